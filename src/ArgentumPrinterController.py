@@ -24,14 +24,27 @@
 
 from PrinterController import PrinterController
 import serial
-import hashlib
 import os
 import time
 import sys
-from imageproc import calcDJB2
-
-order = ['8', '4', 'C', '2', 'A', '6', 'E', '1', '9', '5', 'D', '3', 'B'];
-MAX_FIRING_LINE_LEN = 13*4+12
+import collections
+import threading
+import Queue
+from hexfile import blockTrailers, readHeader, HexFile, PassCounter, BLOCK_SIZE
+from passindex import passIndex
+from serialsession import SessionRecorder, recordedOperation
+from seriallog import SerialLog
+from compression import compress, DECOMPRESSORS, V2_FIRMWARE
+from uploadcache import UploadCache
+from catalog import PrinterCatalog
+from pipeline import CommandPipeline
+from printerstate import PrinterState
+from protocol import Events, splitVersion, bannerComplete
+
+SERIAL_LOG = "serial-log.bin"
+# Opening the port resets the board, which then takes a moment to boot.
+BANNER_TIMEOUT = 5
+MAX_BANNER = 1024
 NO_RESPONSE = "Printer didn't respond. Please ensure no other programs have the port open and try again."
 
 class ArgentumPrinterController(PrinterController):
@@ -47,12 +60,21 @@ class ArgentumPrinterController(PrinterController):
     rightFanOn = False
     printing = False
     sendingFile = False
+    # (filename, passes) for the last job printed: how many of its passes
+    # the printer has finished.
+    lastPass = None
     logSerial = False
     serialLog = None
+    recordSessions = False
+    sessionRecorder = None
 
     def __init__(self, port=None):
         self.port = port
         self.lastCommandTime = None
+        self.uploadCache = UploadCache(self.compress)
+        self.catalog = PrinterCatalog(self)
+        self.state = PrinterState(self)
+        self.unhandled = collections.deque(maxlen=1000)
 
     def clearPrinterNumber(self):
         self.printerNumber = None
@@ -70,40 +92,25 @@ class ArgentumPrinterController(PrinterController):
         self.serialWriteRaw(data)
 
     def serialWriteRaw(self, data):
-        self.logData("write:", data)
+        self.logData('w', data)
         self.serialDevice.write(data)
 
+    def getSerialLog(self):
+        if self.serialLog == None:
+            self.serialLog = SerialLog(SERIAL_LOG)
+        return self.serialLog
+
     def debug(self, msg):
         msg = str(msg)
         print(msg)
         if self.logSerial:
-            if self.serialLog == None:
-                self.serialLog = open("serial.log", "wb")
-            self.serialLog.write(msg + "\n")
-            self.serialLog.flush()
+            self.getSerialLog().add('d', msg)
 
-    def logData(self, msg, data):
+    def logData(self, kind, data):
         if self.logSerial:
-            if self.serialLog == None:
-                self.serialLog = open("serial.log", "wb")
-            str = msg
-            for d in data:
-                if (d >= 'a' and d <= 'z' or
-                    d >= 'A' and d <= 'Z' or
-                    d >= '0' and d <= '9' or
-                    d == '+' or d == '-' or d == ' ' or d == '#' or
-                    d == '[' or d == ']' or d == '.' or d == ',' or
-                    d == '?' or d == '!' or d == ':' or d == '_' or
-                    d == "'"):
-                    str = str + d
-                elif d == '\r':
-                    str = str + "\\r"
-                elif d == '\n':
-                    str = str + "\\n"
-                else:
-                    str = str + "\\x{:02}".format(ord(d))
-            self.serialLog.write(str + "\n")
-            self.serialLog.flush()
+            self.getSerialLog().add(kind, data)
+        if self.sessionRecorder and data:
+            self.sessionRecorder.record(kind, data)
 
     def serialSetTimeout(self, timeout, serialDevice=None):
         if serialDevice == None:
@@ -127,36 +134,26 @@ class ArgentumPrinterController(PrinterController):
             data = serialDevice.read(n)
         else:
             data = self.serialDevice.read(n)
-        self.logData("read:", data)
+        self.logData('r', data)
         return data
 
-    def parseVersion(self, version):
-        if version.find('.') == -1:
-            return
-        major = version[:version.find('.')]
-        version = version[version.find('.')+1:]
-        if version.find('.') == -1:
-            return
-        minor = version[:version.find('.')]
-        version = version[version.find('.')+1:]
-        if version.find('+') == -1:
-            return
-        patch = version[:version.find('+')]
-        build = version[version.find('+')+1:].rstrip()
-        if len(build) != 8:
-            return
+    def startRecordingSession(self, path=None):
+        self.stopRecordingSession()
+        if path == None:
+            path = time.strftime("session-%Y%m%d-%H%M%S.bin")
+        self.sessionRecorder = SessionRecorder(path)
+        self.debug("Recording serial session to " + path)
 
-        tag = None
-        if patch.find('-') != -1:
-            tag = patch[patch.find('-')+1:]
-            patch = patch[:patch.find('-')]
+    def stopRecordingSession(self):
+        if self.sessionRecorder:
+            self.sessionRecorder.close()
+            self.sessionRecorder = None
 
-        try:
-            major = int(major)
-            minor = int(minor)
-            patch = int(patch)
-        except ValueError:
+    def parseVersion(self, version):
+        parsed = splitVersion(version)
+        if parsed == None:
             return
+        (major, minor, patch, tag, build) = parsed
 
         self.version = "{}.{}.{}".format(major, minor, patch)
         if tag:
@@ -182,104 +179,18 @@ class ArgentumPrinterController(PrinterController):
             pass
         return False
 
+    @recordedOperation('connect')
     def connect(self, port=None):
         if port:
             self.port = port
 
         try:
             self.serialDevice = None
-            serialDevice = serial.Serial(self.port, 115200, timeout=0)
-            serialDevice.flushInput()
-            serialDevice.flush()
-            serialDevice.close()
-            serialDevice = serial.Serial(self.port, 115200, timeout=1)
             self.connected = False
-            self.lightsOn = True
-            self.leftFanOn = False
-            self.rightFanOn = False
-
-            self.clearPrinterNumber()
-            self.clearVersion()
-            self.junkBeforeVersion = []
-
-            self.debug("Waiting for printer response.")
-            allResponse = ''
-            firstChar = self.serialRead(1, serialDevice)
-            if firstChar == None:
-                self.debug("No first char.")
-                self.serialSetTimeout(10, serialDevice)
-                firstChar = self.serialRead(1, serialDevice)
-            if firstChar == None or len(firstChar) == 0:
-                self.debug("No response.")
-                self.lastError = NO_RESPONSE
+            serialDevice, allResponse = self.handshake()
+            if serialDevice == None:
                 return False
-            firstCharOrd = ord(firstChar)
-            if firstCharOrd < 9 or firstCharOrd > 126:
-                self.debug("Trying port reset.")
-                if not self.resetPort(serialDevice):
-                    self.debug("Reset port not possible.")
-                    self.lastError = "Port needs reset."
-                    serialDevice.close()
-                    return False
-                serialDevice.close()
-                serialDevice = serial.Serial(self.port, 115200, timeout=1)
-                firstChar = self.serialRead(1, serialDevice)
-                firstCharOrd = ord(firstChar)
-                if firstCharOrd < 9 or firstCharOrd > 126:
-                    self.debug("Reset port failed.")
-                    self.lastError = "Port needs reset."
-                    serialDevice.close()
-                    return False
-                self.debug("Reset port okay!")
-
-            self.debug("Reading rest of response.")
-            allResponse = ''
-            try:
-                while len(allResponse) < 80:
-                    allResponse = allResponse + firstChar
-                    n = serialDevice.inWaiting()
-                    if n != 0:
-                        allResponse = allResponse + self.serialRead(n, serialDevice)
-                    firstChar = self.serialRead(1, serialDevice)
-                    if firstChar == None or len(firstChar) == 0:
-                        break
-            except:
-                pass
-
-            if len(allResponse) < 8:
-                self.debug("Response is too short.")
-                self.lastError = NO_RESPONSE
-                return False
-
-            printerNumber = None
-            version = None
-            pm = '+Printer Number ['
-            if allResponse.find(pm) != -1:
-                if allResponse.find(pm) != 0:
-                    self.junkBeforeVersion = allResponse[:allResponse.find(pm)].split('\n')
-                tmp = allResponse[allResponse.find(pm) + len(pm):]
-                if tmp.find(']') != -1:
-                    printerNumber = tmp[:tmp.find(']')]
-            vm = '+Version ['
-            if allResponse.find(vm) != -1:
-                tmp = allResponse[allResponse.find(vm) + len(vm):]
-                if tmp.find(']') != -1:
-                    version = tmp[:tmp.find(']')]
-
-            if printerNumber:
-                self.printerNumber = printerNumber
-                self.debug("Printer number: " + printerNumber)
-            if version:
-                self.parseVersion(version)
-            else:
-                self.legacyFirmware(allResponse)
-
-            self.debug("Response looks okay.")
-            self.connected = True
-            self.serialDevice = serialDevice
-            self.serialSetTimeout(0)
-            self.debug("Printer looks okay.")
-            return True
+            return self.finishConnect(serialDevice, allResponse)
 
         except serial.SerialException as e:
             self.lastError = str(e)
@@ -287,33 +198,144 @@ class ArgentumPrinterController(PrinterController):
             self.lastError = "Unknown Error: {}".format(e)
             return False
 
-    def legacyFirmware(self, response):
-        self.debug("legacy firmware response: " + response)
-        oYear = response.find("+2014")
-        if oYear == -1:
-            oYear = response.find("+2015")
-        if oYear != -1:
-            sVer = oYear
-            while sVer > 0:
-                sVer = sVer - 1
-                if not (response[sVer] == '.' or
-                        response[sVer] >= '0' and response[sVer] <= '9'):
-                    sVer = sVer + 1
+    @recordedOperation('connect')
+    def connectFirst(self, ports):
+        '''Connects to whichever of ports answers the handshake first.'''
+        self.serialDevice = None
+        self.connected = False
+        probed = probePorts(ports)
+        if probed == None:
+            self.lastError = NO_RESPONSE
+            return False
+        (self.port, serialDevice, allResponse) = probed
+        if self.sessionRecorder:
+            # The probe read the banner, so it goes in the recording here
+            # as if this controller had read it.
+            self.sessionRecorder.record('o')
+            self.sessionRecorder.record('r', allResponse)
+        try:
+            return self.finishConnect(serialDevice, allResponse)
+        except Exception as e:
+            self.lastError = "Unknown Error: {}".format(e)
+            return False
+
+    def handshake(self):
+        '''
+        Opens the port and reads the banner the printer sends when it
+        boots. Returns (serialDevice, banner), or (None, None) with
+        lastError set.
+        '''
+        serialDevice = serial.Serial(self.port, 115200, timeout=1)
+        serialDevice.flushInput()
+        if self.sessionRecorder:
+            self.sessionRecorder.record('o')
+
+        self.debug("Waiting for printer response.")
+        firstChar = self.serialRead(1, serialDevice)
+        if firstChar == None or len(firstChar) == 0:
+            self.debug("No first char.")
+            self.serialSetTimeout(10, serialDevice)
+            firstChar = self.serialRead(1, serialDevice)
+            self.serialSetTimeout(1, serialDevice)
+        if firstChar == None or len(firstChar) == 0:
+            self.debug("No response.")
+            self.lastError = NO_RESPONSE
+            serialDevice.close()
+            return (None, None)
+        firstCharOrd = ord(firstChar)
+        if firstCharOrd < 9 or firstCharOrd > 126:
+            self.debug("Trying port reset.")
+            if not self.resetPort(serialDevice):
+                self.debug("Reset port not possible.")
+                self.lastError = "Port needs reset."
+                serialDevice.close()
+                return (None, None)
+            serialDevice.close()
+            serialDevice = serial.Serial(self.port, 115200, timeout=1)
+            if self.sessionRecorder:
+                self.sessionRecorder.record('o')
+            firstChar = self.serialRead(1, serialDevice)
+            if len(firstChar) == 0 or ord(firstChar) < 9 or ord(firstChar) > 126:
+                self.debug("Reset port failed.")
+                self.lastError = "Port needs reset."
+                serialDevice.close()
+                return (None, None)
+            self.debug("Reset port okay!")
+
+        self.debug("Reading rest of response.")
+        allResponse = self.readBanner(serialDevice, firstChar)
+
+        if len(allResponse) < 8:
+            self.debug("Response is too short.")
+            self.lastError = NO_RESPONSE
+            serialDevice.close()
+            return (None, None)
+        return (serialDevice, allResponse)
+
+    def readBanner(self, serialDevice, response):
+        # Stop as soon as the version line is in rather than waiting for
+        # the port to go quiet.
+        deadline = time.time() + BANNER_TIMEOUT
+        try:
+            while len(response) < MAX_BANNER and time.time() < deadline:
+                if bannerComplete(response):
                     break
-            eVer = oYear
-            while eVer < len(response) - 1:
-                eVer = eVer + 1
-                if not (response[eVer] == '.' or
-                        response[eVer] >= '0' and response[eVer] <= '9'):
+                n = serialDevice.inWaiting()
+                data = self.serialRead(max(n, 1), serialDevice)
+                if data == None or len(data) == 0:
                     break
-            self.parseVersion(response[sVer:eVer])
+                response = response + data
+        except:
+            pass
+        return response
+
+    def finishConnect(self, serialDevice, allResponse):
+        self.lightsOn = True
+        self.leftFanOn = False
+        self.rightFanOn = False
+        self.clearPrinterNumber()
+        self.clearVersion()
+        self.junkBeforeVersion = []
+
+        lines = allResponse.split('\n')
+        events = Events(lines)
+        printerNumber = events.first('pnum')
+        if printerNumber and printerNumber.value:
+            self.junkBeforeVersion = lines[:printerNumber.number]
+            self.printerNumber = printerNumber.value
+            self.debug("Printer number: " + self.printerNumber)
+        version = events.first('version')
+        if version:
+            self.parseVersion(version.value)
+        else:
+            self.legacyFirmware(allResponse, events)
+
+        self.debug("Response looks okay.")
+        self.connected = True
+        self.serialDevice = serialDevice
+        self.serialSetTimeout(0)
+        self.catalog.clear()
+        self.state.clear()
+        self.state.set('pnum', self.printerNumber)
+        self.debug("Printer looks okay.")
+        return True
+
+    def legacyFirmware(self, response, events):
+        self.debug("legacy firmware response: " + response)
+        version = events.first('legacy_version')
+        if version:
+            self.parseVersion(version.value)
 
     def disconnect(self):
         if self.serialDevice:
             self.serialDevice.close()
+            if self.sessionRecorder:
+                self.sessionRecorder.record('c')
         self.serialDevice = None
         self.connected = False
         self.version = None
+        self.catalog.clear()
+        self.state.clear()
 
     def getTimeSinceLastCommand(self):
         if self.lastCommandTime == None:
@@ -350,6 +372,7 @@ class ArgentumPrinterController(PrinterController):
     def calibrate(self):
         self.command('c')
 
+    @recordedOperation('Print', fileArg='path')
     def Print(self, filename, path=None, progressFunc=None):
         if progressFunc == None:
             self.command('p ' + filename)
@@ -359,36 +382,48 @@ class ArgentumPrinterController(PrinterController):
 
         lines = 100
         if path:
-            file = open(path, "r")
-            contents = file.read()
-            file.close()
-            lines = 0
-            for line in contents.split('\n'):
-                if len(line) > 3 and line[0] == 'M' and line[2] == 'X':
-                    lines = lines + 1
+            header = readHeader(path)
+            if header != None and header.passes != None:
+                lines = header.passes
+            else:
+                lines = passIndex(path).count()
             if lines == 0:
                 self.debug("couldn't get number of lines in {}".format(path))
                 self.printing = False
                 return
             self.debug("{} has {} lines.".format(filename, lines))
 
+        complete = False
+        self.lastPass = (filename, 0)
         try:
             self.serialSetTimeout(2*60)
             self.command('p ' + filename)
 
             pos = 0
             Done = False
+            stopped = False
             while not Done:
                 response = self.waitForResponse(timeout=2*60, expect='\n')
                 if response == None:
                     break
                 for line in response:
-                    if line == ".":
+                    if line == "." and not stopped:
                         pos = pos + 1
-                        if not progressFunc(pos, lines):
-                            Done = True
-                            break
+                        self.lastPass = (filename, pos)
+                        pres = progressFunc(pos, lines)
+                        if pres == "Pause":
+                            self.pause()
+                            while pres == "Pause":
+                                time.sleep(0.5)
+                                pres = progressFunc(pos, lines)
+                            if pres:
+                                self.resume()
+                        if not pres:
+                            # Wait for the printer to say it stopped.
+                            self.stop()
+                            stopped = True
                     if line.find("Print complete") != -1:
+                        complete = not stopped
                         Done = True
                         break
                     if line.find("Stopping") != -1:
@@ -397,14 +432,11 @@ class ArgentumPrinterController(PrinterController):
         finally:
             self.serialSetTimeout(0)
             self.printing = False
+        return complete
 
 
     def isHomed(self):
-        response = self.command('lim', 1)
-        for resp in response:
-            if resp == "+Limits: X- Y- ":
-                return True
-        return False
+        return self.state.query('limits') == "X- Y-"
 
     def fire(self, address, primitive):
         self.debug('[APC] Firing Command - {} - {}'.format(address, primitive))
@@ -481,78 +513,102 @@ class ArgentumPrinterController(PrinterController):
             resp_list.append(resp)
         return resp_list
 
+    def request(self, command, timeout=1, expect='\n'):
+        '''Sends command and returns the Events in its response, or None.'''
+        response = self.command(command, timeout=timeout, expect=expect)
+        if response == None:
+            return None
+        events = Events(response)
+        for line in events.unknown:
+            if line != command:
+                self.unhandled.append(line)
+        self.state.apply(events)
+        return events
+
     def missingFiles(self, files):
-        response = self.command("ls", timeout=2)
-        missing = []
-        for filename in files:
-            found = False
-            for resp in response:
-                if resp.lower() == ("+" + filename).lower():
-                    found = True
-                    break
-            if not found:
-                missing.append(filename)
-        return missing
+        return self.catalog.missing(files)
 
     def checkMd5(self, filename):
-        file = open(filename, 'r')
-        contents = file.read()
-        file.close()
-        m = hashlib.md5()
-        m.update(contents)
-        md5 = m.hexdigest()
+        md5 = self.catalog.localMd5(filename)
         response = self.command("md5 {}".format(os.path.basename(filename)), timeout=10, expect='\n')
+        if response == None:
+            return False
         for line in response:
             if line == md5:
                 return True
         return False
 
     def checkDJB2(self, path):
-        file = open(path, 'r')
-        contents = file.read()
-        file.close()
-
-        if contents[0] == '#' and contents[1] == ' ' and contents[10] == '\n':
-            djb2 = contents[2:10]
-        else:
-            hash = calcDJB2(contents)
-            djb2 = "{:08x}".format(hash)
+        djb2 = self.catalog.localDJB2(path)
 
         filename = os.path.basename(path)
         self.debug("asking printer for {} with djb2 {}.".format(filename, djb2))
 
         response = self.command("djb2 {}".format(filename), timeout=30, expect='\n')
+        if response == None:
+            return False
         for line in response:
             if len(line) == 8:
                 self.debug("printer has " + line)
+                self.catalog.update(filename, line)
             if line == djb2:
                 return True
         return False
 
+    def storeJob(self, path, progressFunc=None):
+        '''
+        Makes sure the printer has the file in storage, uploading it if the
+        printer's copy is missing or different, so that it can be printed
+        any number of times with Print(). Returns False when the file can't
+        be stored, for example when the printer is out of space, and it
+        should be sent with printOnline instead.
+        '''
+        return self.storeJobs([path], progressFunc)[path]
+
+    def storeJobs(self, paths, progressFunc=None):
+        if self.version == None:
+            return dict([(path, False) for path in paths])
+        return self.catalog.sync(paths, progressFunc)
+
+    @recordedOperation('send', fileArg='path')
     def send(self, path, progressFunc=None, printOnline=False):
+        # Only the job is uploaded, so the printer's djb2 is the header's.
+        # The body is a view of the mapped file, blocks are copied as sent.
+        # The mapping is closed before returning, as Windows won't let a
+        # mapped file be sliced again or deleted.
+        with HexFile(path) as hexFile:
+            return self.sendContents(path, hexFile.body(), progressFunc, printOnline)
+
+    def sendContents(self, path, contents, progressFunc=None, printOnline=False):
         self.sendingFile = True
-        file = open(path, 'r')
-        contents = file.read()
-        file.close()
-
         filename = os.path.basename(path)
 
         start = time.time()
 
         size = len(contents)
-        compressed = self.compress(contents)
+        version = self.compressionVersion()
+        artifact = self.uploadCache.artifact(path, contents, version)
+        if artifact.contents == None and version > 1:
+            artifact = self.uploadCache.artifact(path, contents, 1)
+        trailers = None
+        decoder = None
         if printOnline:
             cmd = "recv {} o {}"
         else:
             cmd = "recv {} {}"
-        if compressed and (printOnline or len(compressed) * 3 < size):
-            self.debug("compression rate {} to 1".format(float(size) / len(compressed)))
-            size = len(compressed)
-            contents = compressed
+        if artifact.contents and (printOnline or artifact.size() * 3 < size):
+            self.debug("compression rate {} to 1".format(float(size) / artifact.size()))
+            size = artifact.size()
+            contents = artifact.contents
+            trailers = artifact.trailers
+            mode = 'b' if artifact.version == 1 else str(artifact.version)
+            decoder = DECOMPRESSORS[artifact.version]()
             if printOnline:
-                cmd = "recv {} bo {}"
+                cmd = "recv {} " + mode + "o {}"
             else:
-                cmd = "recv {} b {}"
+                cmd = "recv {} " + mode + " {}"
+        if trailers == None:
+            trailers = blockTrailers(contents)
         self.serialDevice.flushInput()
         self.serialDevice.flush()
         response = self.command(cmd.format(size, filename), timeout=10, expect='\n')
@@ -575,8 +631,18 @@ class ArgentumPrinterController(PrinterController):
         canceled = False
         paused = False
 
+        # An online print runs as the blocks arrive, but the printer says G
+        # when it has a block, not when it has printed it, and it has no
+        # pass reports during an upload. Assuming it holds no more than one
+        # block ahead of the head, only passes ending before the latest
+        # acknowledged block are counted as printed, so a resumed print may
+        # repeat a pass but never skips one.
+        passes = None
+        if printOnline:
+            passes = PassCounter(decoder)
+            self.lastPass = (filename, 0)
+
         try:
-            hash = 5381
             fails = 0
             pos = 0
             while (pos < size):
@@ -602,23 +668,8 @@ class ArgentumPrinterController(PrinterController):
                             break
                         continue
                 nleft = size - pos
-                blocksize = nleft if nleft < 1024 else 1024
-                block = contents[pos:pos+blocksize]
-                encblock = ""
-                oldhash = hash
-                for c in block:
-                    encblock = encblock + c
-                    cval = ord(c)
-                    if cval >= 128:
-                        cval = -(256 - cval)
-                    hash = hash * 33 + cval
-                    hash = hash & 0xffffffff
-                encblock = encblock + chr( hash        & 0x7f)
-                encblock = encblock + chr((hash >>  7) & 0x7f)
-                encblock = encblock + chr((hash >> 14) & 0x7f)
-                encblock = encblock + chr((hash >> 21) & 0x7f)
-                encblock = encblock + chr((hash >> 28) & 0x0f)
-                self.serialWriteRaw(encblock)
+                blocksize = nleft if nleft < BLOCK_SIZE else BLOCK_SIZE
+                self.serialWriteRaw(contents[pos:pos+blocksize] + trailers[pos // BLOCK_SIZE])
 
                 done = False
                 cmd = None
@@ -631,7 +682,6 @@ class ArgentumPrinterController(PrinterController):
                             continue
 
                     if cmd == "B":
-                        hash = oldhash
                         fails = fails + 1
                         if fails > 12:
                             self.debug("Too many failures.")
@@ -642,6 +692,9 @@ class ArgentumPrinterController(PrinterController):
                         done = True
                         cmd = None
                     elif cmd == "G":
+                        if passes != None:
+                            self.lastPass = (filename, passes.passes)
+                            passes.feed(contents[pos:pos+blocksize])
                         pos = pos + blocksize
                         if progressFunc:
                             pres = progressFunc(pos, size)
@@ -684,126 +737,52 @@ class ArgentumPrinterController(PrinterController):
             end = time.time()
 
             self.debug("Sent in {} seconds.".format(end - start))
+            if not printOnline:
+                self.catalog.added(filename)
         finally:
             self.sendingFile = False
 
         return True
 
-    def compress(self, contents):
-        compressed = []
-        lastFiringLine = None
-        lastFiring = None
-        lastParts = []
-        firings = []
-        for line in contents.split('\n'):
-            if len(line) == 0:
-                continue
-            if line[0] == '#':
-                compressed.append(line)
-                continue
-
-            if line[0] == 'M':
-                if len(firings) > 0:
-
-                    if len(firings) != len(order):
-                        self.debug("firing order changed!")
-                        return None
-                    firingLine = None
-                    for i in range(len(firings)):
-                        if firings[i][0] != order[i]:
-                            self.debug("firing order changed!")
-                            return None
-                        if firingLine:
-                            if firingLine == ".":
-                                firingLine = "," + firings[i][1:]
-                            else:
-                                firingLine = firingLine + "," + firings[i][1:]
-                        else:
-                            firingLine = firings[i][1:]
-                            if firingLine == None or firingLine == "":
-                                firingLine = "."
-                    if lastFiringLine and firingLine == lastFiringLine:
-                        compressed.append('d')
-                    else:
-                        compressed.append(firingLine)
-                    lastFiringLine = firingLine
-                    if len(firingLine) > MAX_FIRING_LINE_LEN:
-                        self.debug("firing line too long.")
-                        return None
-                    firings = []
-                if line[2:3] == 'X':
-                    compressed.append(line[2:3] + line[4:])
-                else:
-                    compressed.append(line[4:])
-            elif line[0] == 'F':
-                firing = line[2:]
-                if lastFiring and firing[1:] == lastFiring[1:]:
-                    firing = firing[0:1]
-                else:
-                    lastFiring = firing
-                    part = None
-                    if firing[1:] == "0000":
-                        firing = firing[0:1] + 'z'
-                    elif firing[1:3] == "00":
-                        part = firing[3:5]
-                        firing = firing[0:1] + 'z'
-                    elif firing[3:5] == "00":
-                        part = firing[1:3]
-                        firing = firing[0:1]
-                    if part:
-                        if part in lastParts:
-                            firing = firing + chr(ord('a') + lastParts.index(part))
-                        else:
-                            lastParts.append(part)
-                            if len(lastParts) > 25:
-                                lastParts.pop(0)
-                            firing = firing + part
-                firings.append(firing)
-            else:
-                self.debug("what's this? {}".format(line))
-                return None
-
-        return '\n'.join(compressed) + "\n"
+    def compressionVersion(self):
+        if self.version == None:
+            return 1
+        if (self.majorVersion, self.minorVersion) >= V2_FIRMWARE:
+            return 2
+        return 1
+
+    def compress(self, contents, version=1):
+        compressed, compressor = compress(contents, version)
+        if compressed == None:
+            self.debug(compressor.reason)
+            return None
+        self.debug("compressed {} bytes to {}, {} of {} columns repeated".format(
+            compressor.bytesIn, compressor.bytesOut, compressor.repeats, compressor.groups))
+        return compressed
 
     def volt(self):
-        response = self.command("volt", expect='\n', timeout=1)
-        if response:
-            for line in response:
-                if line.find(':') != -1 and line.find('volts.') != -1:
-                    return float(line[line.find(': ') + 2:line.find(' volts')])
-        return 0
+        events = self.request("volt")
+        if events == None or events.first('volts') == None:
+            return 0
+        return events.first('volts').value
 
     def getOptions(self):
-        response = self.command("?eeprom", expect=']', timeout=1)
-        if response == None:
-            return None
-        response = ''.join(response)
-        if response.find('horizontal_offset:') == -1:
-            return None
-        if response.find('vertical_offset:') == -1:
-            return None
-        if response.find('print_overlap:') == -1:
+        events = self.request("?eeprom", expect=']')
+        if events == None or events.first('crc') == None:
             return None
-        if response.find('CRC:') == -1:
+        options = dict(event.values for event in events.all('option'))
+        if len(options) != 3:
             return None
-        value1 = response[response.find('horizontal_offset:') + 19:]
-        value1 = value1[:value1.find('vertical_offset:')]
-        value2 = response[response.find('vertical_offset:') + 17:]
-        value2 = value2[:value2.find('print_overlap:')]
-        value3 = response[response.find('print_overlap:') + 15:]
-        ePos = 0
-        while value3[ePos] >= '0' and value3[ePos] <= '9':
-            ePos = ePos + 1
-        value3 = value3[:ePos]
-        return {'horizontal_offset': int(value1),
-                'vertical_offset': int(value2),
-                'print_overlap': int(value3)}
+        return options
 
     def updateOptions(self, options):
         horizontal_offset = options['horizontal_offset']
         vertical_offset = options['vertical_offset']
         print_overlap = options['print_overlap']
         self.command("!write po {} {} {}".format(horizontal_offset, vertical_offset, print_overlap))
+        self.state.set('options', {'horizontal_offset': horizontal_offset,
+                                   'vertical_offset': vertical_offset,
+                                   'print_overlap': print_overlap})
 
     def getPosition(self):
         if not self.connected:
@@ -814,38 +793,14 @@ class ArgentumPrinterController(PrinterController):
             return None
         if self.printing or self.sendingFile:
             return None
-        response = self.command("pos", timeout=0.1)
-        if response == None:
-            return None
-        response = ''.join(response)
-
-        if response.find('+X:') == -1:
+        events = self.request("pos", timeout=0.1, expect='steps')
+        if events == None:
             return None
-        response = response[response.find('+X: ') + 4:]
-        if response.find(' mm') == -1:
+        mm = events.first('pos_mm')
+        steps = events.first('pos_steps')
+        if mm == None or steps == None:
             return None
-        xmm = float(response[:response.find(' mm')])
-        if response.find(', Y:') == -1:
-            return None
-        response = response[response.find(', Y: ') + 5:]
-        if response.find(' mm') == -1:
-            return None
-        ymm = float(response[:response.find(' mm')])
-
-        if response.find('+X:') == -1:
-            return None
-        response = response[response.find('+X: ') + 4:]
-        if response.find(' steps') == -1:
-            return None
-        xsteps = int(response[:response.find(' steps')])
-        if response.find(', Y:') == -1:
-            return None
-        response = response[response.find(', Y: ') + 5:]
-        if response.find(' steps') == -1:
-            return None
-        ysteps = int(response[:response.find(' steps')])
-
-        return (xmm, ymm, xsteps, ysteps)
+        return mm.values + steps.values
 
     def turnLightsOn(self):
         if self.printing or self.sendingFile:
@@ -884,19 +839,14 @@ class ArgentumPrinterController(PrinterController):
         self.rightFanOn = False
 
     def getPrinterNumber(self):
-        response = self.command("pnum", expect=']', timeout=1)
-        if response == None:
+        events = self.request("pnum", expect=']')
+        if events == None or events.first('pnum') == None:
             return None
-        allResponse = ''.join(response)
-        pm = '+Printer Number ['
-        if allResponse.find(pm) == -1:
-            return None
-        pnum = allResponse[allResponse.find(pm) + len(pm):]
-        pnum = pnum[:pnum.find(']')]
-        return pnum
+        return events.first('pnum').value
 
     def setPrinterNumber(self, pnum):
         self.printerNumber = pnum
+        self.state.set('pnum', pnum)
         self.command("pnum {}".format(pnum))
 
     def moveTo(self, x, y, withOk=False):
@@ -905,8 +855,49 @@ class ArgentumPrinterController(PrinterController):
         else:
             self.command("M {} {}".format(int(x), int(y)))
 
+    def pipeline(self, depth=2, control=None):
+        return CommandPipeline(self, depth, control)
+
     def turnMotorsOn(self):
         self.command('+')
 
     def turnMotorsOff(self):
         self.command('-')
+
+def probePorts(ports):
+    '''
+    Handshakes with all ports at once. Returns (port, serialDevice,
+    banner) for the first printer to answer, or None. The other ports are
+    closed as their handshakes finish.
+    '''
+    results = Queue.Queue()
+    def probe(port):
+        serialDevice, banner = (None, None)
+        try:
+            serialDevice, banner = ArgentumPrinterController(port).handshake()
+        except Exception:
+            pass
+        results.put((port, serialDevice, banner))
+    for port in ports:
+        thread = threading.Thread(target=probe, args=(port,))
+        thread.daemon = True
+        thread.start()
+
+    winner = None
+    remaining = len(ports)
+    while winner == None and remaining > 0:
+        result = results.get()
+        remaining = remaining - 1
+        if result[1] != None:
+            winner = result
+
+    def closeRest(remaining):
+        for n in range(remaining):
+            port, serialDevice, banner = results.get()
+            if serialDevice != None:
+                serialDevice.close()
+    if remaining > 0:
+        thread = threading.Thread(target=closeRest, args=(remaining,))
+        thread.daemon = True
+        thread.start()
+    return winner
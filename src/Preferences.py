@@ -69,6 +69,10 @@ class PreferencesDialog(QtGui.QDialog):
         self.logSerial.setChecked(False)
         mainLayout.addWidget(self.logSerial)
 
+        self.recordSession = QtGui.QCheckBox("Record serial sessions for replay")
+        self.recordSession.setChecked(False)
+        mainLayout.addWidget(self.recordSession)
+
         layout = QtGui.QHBoxLayout()
         cancelButton = QtGui.QPushButton("Cancel")
         cancelButton.clicked.connect(self.reject)
@@ -105,6 +109,7 @@ class PreferencesDialog(QtGui.QDialog):
         self.read_setting("lights_always_on", self.lightsAlwaysOn)
         self.read_setting("motors_start_off", self.motorsStartOff)
         self.read_setting("log_serial", self.logSerial)
+        self.read_setting("record_session", self.recordSession)
 
     def save(self):
         self.write_setting("autoconnect", self.autoConnect)
@@ -116,6 +121,7 @@ class PreferencesDialog(QtGui.QDialog):
         self.write_setting("lights_always_on", self.lightsAlwaysOn)
         self.write_setting("motors_start_off", self.motorsStartOff)
         self.write_setting("log_serial", self.logSerial)
+        self.write_setting("record_session", self.recordSession)
         self.argentum.updateOptions(self.options)
         self.accept()
 
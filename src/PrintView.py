@@ -32,14 +32,23 @@ from gerber import Gerber
 import requests
 from setup import VERSION, BASEVERSION, CA_CERTS
 import tempfile
-
-printPlateDesignScale = [1.0757, 1.2256] # * printArea
-imageScale            = [ 23.70,  23.70] # * print = pixels
+from checkpoint import PrintCheckpoint
+from printloop import PrintLoop, PrintLoopError, OutsideLimitsError
+from passindex import passIndex
+from hexfile import readHeader
+# Imported hex files are previewed with NumPy when it's installed.
+try:
+    from hexpreview import renderHex
+except ImportError:
+    renderHex = None
+from layoutfile import (printPlateDesignScale, imageScale, hexFilenameFor,
+                        readLayout, writeLayout, printAreaToMove, dryingMoves)
 
 class PrintView(QtGui.QWidget):
     layout = None
     layoutChanged = False
     printThread = None
+    checkpoint = None
     dragging = None
     resizing = None
     selection = None
@@ -184,7 +193,8 @@ class PrintView(QtGui.QWidget):
 
         try:
             printer = self.argentum.printer
-            printer.command("l E", expect='rollers')
+            pipeline = printer.pipeline(control=self.pipelineControl)
+            pipeline.command("l E", expect=None)
 
             for image in self.images:
                 if image == self.printHeadImage:
@@ -193,28 +203,15 @@ class PrintView(QtGui.QWidget):
                     continue
                 print("Jacket drying.")
                 self.setProgress(labelText="Drying " + image.hexFilename)
-                pos = self.printAreaToMove(image.left + image.width - 60, image.bottom + 30)
-                x = pos[0]
-                y = pos[1]
-                sy = y
-                while y - sy < image.height * 80:
-                    while self.progress.paused:
-                        time.sleep(0.5)
-                    printer.moveTo(x, y, withOk=True)
-                    printer.waitForResponse(timeout=10, expect='Ok')
-                    printer.command("l d", expect='rollers')
-                    time.sleep(1.5)
-                    left = x - int(image.width * 1.5) * 80
-                    if left < 0:
-                        left = 0
-                    while self.progress.paused:
-                        time.sleep(0.5)
-                    printer.moveTo(left, y, withOk=True)
-                    printer.waitForResponse(timeout=10, expect='Ok')
-                    printer.command("l r", expect='rollers')
-                    time.sleep(1.5)
-                    y = y + 30 * 80
-
+                for x, y, left in dryingMoves(image):
+                    pipeline.moveTo(x, y)
+                    pipeline.command("l d", expect=None)
+                    pipeline.dwell(1.5)
+                    pipeline.moveTo(left, y)
+                    pipeline.command("l r", expect=None)
+                    pipeline.dwell(1.5)
+
+            pipeline.finish()
             printer.command("l e", expect='rollers')
         finally:
             if self.printThread.dryingOnly:
@@ -321,13 +318,7 @@ class PrintView(QtGui.QWidget):
         return self.printToScreen(p)
 
     def printAreaToMove(self, offsetX, offsetY):
-        fudgeX = -80
-        fudgeY = -560
-        x = offsetX * 80 + fudgeX
-        y = offsetY * 80 + fudgeY
-        x = int(x)
-        y = int(y)
-        return (x, y)
+        return printAreaToMove(offsetX, offsetY)
 
     def screenToPrintArea(self, x, y):
         r = self.printToScreen(self.printArea)
@@ -452,29 +443,28 @@ class PrintView(QtGui.QWidget):
         return pixmap
 
     def pixmapFromHexFile(self, inputFileName):
-        f = open(inputFileName)
-        lines = f.read().split('\n')
-        f.close()
-        width = 800
-        height = 0
-        theight = 0
-        for line in lines:
-            if line.startswith('M Y -'):
-                h = int(line[5:])
-                if h > height:
-                    height = h
-            elif line.startswith('M X -'):
-                w = int(line[5:])
-                width += w
-            elif line.startswith('M Y'):
-                theight += int(line[4:])
-        print("height={} theight={}".format(height, theight))
-        if height == 0:
-            height = theight
+        header = readHeader(inputFileName)
+        if header != None and header.width != None:
+            # Sliced with a header, which knows the size of the image.
+            width = header.width
+            height = header.height
         else:
-            height -= (104 * 2) * 4 # blank lines
+            index = passIndex(inputFileName)
+            width, height = index.extent()
+            width += 800
+            print("height={} passes={}".format(height, index.count()))
+            if index.end[1] < height:
+                # The head returns after each pass, past the blank lines.
+                height -= (104 * 2) * 4 # blank lines
+            width = width / 4
+            height = height / 4
         print("{}x{}".format(width, height))
-        image = QtGui.QImage(width / 4, height / 4, QtGui.QImage.Format_RGB32)
+        if renderHex != None:
+            try:
+                return self.renderedHexPixmap(inputFileName, width, height)
+            except Exception as e:
+                print("Can't render {}: {}".format(inputFileName, e))
+        image = QtGui.QImage(width, height, QtGui.QImage.Format_RGB32)
         image.fill(0xffffff)
         p = QtGui.QPainter()
         p.begin(image)
@@ -486,6 +476,16 @@ class PrintView(QtGui.QWidget):
         p.end()
         return QtGui.QPixmap.fromImage(image)
 
+    def renderedHexPixmap(self, inputFileName, width, height):
+        '''A picture of what the hex file prints, at width x height.'''
+        pixels = renderHex(inputFileName).copy()
+        image = QtGui.QImage(pixels.data, pixels.shape[1], pixels.shape[0],
+                             pixels.strides[0], QtGui.QImage.Format_Indexed8)
+        image.setColorTable([QtGui.qRgb(i, i, i) for i in range(256)])
+        # The QImage doesn't own pixels, so copy it before they go.
+        image = image.copy().scaled(width, height)
+        return QtGui.QPixmap.fromImage(image)
+
     def pixmapFromFilename(self, inputFileName):
         if inputFileName.endswith(".hex"):
             pixmap = self.pixmapFromHexFile(inputFileName)
@@ -549,6 +549,13 @@ class PrintView(QtGui.QWidget):
         self.setProgress(percent=percent)
         return True
 
+    def pipelineControl(self):
+        if self.printCanceled:
+            return False
+        if self.progress.paused:
+            return "Pause"
+        return True
+
     def sendProgress(self, pos, size):
         if self.printPaused:
             return "Pause"
@@ -679,7 +686,17 @@ class PrintView(QtGui.QWidget):
         self.printCross(x+10, y+20)
         self.setProgress(percent=100)
 
-    def startPrint(self):
+    def printableImages(self):
+        images = []
+        for image in self.images:
+            if image == self.printHeadImage:
+                continue
+            if not image.visible:
+                continue
+            images.append(image)
+        return images
+
+    def startPrint(self, resume=False):
         if len(self.images) == 1:
             QtGui.QMessageBox.information(self,
                         "Nothing to print",
@@ -691,9 +708,27 @@ class PrintView(QtGui.QWidget):
             print("Already printing!")
             return
 
-        options = PrintOptionsDialog(self)
-        if options.exec_() == options.Rejected:
-            return
+        if resume:
+            checkpoint = self.checkpoint
+            if checkpoint == None:
+                QtGui.QMessageBox.information(self,
+                            "Nothing to resume",
+                            "There is no interrupted print to resume.")
+                return
+            if not checkpoint.matches(self.printableImages()):
+                QtGui.QMessageBox.information(self,
+                            "Can't resume print",
+                            "The layout has changed since the print stopped. Print it again from the start.")
+                return
+        else:
+            options = PrintOptionsDialog(self)
+            if options.exec_() == options.Rejected:
+                return
+            checkpoint = PrintCheckpoint(self.printableImages(),
+                                         options.getPasses(),
+                                         options.getUseRollers(),
+                                         options.getAlsoPause())
+        self.checkpoint = checkpoint
 
         self.printCanceled = False
         self.progress = PrintProgressDialog(self)
@@ -703,9 +738,10 @@ class PrintView(QtGui.QWidget):
         self.progress.show()
 
         self.printThread = threading.Thread(target=self.printLoop)
-        self.printThread.passes = options.getPasses()
-        self.printThread.useRollers = options.getUseRollers()
-        self.printThread.alsoPause = options.getAlsoPause()
+        self.printThread.passes = checkpoint.passes
+        self.printThread.useRollers = checkpoint.useRollers
+        self.printThread.alsoPause = checkpoint.alsoPause
+        self.printThread.checkpoint = checkpoint
         self.printThread.dryingOnly = False
         self.printThread.start()
 
@@ -741,90 +777,28 @@ class PrintView(QtGui.QWidget):
                 self.setProgress(labelText="Printer firmware too old.", statusText="Print aborted. Printer firmware needs upgrade.", canceled=True)
                 return
 
-            self.argentum.printer.monitorEnabled = False
-
-            volts = self.argentum.printer.volt()
-            if volts < 5:
-                self.setProgress(labelText="Please turn on your printer.")
-                while volts < 5:
-                    volts = self.argentum.printer.volt()
-
-            self.setProgress(percent=20, labelText="Starting print.")
-
-            self.argentum.printer.turnLightsOn()
-            self.argentum.printer.command("l E", expect='rollers')
-            self.argentum.printer.command("l r", expect='rollers')
-            time.sleep(1.5)
-            self.argentum.printer.command("l e", expect='rollers')
-            self.argentum.printer.turnMotorsOn()
-            self.argentum.setSpeed()
-            self.argentum.printer.home(wait=True)
-
-            # Now we can actually print!
-            printingStart = time.time()
-            for i in range(0, self.printThread.passes):
-                self.setProgress(percent=20, labelText="Starting pass {}".format(i+1))
-                self.perImage = 79.0 / (len(self.images) - 1)
-                nImage = 0
-                for image in self.images:
-                    if image == self.printHeadImage:
-                        continue
-                    if not image.visible:
-                        continue
-                    while self.progress.paused:
-                        time.sleep(0.5)
-                        if self.printCanceled:
-                            raise PrintCanceledException()
-                    pos = self.printAreaToMove(image.left + image.width, image.bottom)
-                    if image.filename.endswith(".hex"):
-                        pos = (pos[0] - 15 * 80, pos[1] + 560 + 25 * 80)
-                    self.argentum.printer.moveTo(pos[0], pos[1], withOk=True)
-                    response = self.argentum.printer.waitForResponse(timeout=10, expect='Ok')
-                    if response:
-                        response = ''.join(response)
-                        if response.find('/') != -1:
-                            self.setProgress(statusText="Print error - ensure images are within print limits.", canceled=True)
-                            return
-                    self.setProgress(labelText="Pass {}: {}".format(i + 1, image.hexFilename))
-                    path = os.path.join(self.argentum.filesDir, image.hexFilename)
-                    while self.progress.paused:
-                        time.sleep(0.5)
-                        if self.printCanceled:
-                            raise PrintCanceledException()
-                    if not self.argentum.printer.send(path, progressFunc=self.sendProgress, printOnline=True):
-                        self.setProgress(labelText="Printer error.", canceled=True)
-                        return
-                    nImage = nImage + 1
-                    self.setProgress(percent=(20 + self.perImage * nImage))
-
-                    printingEnd = time.time()
-                    print("printed in {} s".format(printingEnd - printingStart))
-                    self.argentum.addTimeSpentPrinting(printingEnd - printingStart)
-                    printingStart = time.time()
-
-                if self.printThread.useRollers:
-                    self.dryingLoop()
-
-                if self.printThread.alsoPause:
-                    self.setProgress(labelText="Pausing before next pass.")
-                    if not self.progress.paused:
-                        self.progress.pause()
-                    self.argentum.printer.moveTo(100, 100, withOk=True)
-                    self.argentum.printer.waitForResponse(timeout=10, expect='Ok')
-                    while self.progress.paused:
-                        time.sleep(0.5)
-                        if self.printCanceled:
-                            raise PrintCanceledException()
-
-                printingEnd = time.time()
-                self.argentum.addTimeSpentPrinting(printingEnd - printingStart)
-                printingStart = time.time()
-
-            self.argentum.printer.home()
+            # Now we can actually print! The checkpoint skips whatever an
+            # interrupted print of this layout already finished.
+            images = self.printableImages()
+            paths = [os.path.join(self.argentum.filesDir, image.hexFilename)
+                     for image in images]
+            self.printingStart = time.time()
+            loop = PrintViewLoop(self, images, paths, self.printThread.checkpoint)
+            try:
+                if not loop.run():
+                    return
+            except OutsideLimitsError:
+                self.setProgress(statusText="Print error - ensure images are within print limits.", canceled=True)
+                return
+            except PrintLoopError as e:
+                self.setProgress(labelText=str(e), statusText="Print aborted.", canceled=True)
+                return
+
             self.setProgress(statusText='Print complete.', percent=100)
+            self.checkpoint = None
 
             printingEnd = time.time()
-            self.argentum.addTimeSpentPrinting(printingEnd - printingStart)
+            self.argentum.addTimeSpentPrinting(printingEnd - self.printingStart)
 
         except PrintCanceledException:
             pass
@@ -1451,49 +1425,15 @@ class PrintView(QtGui.QWidget):
         if filename == None:
             return
 
-        file = open(filename, "r")
-        lines = file.read().split('\n')
-        file.close()
-
-        layoutPath = os.path.dirname(filename)
-        bImageSection = False
         image = None
-        for line in lines:
-            if len(line) == 0:
-                continue
-            if line[0] == '#':
-                continue
-            if line[0] == '[':
-                bImageSection = False
-                if line == '[image]':
-                    bImageSection = True
-                continue
-            if line.find('=') == -1:
-                # What is this?
-                continue
-
-            key = line[0:line.find('=')]
-            value = line[line.find('=')+1:]
-
-            if bImageSection:
-                if key == "filename":
-                    if image:
-                        self.ensureImageInPrintLims(image)
-                    filename = value
-                    if not os.path.isabs(filename):
-                        filename = os.path.join(layoutPath, filename)
-                    image = self.addImageFile(filename)
-                if image:
-                    if key == "left":
-                        image.left = float(value)
-                    if key == "bottom":
-                        image.bottom = float(value)
-                    if key == "width":
-                        image.width = float(value)
-                    if key == "height":
-                        image.height = float(value)
-                    if key == "lastResized":
-                        image.lastResized = float(value)
+        for entry in readLayout(filename):
+            if image:
+                self.ensureImageInPrintLims(image)
+            image = self.addImageFile(entry.filename)
+            if image:
+                for key in ["left", "bottom", "width", "height", "lastResized"]:
+                    if getattr(entry, key) != None:
+                        setattr(image, key, getattr(entry, key))
         if image:
             self.ensureImageInPrintLims(image)
 
@@ -1514,25 +1454,8 @@ class PrintView(QtGui.QWidget):
         # TODO we really need to create an archive of the control file
         #      and all the images used
         #
-        # XXX Saves full pathnames. :(
-        file = open(filename, "w")
-        layoutPath = os.path.dirname(filename)
-        for image in self.images:
-            if image == self.printHeadImage:
-                continue
-            file.write('[image]\n')
-            path = os.path.relpath(image.filename, layoutPath)
-            if path.find('..') != -1:
-                path = image.filename
-            file.write('filename={}\n'.format(path))
-            file.write('left={}\n'.format(image.left))
-            file.write('bottom={}\n'.format(image.bottom))
-            file.write('width={}\n'.format(image.width))
-            file.write('height={}\n'.format(image.height))
-            if image.lastResized:
-                file.write('lastResized={}\n'.format(image.lastResized))
-            file.write('\n')
-        file.close()
+        writeLayout(filename, [image for image in self.images
+                               if image != self.printHeadImage])
 
         self.layout = filename
         self.layoutChanged = False
@@ -1626,10 +1549,7 @@ class PrintImage(PrintRect):
         self.screenRect = None
         self.visible = True
 
-        filename = os.path.basename(filename)
-        if filename.find('.') != -1:
-            filename = filename[:filename.find('.')]
-        self.hexFilename = filename + ".hex"
+        self.hexFilename = hexFilenameFor(filename)
 
     def pixmapRect(self):
         return QtCore.QRectF(self.pixmap.rect())
@@ -1637,6 +1557,60 @@ class PrintImage(PrintRect):
 class PrintCanceledException(Exception):
     pass
 
+class PrintViewLoop(PrintLoop):
+    '''The print loop, reporting to the print view's progress dialog.'''
+
+    def __init__(self, view, images, paths, checkpoint):
+        PrintLoop.__init__(self, view.argentum.printer, images, paths, checkpoint)
+        self.view = view
+
+    def canceled(self):
+        return self.view.printCanceled
+
+    def message(self, text):
+        self.view.setProgress(labelText=text)
+
+    def progressFunc(self, pos, size):
+        return self.view.sendProgress(pos, size)
+
+    def waitIfPaused(self):
+        while self.view.progress.paused:
+            time.sleep(0.5)
+            if self.view.printCanceled:
+                raise PrintCanceledException()
+
+    def setSpeed(self):
+        self.view.argentum.setSpeed()
+
+    def passStarted(self, layoutPass):
+        view = self.view
+        view.perImage = 79.0 / len(self.images)
+        view.setProgress(percent=20, labelText="Starting pass {}".format(layoutPass + 1))
+
+    def imagePrinted(self, layoutPass, image):
+        view = self.view
+        view.setProgress(percent=(20 + view.perImage * (image + 1)))
+        printingEnd = time.time()
+        print("printed in {} s".format(printingEnd - view.printingStart))
+        view.argentum.addTimeSpentPrinting(printingEnd - view.printingStart)
+        view.printingStart = time.time()
+
+    def dry(self):
+        self.view.dryingLoop()
+
+    def passPrinted(self, layoutPass, pipeline):
+        view = self.view
+        if view.printThread.alsoPause:
+            view.setProgress(labelText="Pausing before next pass.")
+            if not view.progress.paused:
+                view.progress.pause()
+            pipeline.moveTo(100, 100).wait(10)
+            self.waitIfPaused()
+
+        printingEnd = time.time()
+        view.argentum.addTimeSpentPrinting(printingEnd - view.printingStart)
+        view.printingStart = time.time()
+
 class PrintOptionsDialog(QtGui.QDialog):
     def __init__(self, parent=None):
         QtGui.QWidget.__init__(self, parent)
@@ -0,0 +1,223 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+    Argentum Control GUI
+
+    Copyright (C) 2013 Isabella Stevens
+    Copyright (C) 2014 Michael Shiel
+    Copyright (C) 2015 Trent Waddington
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+# Measures end-to-end connect, upload and print throughput through the real
+# ArgentumPrinterController talking to a VirtualPrinter over a pty.
+#
+#   python benchmark.py [--baud 115200] [--latency 0] [--error-rate 0]
+#                       [--time-scale 0] [hex files...]
+#
+# Without hex files a synthetic board is generated.
+
+import sys
+import os
+import time
+import random
+import shutil
+import tempfile
+import argparse
+from ArgentumPrinterController import ArgentumPrinterController
+from virtualprinter import VirtualPrinter
+from compression import order, compress, COMPRESSORS
+
+SPN = 3.386666
+
+def makeBoard(path, width=1500, passes=8, seed=1, panelized=False):
+    '''
+    Writes a synthetic job in the same layout the slicer produces: for each
+    pass every inked column gets a Y move and one firing per address, then
+    the carriage returns and the head feeds down in X. A panelized board
+    repeats the same pass, like a sheet of identical boards.
+    '''
+    rnd = random.Random(seed)
+    f = open(path, 'wb')
+    xposition = 0
+    for y in range(passes):
+        if panelized:
+            rnd = random.Random(seed)
+        yposition = 0
+        # A handful of traces, each a run of identical columns.
+        runs = []
+        x = rnd.randint(0, 40)
+        while x < width:
+            length = rnd.randint(5, 120)
+            firings = [(rnd.choice((0, 0, 0x55, 0xaa, 0xff, rnd.randint(0, 255))),
+                        rnd.choice((0, 0, 0x55, 0xaa, 0xff, rnd.randint(0, 255))))
+                       for a in range(13)]
+            runs.append((x, min(width, x + length), firings))
+            x = x + length + rnd.randint(10, 200)
+        for start, end, firings in runs:
+            for x in range(start, end):
+                if rnd.random() < 0.2:
+                    # Edges of traces change from column to column.
+                    a = rnd.randint(0, 12)
+                    firings[a] = (rnd.randint(0, 255), firings[a][1])
+                move = int((x + 1) * SPN) - yposition
+                if move != 0:
+                    yposition += move
+                    f.write('M Y {}\n'.format(move))
+                for a in range(13):
+                    f.write('F {}{:02X}{:02X}\n'.format(order[a], firings[a][0], firings[a][1]))
+        if yposition != 0:
+            f.write('M Y {}\n'.format(-yposition))
+        movex = int(41 * (y + 1) * SPN) - xposition
+        f.write('M X {}\n'.format(-movex))
+        xposition += movex
+    f.close()
+    return path
+
+def makeCorpus(tmpdir):
+    paths = []
+    for seed in range(1, 4):
+        paths.append(makeBoard(os.path.join(tmpdir, 'board{}.hex'.format(seed)),
+                               width=1000 + 500 * seed, seed=seed))
+        paths.append(makeBoard(os.path.join(tmpdir, 'panel{}.hex'.format(seed)),
+                               width=1000 + 500 * seed, seed=seed, panelized=True))
+    return paths
+
+def compareFormats(paths):
+    print('{:<20} {:>10} {:>10} {:>10} {:>7}'.format('file', 'hex', 'format 1', 'format 2', 'saved'))
+    totals = [0, 0, 0]
+    for path in paths:
+        contents = open(path, 'rb').read()
+        sizes = [len(contents)]
+        for version in sorted(COMPRESSORS):
+            compressed, compressor = compress(contents, version)
+            sizes.append(len(compressed) if compressed else len(contents))
+        totals = [a + b for a, b in zip(totals, sizes)]
+        print('{:<20} {:10} {:10} {:10} {:6.1f}%'.format(os.path.basename(path)[:20],
+              sizes[0], sizes[1], sizes[2], 100.0 * (sizes[1] - sizes[2]) / sizes[1]))
+    print('{:<20} {:10} {:10} {:10} {:6.1f}%'.format('total', totals[0], totals[1], totals[2],
+          100.0 * (totals[1] - totals[2]) / totals[1]))
+
+def timed(func, *args, **kwargs):
+    start = time.time()
+    result = func(*args, **kwargs)
+    return result, time.time() - start
+
+def report(name, seconds, nbytes=None):
+    if nbytes:
+        print('{:<28} {:8.3f} s  {:10.0f} bytes/s'.format(name, seconds, nbytes / seconds))
+    else:
+        print('{:<28} {:8.3f} s'.format(name, seconds))
+
+def printPasses(printer, path, passes, store):
+    progress = lambda pos, total: True
+    if store and printer.storeJob(path):
+        for i in range(passes):
+            if not printer.Print(os.path.basename(path), path, progress):
+                return False
+        return True
+    for i in range(passes):
+        if not printer.send(path, None, True):
+            return False
+    return True
+
+def benchmark(vp, paths, logSerial=False, passes=1):
+    printer = ArgentumPrinterController(vp.port)
+    printer.logSerial = logSerial
+
+    ok, t = timed(printer.connect)
+    if not ok:
+        print('Could not connect: {}'.format(printer.lastError))
+        return False
+    report('connect', t)
+
+    for path in paths:
+        size = os.path.getsize(path)
+        name = os.path.basename(path)
+        print('{} ({} bytes)'.format(name, size))
+
+        vp.resetStats()
+        ok, t = timed(printer.send, path)
+        report('  upload', t, size)
+        print('    {} bytes on the wire, {} bad blocks'.format(vp.stats['bytesIn'], vp.stats['blocksBad']))
+        if not ok:
+            print('  upload failed')
+            continue
+
+        ok, t = timed(printer.checkDJB2, path)
+        report('  verify djb2' + ('' if ok else ' (MISMATCH)'), t)
+
+        progress = lambda pos, total: True
+        vp.resetStats()
+        result, t = timed(printer.Print, name, path, progress)
+        report('  print from storage', t, size)
+        print('    {:.1f} s of motion, {} firings'.format(vp.stats['motionTime'], vp.stats['firings']))
+
+        vp.resetStats()
+        ok, t = timed(printer.send, path, None, True)
+        report('  print online', t, size)
+
+        if passes > 1:
+            ok, t = timed(printPasses, printer, path, passes, False)
+            report('  {} passes online'.format(passes), t, size * passes)
+            printer.command('rm ' + name, timeout=1, expect='\n')
+            ok, t = timed(printPasses, printer, path, passes, True)
+            report('  {} passes from storage'.format(passes), t, size * passes)
+
+    printer.disconnect()
+    return True
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Argentum upload and print benchmark.')
+    parser.add_argument('--baud', type=int, default=115200, help='emulated link rate, 0 for unthrottled')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds before each printer response')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='probability of a bad block')
+    parser.add_argument('--time-scale', type=float, default=0.0, help='fraction of motion time to spend')
+    parser.add_argument('--firmware', default=None, help='firmware version the virtual printer reports')
+    parser.add_argument('--corpus', action='store_true', help='compare compressed sizes over generated boards and the given files')
+    parser.add_argument('--passes', type=int, default=3, help='passes for the multi-pass job timings')
+    parser.add_argument('--log-serial', action='store_true', help='log serial traffic as the GUI does')
+    parser.add_argument('files', nargs='*', help='hex files to upload')
+    args = parser.parse_args()
+
+    if args.corpus:
+        tmpdir = tempfile.mkdtemp()
+        corpus = makeCorpus(tmpdir)
+        compareFormats(corpus + args.files)
+        shutil.rmtree(tmpdir)
+        sys.exit(0)
+
+    paths = args.files
+    tmpdir = None
+    if len(paths) == 0:
+        tmpdir = tempfile.mkdtemp()
+        paths = [makeBoard(os.path.join(tmpdir, 'board.hex'))]
+
+    vp = VirtualPrinter(baudRate=args.baud or None,
+                        latency=args.latency,
+                        errorRate=args.error_rate,
+                        timeScale=args.time_scale,
+                        seed=1,
+                        version=args.firmware)
+    vp.start()
+    try:
+        ok = benchmark(vp, paths, args.log_serial, args.passes)
+    finally:
+        vp.stop()
+        if tmpdir:
+            shutil.rmtree(tmpdir)
+    sys.exit(0 if ok else 1)
@@ -22,52 +22,319 @@
     along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+
+# Converts hex files between binary firings and textual firings, in either
+# direction. A binary firing is two 4 byte records, one for each cartridge:
+#
+#   01 <firing> <address> 0A 01 <firing> <address> 0A
+#
+# and the same firing in text is "F <address><firing><firing>" in hex
+# digits. Moves are the same text lines in both. Files are converted a
+# chunk at a time, with only an unfinished record or line carried between
+# chunks, so any size of file takes the same memory. Bad input raises
+# HexFormatError with the offset of the bad command.
+#
+# A #argentum header isn't copied, as its checksum is of the other body.
+#
+#   python binhex2txt.py [--to-binary] <hex file> [output file]
+
 import sys
-import os
-
-def bin2txt(filename):
-    f = open(filename, "r")
-    contents = f.read()
-    f.close()
-
-    i = 0
-    while i < len(contents):
-        if contents[i] == 'M':
-            while contents[i] != '\n':
-                sys.stdout.write(contents[i])
-                i = i + 1
-            sys.stdout.write('\n')
-        elif contents[i] == chr(1):
-            i = i + 1
-            firing1 = ord(contents[i])
-            i = i + 1
-            address1 = ord(contents[i])
-            i = i + 1
-            if contents[i] != '\n' and contents[i] != chr(0):
-                sys.stderr.write("Invalid firing command.\n")
-                sys.exit(1)
-            i = i + 1
-            if contents[i] != chr(1):
-                sys.stderr.write("Invalid firing command.\n")
-                sys.exit(1)
-            i = i + 1
-            firing2 = ord(contents[i])
-            i = i + 1
-            address2 = ord(contents[i])
-            i = i + 1
-            if address1 != address2:
-                sys.stderr.write("Invalid firing command.\n")
-                sys.exit(1)
-            sys.stdout.write('F {:01X}{:02X}{:02X}\n'.format(address1, firing1, firing2).encode('utf-8'))
+import argparse
+import numpy
+from hexfile import HEADER_TAG
+
+CHUNK_SIZE = 1 << 20
+# Records first looked at in one go in a run of binary firings.
+RUN_WINDOW = 64
+# Longest line carried over to the next chunk.
+MAX_LINE = 4096
+RECORD_SIZE = 8
+
+DIGITS = numpy.frombuffer(b'0123456789ABCDEF', numpy.uint8)
+
+def digitValues():
+    values = numpy.zeros(256, numpy.int16) - 1
+    for n, c in enumerate('0123456789ABCDEF'):
+        values[ord(c)] = n
+        values[ord(c.lower())] = n
+    return values
+
+VALUES = digitValues()
+
+class HexFormatError(ValueError):
+    def __init__(self, message, offset):
+        ValueError.__init__(self, '{} at byte {}'.format(message, offset))
+        self.offset = offset
+
+def isHeader(line, offset):
+    return offset == 0 and line.startswith(HEADER_TAG + ' ')
+
+def checkMove(line, offset):
+    fields = line.split()
+    if len(fields) != 3 or fields[0] != 'M' or fields[1] not in ('X', 'Y'):
+        raise HexFormatError('Invalid move command', offset)
+    try:
+        int(fields[2])
+    except ValueError:
+        raise HexFormatError('Invalid move command', offset)
+
+def splitLines(text):
+    '''The starts, ends, lengths and first characters of the lines in text.'''
+    ends = numpy.flatnonzero(text == ord('\n'))
+    if len(text) > 0 and (len(ends) == 0 or ends[-1] != len(text) - 1):
+        ends = numpy.append(ends, len(text))
+    starts = numpy.concatenate(([0], ends[:-1] + 1))
+    lengths = ends - starts
+    firsts = numpy.where(lengths > 0, text[numpy.minimum(starts, len(text) - 1)], 0)
+    return starts, ends, lengths, firsts
+
+def checkFirings(text, starts, lengths, offset):
+    bad = lengths != 7
+    good = numpy.flatnonzero(~bad)
+    digits = VALUES[text[starts[good][:, None] + numpy.arange(2, 7)]]
+    bad[good] = (text[starts[good] + 1] != ord(' ')) | (digits < 0).any(axis=1)
+    if bad.any():
+        raise HexFormatError('Invalid firing command', offset + starts[numpy.argmax(bad)])
+
+def badMoves(text, starts, lengths):
+    '''Which moves aren't "M X <steps>" or "M Y <steps>".'''
+    bad = lengths < 5
+    good = numpy.flatnonzero(~bad)
+    starts = starts[good]
+    axis = text[starts + 2]
+    bad[good] = ((text[starts + 1] != ord(' ')) | (text[starts + 3] != ord(' ')) |
+                 ((axis != ord('X')) & (axis != ord('Y'))))
+    # Steps are digits, after a minus sign or not.
+    counts = lengths[good] - 4
+    firsts = numpy.cumsum(counts) - counts
+    step = numpy.arange(counts.sum()) - numpy.repeat(firsts, counts)
+    chars = text[numpy.repeat(starts + 4, counts) + step]
+    digit = (chars >= ord('0')) & (chars <= ord('9'))
+    sign = (chars == ord('-')) & (step == 0)
+    wrong = numpy.zeros(len(good), bool)
+    wrong[numpy.repeat(numpy.arange(len(good)), counts)[~(digit | sign)]] = True
+    onlySign = (counts == 1) & (text[starts + 4] == ord('-'))
+    bad[good] |= wrong | onlySign
+    return bad
+
+def textLines(data, text, offset):
+    '''
+    Splits text, whole lines from offset in the file, and checks them.
+    Returns the lines as splitLines does, and which of them are firings,
+    moves and comments other than the header.
+    '''
+    starts, ends, lengths, firsts = lines = splitLines(text)
+    firings = numpy.flatnonzero(firsts == ord('F'))
+    moves = numpy.flatnonzero(firsts == ord('M'))
+    comments = numpy.flatnonzero(firsts == ord('#'))
+    if len(comments) > 0 and comments[0] == 0 and isHeader(data[:ends[0]], offset):
+        comments = comments[1:]
+    others = numpy.flatnonzero((firsts != ord('F')) & (firsts != ord('M')) &
+                               (firsts != ord('#')) & (lengths > 0))
+    if len(others) > 0:
+        raise HexFormatError('Invalid command', offset + starts[others[0]])
+    checkFirings(text, starts[firings], lengths[firings], offset)
+    for line in moves[badMoves(text, starts[moves], lengths[moves])][:1]:
+        checkMove(data[starts[line]:ends[line]], offset + starts[line])
+    return lines, firings, moves, comments
+
+def walkBinary(data, offset, final):
+    '''
+    Splits data, binary hex from offset in the file, into runs of firing
+    records and lines. Returns the runs as (start, count), the segments in
+    order, each a run's index or a line's (start, end), and where the
+    unfinished part at the end starts. The header isn't a segment.
+    '''
+    segments = []
+    runs = []
+    pos = 0
+    while pos < len(data):
+        c = data[pos]
+        if c == b'\x01':
+            left = (len(data) - pos) // RECORD_SIZE
+            if left == 0:
+                break
+            # Runs are measured with strided slices, a window at a time.
+            window = RUN_WINDOW
+            while True:
+                starts = data[pos:pos + min(window, left) * RECORD_SIZE:RECORD_SIZE]
+                count = len(starts) - len(starts.lstrip(b'\x01'))
+                if count < len(starts) or len(starts) == left:
+                    break
+                window = window * 4
+            segments.append(len(runs))
+            runs.append((pos, count))
+            pos += count * RECORD_SIZE
+        elif c == b'M' or c == b'#':
+            nl = data.find(b'\n', pos)
+            if nl == -1:
+                if not final:
+                    break
+                nl = len(data)
+            line = data[pos:nl]
+            if c == b'M':
+                checkMove(line, offset + pos)
+            if not isHeader(line, offset + pos):
+                segments.append((pos, nl))
+            pos = nl + 1
         else:
-            sys.stderr.write("Invalid hex file.\n")
-            sys.exit(1)
-        i = i + 1
+            raise HexFormatError('Invalid command', offset + pos)
+    return runs, segments, min(pos, len(data))
+
+def binaryRecords(data, runs, offset):
+    '''
+    The firing records of the runs as an (n, 8) array, with where each
+    starts in data. Both halves must be for the same address.
+    '''
+    if len(runs) == 0:
+        return numpy.zeros((0, RECORD_SIZE), numpy.uint8), numpy.zeros(0, numpy.int64)
+    firsts, counts = numpy.array(runs, numpy.int64).T
+    at = numpy.cumsum(counts) - counts
+    starts = (numpy.repeat(firsts - at * RECORD_SIZE, counts) +
+              numpy.arange(counts.sum()) * RECORD_SIZE)
+    records = numpy.frombuffer(data, numpy.uint8)[starts[:, None] + numpy.arange(RECORD_SIZE)]
+    terminators = (records[:, [3, 7]] == ord('\n')) | (records[:, [3, 7]] == 0)
+    bad = ((records[:, 4] != 1) | (records[:, 2] != records[:, 6]) | (records[:, 2] > 15) |
+           ~terminators.all(axis=1))
+    if bad.any():
+        raise HexFormatError('Invalid firing command', offset + starts[numpy.argmax(bad)])
+    return records, starts
+
+class Converter(object):
+    '''
+    Feed it a file a chunk at a time, and it returns the converted chunks.
+    finish() returns whatever is left.
+    '''
+
+    def __init__(self):
+        self.pending = b''
+        # Where pending starts in the file.
+        self.offset = 0
+
+    def feed(self, data):
+        return self.convert(self.pending + data, False)
+
+    def finish(self):
+        out = self.convert(self.pending, True)
+        if len(self.pending) > 0:
+            raise HexFormatError('Unfinished command', self.offset)
+        return out
+
+    def keep(self, data, pos):
+        self.pending = data[pos:]
+        self.offset += pos
+        if len(self.pending) > MAX_LINE:
+            raise HexFormatError('Line too long', self.offset)
+
+    def wholeLines(self, data, final):
+        '''Where the last whole line in data ends.'''
+        return len(data) if final else data.rfind(b'\n') + 1
+
+class BinaryToText(Converter):
+    def convert(self, data, final):
+        # The file is walked a run of firings or a line at a time, and then
+        # all the firings are converted at once.
+        runs, segments, pos = walkBinary(data, self.offset, final)
+        records, starts = binaryRecords(data, runs, self.offset)
+        lines = numpy.empty((len(records), 8), numpy.uint8)
+        lines[:, 0] = ord('F')
+        lines[:, 1] = ord(' ')
+        lines[:, 2] = DIGITS[records[:, 2]]
+        lines[:, 3] = DIGITS[records[:, 1] >> 4]
+        lines[:, 4] = DIGITS[records[:, 1] & 15]
+        lines[:, 5] = DIGITS[records[:, 5] >> 4]
+        lines[:, 6] = DIGITS[records[:, 5] & 15]
+        lines[:, 7] = ord('\n')
+        text = lines.tobytes()
+        at = [0]
+        for start, count in runs:
+            at.append(at[-1] + count * 8)
+        out = [text[at[s]:at[s + 1]] if isinstance(s, int) else data[s[0]:s[1]] + b'\n'
+               for s in segments]
+        self.keep(data, pos)
+        return b''.join(out)
+
+class TextToBinary(Converter):
+    def convert(self, data, final):
+        end = self.wholeLines(data, final)
+        if end == 0:
+            self.keep(data, 0)
+            return b''
+        text = numpy.frombuffer(data, numpy.uint8, end)
+        (starts, ends, lengths, firsts), firings, moves, comments = textLines(data, text, self.offset)
+
+        # Firings become 8 bytes, moves and comments are copied with their
+        # newlines.
+        sizes = numpy.zeros(len(starts), numpy.int64)
+        sizes[firings] = RECORD_SIZE
+        copied = numpy.sort(numpy.concatenate((moves, comments)))
+        sizes[copied] = lengths[copied] + 1
+        at = numpy.cumsum(sizes) - sizes
+        out = numpy.empty(sizes.sum(), numpy.uint8)
+
+        f = starts[firings]
+        address = VALUES[text[f + 2]].astype(numpy.uint8)
+        o = at[firings]
+        out[o] = 1
+        out[o + 1] = VALUES[text[f + 3]] * 16 + VALUES[text[f + 4]]
+        out[o + 2] = address
+        out[o + 3] = ord('\n')
+        out[o + 4] = 1
+        out[o + 5] = VALUES[text[f + 5]] * 16 + VALUES[text[f + 6]]
+        out[o + 6] = address
+        out[o + 7] = ord('\n')
+
+        if len(copied) > 0:
+            counts = lengths[copied]
+            firsts = numpy.cumsum(counts) - counts
+            step = numpy.arange(counts.sum()) - numpy.repeat(firsts, counts)
+            out[numpy.repeat(at[copied], counts) + step] = text[numpy.repeat(starts[copied], counts) + step]
+            out[at[copied] + counts] = ord('\n')
+
+        self.keep(data, end)
+        return out.tobytes()
+
+def convert(input, output, converter, chunkSize=CHUNK_SIZE):
+    '''Converts one open file into another.'''
+    while True:
+        chunk = input.read(chunkSize)
+        if not chunk:
+            break
+        output.write(converter.feed(chunk))
+    output.write(converter.finish())
+
+def convertFile(filename, output, converter):
+    f = open(filename, 'rb')
+    try:
+        convert(f, output, converter)
+    finally:
+        f.close()
+
+def bin2txt(filename, output=None):
+    convertFile(filename, output or sys.stdout, BinaryToText())
+
+def txt2bin(filename, output=None):
+    convertFile(filename, output or sys.stdout, TextToBinary())
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("usage: binhex2txt.py <binary hex file>")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description='Convert hex files between binary and textual firings.')
+    parser.add_argument('--to-binary', action='store_true', help='convert textual firings to binary')
+    parser.add_argument('input', help='hex file')
+    parser.add_argument('output', nargs='?', default=None, help='where to write, or standard output')
+    args = parser.parse_args()
 
-    bin2txt(sys.argv[1])
+    output = sys.stdout
+    if args.output:
+        output = open(args.output, 'wb')
+    try:
+        if args.to_binary:
+            txt2bin(args.input, output)
+        else:
+            bin2txt(args.input, output)
+    except HexFormatError as e:
+        sys.stderr.write("Invalid hex file: {}\n".format(e))
+        sys.exit(1)
+    finally:
+        if args.output:
+            output.close()
     sys.exit(0)
@@ -0,0 +1,236 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+    Argentum Control GUI
+
+    Copyright (C) 2013 Isabella Stevens
+    Copyright (C) 2014 Michael Shiel
+    Copyright (C) 2015 Trent Waddington
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+# A cached view of the files in the printer's storage and their hashes, so
+# that making sure a set of job files is on the printer costs one batch of
+# djb2 queries followed by only the uploads that are really needed.
+
+import os
+import time
+import collections
+from hexfile import HexFile
+
+def isHash(line):
+    if len(line) != 8:
+        return False
+    try:
+        int(line, 16)
+    except ValueError:
+        return False
+    return True
+
+class PrinterCatalog(object):
+    '''
+    files maps the lower case name of every file known to be on the printer
+    to its djb2, or None when the hash hasn't been asked for yet. It is
+    None as a whole until the printer has been listed, because hearing
+    about a few files says nothing about the ones not asked for. What is
+    learnt about single files before then is kept in hashes, which is
+    merged into files once the listing arrives.
+    '''
+
+    # Bytes of commands sent ahead of their responses. The firmware reads
+    # commands into a 64 byte serial buffer while it is busy hashing.
+    window = 63
+    timeout = 30
+
+    def __init__(self, printer):
+        self.printer = printer
+        self.files = None
+        self.hashes = {}
+        self.local = {}
+        self.buffer = ''
+        self.roundTrips = 0
+
+    def clear(self):
+        self.files = None
+        self.hashes = {}
+        self.buffer = ''
+
+    def debug(self, msg):
+        self.printer.debug(msg)
+
+    ### Local files
+
+    def localEntry(self, path):
+        st = os.stat(path)
+        entry = self.local.get(path)
+        if entry == None or entry['size'] != st.st_size or entry['mtime'] != st.st_mtime:
+            hexFile = HexFile(path)
+            try:
+                entry = {'size': st.st_size,
+                         'mtime': st.st_mtime,
+                         'djb2': hexFile.djb2(),
+                         'md5': hexFile.md5()}
+            finally:
+                hexFile.close()
+            self.local[path] = entry
+        return entry
+
+    def localDJB2(self, path):
+        return self.localEntry(path)['djb2']
+
+    def localMd5(self, path):
+        return self.localEntry(path)['md5']
+
+    ### The printer's files
+
+    def listing(self):
+        if self.files == None:
+            response = self.printer.command("ls", timeout=2)
+            self.roundTrips += 1
+            if response == None:
+                return {}
+            self.files = {}
+            for line in response:
+                if line.startswith('+'):
+                    name = line[1:].lower()
+                    self.files[name] = self.hashes.get(name)
+        return self.files
+
+    def missing(self, names):
+        files = self.listing()
+        return [name for name in names if name.lower() not in files]
+
+    def update(self, name, djb2):
+        name = name.lower()
+        if djb2 == None:
+            self.hashes.pop(name, None)
+            if self.files != None:
+                self.files.pop(name, None)
+        else:
+            self.hashes[name] = djb2
+            if self.files != None:
+                self.files[name] = djb2
+
+    def added(self, name):
+        '''
+        Notes that the file has just been written to the printer without
+        assuming what it now holds; the next djb2 query will tell.
+        '''
+        name = name.lower()
+        self.hashes.pop(name, None)
+        if self.files != None:
+            self.files[name] = None
+
+    def djb2(self, name):
+        return self.hashes.get(name.lower())
+
+    def readLine(self):
+        deadline = time.time() + self.timeout
+        printer = self.printer
+        try:
+            while self.buffer.find('\n') == -1:
+                if time.time() > deadline:
+                    return None
+                printer.serialSetTimeout(0.1)
+                self.buffer += printer.serialRead(max(1, printer.serialDevice.inWaiting()))
+        finally:
+            printer.serialSetTimeout(0)
+        line, self.buffer = self.buffer.split('\n', 1)
+        return line.rstrip('\r')
+
+    def queryHashes(self, names):
+        '''
+        Asks the printer for the djb2 of every name with the commands sent
+        back to back, and returns a dict of the answers. Files the printer
+        doesn't have are None.
+        '''
+        pending = collections.deque(names)
+        inflight = collections.deque()
+        results = {}
+        self.buffer = ''
+        self.printer.serialDevice.flushInput()
+        self.roundTrips += 1
+        while pending or inflight:
+            while pending:
+                cmd = "djb2 {}\n".format(pending[0])
+                if inflight and sum([n for name, n in inflight]) + len(cmd) > self.window:
+                    break
+                self.printer.serialWriteString(cmd)
+                inflight.append((pending.popleft(), len(cmd)))
+            line = self.readLine()
+            if line == None:
+                self.debug("no response to djb2 {}".format(inflight[0][0]))
+                break
+            if line.strip() == '' or line == "djb2 " + inflight[0][0]:
+                continue
+            # Anything but a hash, whatever the firmware words it as, means
+            # the printer hasn't got the file.
+            name = inflight.popleft()[0]
+            if isHash(line):
+                results[name] = line
+            else:
+                results[name] = None
+            self.update(name, results[name])
+        return results
+
+    def sync(self, paths, progressFunc=None, trust=False):
+        '''
+        Makes sure the printer has an up to date copy of every path,
+        uploading only files that are missing or different. With trust set,
+        the cached hashes are believed without asking the printer. Returns a
+        dict of path to whether the printer now has the file.
+        '''
+        wanted = {}
+        for path in paths:
+            wanted[path] = self.localDJB2(path)
+
+        # Once the printer has been listed, files the listing doesn't have
+        # are missing without asking. Listing it just for this costs more
+        # than the queries it saves, as an empty printer doesn't answer ls.
+        names = [os.path.basename(path) for path in paths]
+        if self.files != None:
+            names = [name for name in names if name.lower() in self.files]
+        known = {}
+        if trust:
+            for name in names:
+                known[name] = self.djb2(name)
+        if names and (not trust or None in known.values()):
+            known = self.queryHashes(names)
+
+        result = {}
+        uploaded = []
+        for path in paths:
+            name = os.path.basename(path)
+            if known.get(name) == wanted[path]:
+                result[path] = True
+                continue
+            self.debug("uploading {}".format(name))
+            if not self.printer.send(path, progressFunc=progressFunc):
+                result[path] = False
+                continue
+            uploaded.append(path)
+
+        # A finished upload only means the bytes left, so the printer is
+        # asked what it stored before the file is counted as there.
+        if uploaded:
+            stored = self.queryHashes([os.path.basename(path) for path in uploaded])
+            for path in uploaded:
+                name = os.path.basename(path)
+                result[path] = stored.get(name) == wanted[path]
+                if not result[path]:
+                    self.debug("{} has the wrong djb2 after uploading".format(name))
+        return result
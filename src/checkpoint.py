@@ -0,0 +1,106 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+    Argentum Control GUI
+
+    Copyright (C) 2013 Isabella Stevens
+    Copyright (C) 2014 Michael Shiel
+    Copyright (C) 2015 Trent Waddington
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+# Where an interrupted print got to, so it can be finished without printing
+# the whole layout again. A layout print is a number of layout passes, each
+# printing every image in turn, and every image's job is itself a number of
+# passes of the print head. The controller reports how many of the current
+# job's passes are done (ArgentumPrinterController.lastPass) and a resumed
+# print skips everything before that, printing the rest of the interrupted
+# job from a truncated copy of it cut at the pass index. Prints from storage
+# count the printer's own pass reports; online prints only know which
+# blocks were received, so their count leaves out the last block's passes
+# in case the printer hadn't got to them.
+
+import os
+from passindex import passIndex
+
+def layoutKey(images):
+    return [(image.hexFilename, image.left, image.bottom) for image in images]
+
+class PrintCheckpoint(object):
+    def __init__(self, images, passes=1, useRollers=False, alsoPause=False):
+        self.layout = layoutKey(images)
+        self.passes = passes
+        self.useRollers = useRollers
+        self.alsoPause = alsoPause
+        self.layoutPass = 0
+        self.image = 0
+        self.done = 0
+        self.base = 0
+        self.filename = None
+
+    def matches(self, images):
+        return layoutKey(images) == self.layout
+
+    def started(self):
+        return self.layoutPass > 0 or self.image > 0 or self.done > 0
+
+    def skip(self, layoutPass, image):
+        '''True if that image was finished in that layout pass.'''
+        return (layoutPass, image) < (self.layoutPass, self.image)
+
+    def startImage(self, filename, base=0):
+        # base is the number of passes dropped from the front of the job.
+        self.filename = filename
+        self.base = base
+
+    def record(self, lastPass):
+        if lastPass != None and lastPass[0] == self.filename:
+            self.done = self.base + lastPass[1]
+
+    def finishImage(self):
+        self.image = self.image + 1
+        self.done = 0
+        self.filename = None
+
+    def finishPass(self):
+        self.layoutPass = self.layoutPass + 1
+        self.image = 0
+        self.done = 0
+
+    def describe(self):
+        text = "pass {}, image {}".format(self.layoutPass + 1, self.image + 1)
+        if self.done > 0:
+            text = text + " from line {}".format(self.done + 1)
+        return text
+
+def writeResumeJob(path, done):
+    '''
+    Writes the job in path without its first done passes next to it.
+    Returns the new path and the (x, y) steps to start it from, relative to
+    where the whole job would start. The path is None if nothing is left.
+    '''
+    index = passIndex(path)
+    rest = index.read(path, done)
+    offset = index.position(done)
+    if rest.strip() == '':
+        return None, offset
+    base, ext = os.path.splitext(path)
+    resumePath = "{}-p{}{}".format(base, done, ext)
+    file = open(resumePath, 'w')
+    file.write(rest)
+    file.close()
+    return resumePath, offset
@@ -0,0 +1,535 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+    Argentum Control GUI
+
+    Copyright (C) 2013 Isabella Stevens
+    Copyright (C) 2014 Michael Shiel
+    Copyright (C) 2015 Trent Waddington
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+# The compressed upload format understood by the firmware ("recv <size> b").
+#
+# Each group of firings between two moves becomes one line of 13 comma
+# separated entries, one per address in firing order:
+#
+#   ''      same data as the previous firing
+#   z       0000
+#   z<part> 00 followed by part
+#   <part>  part followed by 00
+#   XXYY    anything else
+#
+# A part is either two hex digits, which are also added to a table of the 25
+# most recently introduced parts, or a letter a-y referring to that table.
+# A group identical to the previous one is sent as 'd'. Moves are sent as
+# 'X<steps>' or '<steps>' for Y, and comment lines are passed through.
+#
+# Format 2 ("recv <size> 2") adds to this:
+#
+#   d        now means a column with exactly the same firings as the last
+#   @xx      the column at index xx (hex) in a table of the 256 most recently
+#            introduced columns; every column sent as entries is added to it
+#   ;<code>  after a column, a Y move of the last Y move plus a small delta
+#   r<codes> for every code, a repeat of the last column and then a Y move
+#
+# A code is one of 'abcdefghi' for a delta of -4 to +4 steps.
+
+import re
+import collections
+from hexfile import splitHeader
+
+order = ['8', '4', 'C', '2', 'A', '6', 'E', '1', '9', '5', 'D', '3', 'B']
+FIRING_ORDER = ''.join(order)
+MAX_FIRING_LINE_LEN = 13*4+12
+MAX_PARTS = 25
+# One firing for every address, in order.
+GROUP = re.compile(''.join(['F.' + n + '([^\n]*)\n' for n in order]) + r'\Z')
+LETTERS = 'abcdefghijklmnopqrstuvwxy'
+
+# Format 2, and the first firmware version to accept it.
+V2_FIRMWARE = (0, 19)
+MAX_COLUMNS = 256
+MAX_RUN = 60
+MAX_DELTA = 4
+MOVE_CODES = 'abcdefghi'
+MOVE = re.compile(r'M Y (0|-?[1-9][0-9]*)\Z')
+
+# An optional run of firing lines followed by any other line, usually the
+# move to the next column, and then any copies of the same firings that are
+# each followed by a plain move.
+TOKEN = re.compile(r'((?:F[^\n]*\n)+)?([^\n]*)\n((?:\1M [XY] -?[0-9]+\n)*)')
+
+class CompressionFailed(Exception):
+    pass
+
+def splitFiring(data):
+    '''
+    Splits the data of a firing into the literal part of its entry and the
+    part to look up in the table, if any.
+    '''
+    if data == '0000':
+        return 'z', None
+    if data[0:2] == '00':
+        return 'z', data[2:4]
+    if data[2:4] == '00':
+        return '', data[0:2]
+    return data, None
+
+class PartTable(object):
+    '''
+    The table of recent parts. Every part gets a serial number when it is
+    added, so its letter is its serial minus the serial of the oldest entry.
+    Hits don't reorder the table, the firmware only ever appends.
+    '''
+
+    def __init__(self, size=MAX_PARTS):
+        self.size = size
+        self.serials = {}
+        self.parts = collections.deque()
+        self.oldest = 0
+        self.next = 0
+
+    def encode(self, part):
+        serial = self.serials.get(part)
+        if serial != None:
+            return LETTERS[serial - self.oldest]
+        self.serials[part] = self.next
+        self.next += 1
+        self.parts.append(part)
+        if len(self.parts) > self.size:
+            del self.serials[self.parts.popleft()]
+            self.oldest += 1
+        return part
+
+class Compressor(object):
+    '''
+    Streaming encoder for the compressed upload format. Feed it the hex file
+    in pieces of any size, it returns the compressed text for everything
+    that can be encoded so far. The output is identical to what the
+    original one-shot encoder produced.
+
+    When the file can't be represented, feed() and finish() raise
+    CompressionFailed and the reason is kept in self.reason.
+    '''
+
+    def __init__(self):
+        self.pending = ''
+        self.firings = []
+        self.lastFiringLine = None
+        self.lastData = None
+        self.parts = PartTable()
+        self.splits = {}
+        # The previous group and whether encoding it again gives the same
+        # line, which is the case unless it changed the encoder's state.
+        self.lastGroup = None
+        self.lastGroupStable = False
+        self.wroteLine = False
+        self.reason = None
+        self.bytesIn = 0
+        self.bytesOut = 0
+        self.groups = 0
+        self.repeats = 0
+
+    def ratio(self):
+        if self.bytesOut == 0:
+            return 0
+        return float(self.bytesIn) / self.bytesOut
+
+    def fail(self, reason):
+        self.reason = reason
+        raise CompressionFailed(reason)
+
+    def feed(self, data):
+        if self.reason:
+            raise CompressionFailed(self.reason)
+        self.bytesIn += len(data)
+        data = self.pending + data
+        end = data.rfind('\n') + 1
+        self.pending = data[end:]
+        out = []
+        self.encodeLines(data, end, out)
+        return self.output(out)
+
+    def encodeLines(self, data, end, out):
+        firings = self.firings
+        for match in TOKEN.finditer(data, 0, end):
+            run, line, repeats = match.groups()
+            if run:
+                firings.append(run)
+            if len(line) == 0:
+                pass
+            elif line[0] == 'M':
+                if len(firings) > 0:
+                    out.append(self.encodeGroup())
+                if line[2:3] == 'X':
+                    out.append('X' + line[4:])
+                else:
+                    out.append(line[4:])
+            elif line[0] == 'F':
+                firings.append(line + '\n')
+            elif line[0] == '#':
+                out.append(line)
+            else:
+                self.fail("what's this? {}".format(line))
+            if repeats:
+                self.encodeRepeats(run, repeats, out)
+
+    def encodeRepeats(self, run, repeats, out):
+        '''
+        Encodes columns identical to the one just encoded, each followed by
+        a move. Once encoding the column leaves the state unchanged, every
+        further copy is a 'd' and the whole run is converted at once.
+        '''
+        while (repeats and not self.lastGroupStable and
+               len(self.firings) == 0 and self.lastGroup == run):
+            first = repeats.find('\n', len(run)) + 1
+            self.encodeLines(repeats, first, out)
+            repeats = repeats[first:]
+        if len(self.firings) > 0 or self.lastGroup != run:
+            self.encodeLines(repeats, len(repeats), out)
+            return
+        if repeats:
+            count = repeats.count(run)
+            self.groups += count
+            self.repeats += count
+            repeats = repeats.replace(run, 'd\n').replace('M Y ', '').replace('M X ', 'X')
+            out.append(repeats[:-1])
+
+    def finish(self):
+        out = ''
+        if self.pending:
+            pending = self.pending
+            self.pending = ''
+            self.bytesIn -= len(pending) + 1
+            out = self.feed(pending + '\n')
+        if not self.wroteLine:
+            out += '\n'
+            self.bytesOut += 1
+        return out
+
+    def output(self, out):
+        if len(out) == 0:
+            return ''
+        self.wroteLine = True
+        out.append('')
+        out = '\n'.join(out)
+        self.bytesOut += len(out)
+        return out
+
+    def encodeGroup(self):
+        group = ''.join(self.firings)
+        del self.firings[:]
+        self.groups += 1
+        if group == self.lastGroup and self.lastGroupStable:
+            self.repeats += 1
+            return 'd'
+
+        match = GROUP.match(group)
+        if match == None:
+            self.fail("firing order changed!")
+
+        startData = self.lastData
+        startParts = self.parts.next
+        entries = self.encodeEntries(match.groups())
+
+        self.lastGroup = group
+        self.lastGroupStable = (startParts == self.parts.next and
+                                startData == self.lastData)
+
+        firingLine = ','.join(entries)
+        if firingLine == self.lastFiringLine:
+            self.repeats += 1
+            return 'd'
+        self.lastFiringLine = firingLine
+        if len(firingLine) > MAX_FIRING_LINE_LEN:
+            self.fail("firing line too long.")
+        return firingLine
+
+    def encodeEntries(self, datas):
+        lastData = self.lastData
+        table = self.parts
+        serials = table.serials
+        splits = self.splits
+        entries = []
+        for data in datas:
+            if data == lastData:
+                entries.append('')
+                continue
+            lastData = data
+            split = splits.get(data)
+            if split == None:
+                split = splits[data] = splitFiring(data)
+            prefix, part = split
+            if part:
+                serial = serials.get(part)
+                if serial == None:
+                    entries.append(prefix + table.encode(part))
+                else:
+                    entries.append(prefix + LETTERS[serial - table.oldest])
+            else:
+                entries.append(prefix)
+        self.lastData = lastData
+        return entries
+
+class Decompressor(object):
+    '''
+    Decodes the compressed upload format back into the original hex file.
+    Data can be fed in arbitrary pieces, decoded text is returned for
+    every complete line.
+    '''
+
+    def __init__(self):
+        self.pending = ''
+        self.lastFiringLine = None
+        self.lastFiring = None
+        self.lastParts = []
+
+    def feed(self, data):
+        lines = (self.pending + data).split('\n')
+        self.pending = lines.pop()
+        out = []
+        for line in lines:
+            self.decodeLine(line, out)
+        return ''.join(out)
+
+    def finish(self):
+        out = []
+        if self.pending:
+            self.decodeLine(self.pending, out)
+            self.pending = ''
+        return ''.join(out)
+
+    def part(self, p):
+        if len(p) == 1:
+            return self.lastParts[ord(p) - ord('a')]
+        self.lastParts.append(p)
+        if len(self.lastParts) > 25:
+            self.lastParts.pop(0)
+        return p
+
+    def decodeLine(self, line, out):
+        if len(line) == 0:
+            return
+        if line[0] == '#':
+            out.append(line + '\n')
+        elif line == 'd':
+            self.writeFirings(self.lastFiringLine, out)
+        elif line.find(',') != -1 or line == '.':
+            firings = self.decodeEntries(line)
+            self.lastFiringLine = firings
+            self.writeFirings(firings, out)
+        elif line[0] == 'X':
+            out.append('M X ' + line[1:] + '\n')
+        else:
+            out.append('M Y ' + line + '\n')
+
+    def decodeEntries(self, line):
+        if line == '.':
+            entries = ['']
+        else:
+            entries = line.split(',')
+        firings = []
+        for entry in entries:
+            if entry == '':
+                firing = self.lastFiring
+            elif entry[0] == 'z':
+                if len(entry) == 1:
+                    firing = '0000'
+                else:
+                    firing = '00' + self.part(entry[1:])
+            elif len(entry) == 4:
+                firing = entry
+            else:
+                firing = self.part(entry) + '00'
+            self.lastFiring = firing
+            firings.append(firing)
+        return firings
+
+    def writeFirings(self, firings, out):
+        for i in range(len(firings)):
+            out.append('F ' + order[i] + firings[i] + '\n')
+
+class CompressorV2(Compressor):
+    '''
+    Encoder for format 2. Columns are only repeated when their firings are
+    really identical, so runs of them can be collected into 'r' lines.
+    '''
+
+    def __init__(self):
+        Compressor.__init__(self)
+        self.columns = PartTable(MAX_COLUMNS)
+        self.lastY = 0
+        self.runCodes = []
+        self.columnHits = 0
+
+    def encodeLines(self, data, end, out):
+        firings = self.firings
+        for match in TOKEN.finditer(data, 0, end):
+            run, line, repeats = match.groups()
+            if run:
+                firings.append(run)
+            if len(line) == 0:
+                pass
+            elif line[0] == 'M':
+                column = None
+                if len(firings) > 0:
+                    column = self.encodeColumn()
+                self.encodeMove(column, line, out)
+            elif line[0] == 'F':
+                firings.append(line + '\n')
+            elif line[0] == '#':
+                self.flushRun(out)
+                out.append(line)
+            else:
+                self.fail("what's this? {}".format(line))
+            if repeats:
+                if len(firings) > 0 or self.lastGroup != run:
+                    self.encodeLines(repeats, len(repeats), out)
+                    continue
+                for move in repeats.split(run)[1:]:
+                    self.groups += 1
+                    self.repeats += 1
+                    self.encodeMove('d', move[:-1], out)
+
+    def encodeColumn(self):
+        group = ''.join(self.firings)
+        del self.firings[:]
+        self.groups += 1
+        if group == self.lastGroup:
+            self.repeats += 1
+            return 'd'
+
+        match = GROUP.match(group)
+        if match == None:
+            self.fail("firing order changed!")
+        self.lastGroup = group
+
+        serial = self.columns.serials.get(group)
+        if serial != None:
+            self.columnHits += 1
+            self.lastData = match.group(len(order))
+            return '@{:02x}'.format(serial - self.columns.oldest)
+
+        self.columns.encode(group)
+        firingLine = ','.join(self.encodeEntries(match.groups()))
+        if len(firingLine) > MAX_FIRING_LINE_LEN:
+            self.fail("firing line too long.")
+        return firingLine
+
+    def encodeMove(self, column, line, out):
+        code = None
+        move = MOVE.match(line)
+        if move:
+            delta = int(move.group(1)) - self.lastY
+            if -MAX_DELTA <= delta <= MAX_DELTA:
+                code = MOVE_CODES[delta + MAX_DELTA]
+        if column == 'd' and code:
+            self.lastY += delta
+            self.runCodes.append(code)
+            if len(self.runCodes) == MAX_RUN:
+                self.flushRun(out)
+            return
+
+        self.flushRun(out)
+        if code:
+            self.lastY += delta
+            out.append(column + ';' + code if column else ';' + code)
+            return
+        if column:
+            out.append(column)
+        if line[2:3] == 'X':
+            out.append('X' + line[4:])
+        else:
+            out.append(line[4:])
+            if move:
+                self.lastY = int(move.group(1))
+
+    def flushRun(self, out):
+        if len(self.runCodes) > 0:
+            out.append('r' + ''.join(self.runCodes))
+            self.runCodes = []
+
+    def finish(self):
+        out = Compressor.finish(self)
+        tail = []
+        self.flushRun(tail)
+        return out + self.output(tail)
+
+class DecompressorV2(Decompressor):
+    def __init__(self):
+        Decompressor.__init__(self)
+        self.columns = []
+        self.lastY = 0
+
+    def decodeLine(self, line, out):
+        if len(line) == 0:
+            return
+        if line[0] == '#':
+            out.append(line + '\n')
+            return
+        if line[0] == 'r' and line.find(',') == -1:
+            for code in line[1:]:
+                self.writeFirings(self.lastFiringLine, out)
+                self.moveY(self.lastY + MOVE_CODES.index(code) - MAX_DELTA, out)
+            return
+
+        line, code = (line.split(';') + [None])[:2]
+        if line == 'd':
+            self.writeFirings(self.lastFiringLine, out)
+        elif line[0:1] == '@':
+            firings = self.columns[int(line[1:], 16)]
+            self.lastFiring = firings[-1]
+            self.lastFiringLine = firings
+            self.writeFirings(firings, out)
+        elif line.find(',') != -1:
+            firings = self.decodeEntries(line)
+            self.columns.append(firings)
+            if len(self.columns) > MAX_COLUMNS:
+                self.columns.pop(0)
+            self.lastFiringLine = firings
+            self.writeFirings(firings, out)
+        elif line[0:1] == 'X':
+            out.append('M X ' + line[1:] + '\n')
+        elif line:
+            out.append('M Y ' + line + '\n')
+            if MOVE.match('M Y ' + line):
+                self.lastY = int(line)
+        if code:
+            self.moveY(self.lastY + MOVE_CODES.index(code) - MAX_DELTA, out)
+
+    def moveY(self, y, out):
+        self.lastY = y
+        out.append('M Y {}\n'.format(y))
+
+COMPRESSORS = {1: Compressor, 2: CompressorV2}
+DECOMPRESSORS = {1: Decompressor, 2: DecompressorV2}
+
+def compress(contents, version=1):
+    '''
+    Compresses a whole hex file in the given format version. Returns the compressed text and the
+    Compressor with its statistics; the text is None if the file can't be
+    compressed.
+    '''
+    compressor = COMPRESSORS[version]()
+    # The header describes the file on this side, it isn't uploaded.
+    header, contents = splitHeader(contents)
+    try:
+        compressed = compressor.feed(contents) + compressor.finish()
+    except CompressionFailed:
+        return None, compressor
+    return compressed, compressor
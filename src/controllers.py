@@ -22,6 +22,8 @@
     along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+import numpy
+
 class ControllerBase(object):
 
     # Control Commands
@@ -104,10 +106,23 @@ class ParsingControllerBase(ControllerBase):
 
         self.firingCommand(primitive1, address1, primitive2, address2)
 
+    def commandBatch(self, commands):
+        '''
+        Handles an array of fileparser.COMMAND. This goes a command at a
+        time; subclasses can do a whole batch at once.
+        '''
+        for op, axis, steps, firing1, address1, firing2, address2 in commands.tolist():
+            if op == self.OP_FIRING:
+                self.firingCommand(self.decodePrimitiveBitmask(firing1), address1,
+                                   self.decodePrimitiveBitmask(firing2), address2)
+            else:
+                self.incrementalMovementCommand(axis, steps)
+
 
 class TestParsingController(ParsingControllerBase):
-    positions = {'X': 0, 'Y': 0}
-    maximums  = {'X': 0, 'Y': 0}
+    def __init__(self):
+        self.positions = {'X': 0, 'Y': 0}
+        self.maximums  = {'X': 0, 'Y': 0}
 
     def incrementalMovementCommand(self, axis, steps):
         #print('incrementalMovementCommand on {} axis for {} steps.'.format(axis, steps))
@@ -129,3 +144,22 @@ class TestParsingController(ParsingControllerBase):
         #print('firingCommand1 on primitives {} (bitmask) and address {}.'.format(primitives1, address1))
         #print('firingCommand2 on primitives {} (bitmask) and address {}.'.format(primitives2, address2))
         pass
+
+    def commandBatch(self, commands):
+        moves = commands[commands['op'] == self.OP_MOVE]
+        for axis in self.positions:
+            increments = numpy.abs(moves['steps'][moves['axis'] == axis])
+            if len(increments) == 0:
+                continue
+            # A move of zero homes the axis, and positions count up from there.
+            homes = numpy.flatnonzero(increments == 0)
+            totals = numpy.cumsum(increments)
+            if len(homes) > 0:
+                base = numpy.zeros(len(increments), numpy.int64)
+                base[homes] = totals[homes]
+                totals = totals - numpy.maximum.accumulate(base)
+                totals[:homes[0]] += self.positions[axis]
+            else:
+                totals += self.positions[axis]
+            self.positions[axis] = int(totals[-1])
+            self.maximums[axis] = max(self.maximums[axis], int(totals.max()))
@@ -0,0 +1,287 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+    Argentum Control GUI
+
+    Copyright (C) 2013 Isabella Stevens
+    Copyright (C) 2014 Michael Shiel
+    Copyright (C) 2015 Trent Waddington
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+
+# Estimates how long a layout takes to print, and whether it stays inside
+# the print limits, without a printer. The layout moves, every move in the
+# sliced hex files and the roller drying moves go through a motion model
+# using the same speed and acceleration settings the GUI sends to the
+# printer. Uploads are timed at the serial link rate using the compressed
+# size that would actually be sent.
+#
+#   python dryrun.py [--passes 2] [--rollers] [--baud 115200]
+#                    [--options argentum.pickle] job.layout
+#
+# The acceleration and firing times are estimates, not measurements.
+
+import os
+import sys
+import math
+import pickle
+import argparse
+from layoutfile import imageMove, dryingMoves
+from uploadcache import UploadCache
+from compression import compress
+from hexfile import HexFile, BLOCK_SIZE
+
+STEPS_PER_MM = 80
+X_LIMIT = 230 * STEPS_PER_MM
+Y_LIMIT = 150 * STEPS_PER_MM
+# Steps/s^2 when acceleration is on.
+ACCELERATION = 20000
+# Seconds to fire one address on both cartridges.
+FIRING_TIME = 0.0001
+# Seconds the GUI waits after each roller command.
+ROLLER_DWELL = 1.5
+# Each block is followed by a 5 byte trailer.
+TRAILER_SIZE = 5
+
+class MotionModel(object):
+    def __init__(self, speed=None, accel=None, acceleration=ACCELERATION,
+                 xLimit=X_LIMIT, yLimit=Y_LIMIT):
+        self.speed = speed or {'X': 8000, 'Y': 8000}
+        self.accel = accel or {'X': True, 'Y': True}
+        self.acceleration = acceleration
+        self.xLimit = xLimit
+        self.yLimit = yLimit
+        self.x = 0
+        self.y = 0
+        self.travel = 0
+        self.violations = []
+
+    def axisTime(self, axis, steps):
+        steps = abs(steps)
+        if steps == 0:
+            return 0.0
+        v = float(self.speed[axis])
+        if not self.accel[axis]:
+            return steps / v
+        a = float(self.acceleration)
+        # Trapezoidal profile, or triangular if it never reaches speed.
+        if steps >= v * v / a:
+            return steps / v + v / a
+        return 2 * math.sqrt(steps / a)
+
+    def moveTo(self, x, y, what):
+        '''An absolute move; the firmware refuses ones outside the limits.'''
+        if x < 0 or x > self.xLimit or y < 0 or y > self.yLimit:
+            self.violations.append('{}: move to {},{} is outside {}/{}'.format(
+                what, x, y, self.xLimit, self.yLimit))
+            return 0.0
+        t = max(self.axisTime('X', x - self.x), self.axisTime('Y', y - self.y))
+        self.travel += abs(x - self.x) + abs(y - self.y)
+        self.x = x
+        self.y = y
+        return t
+
+    def moveBy(self, axis, steps):
+        t = self.axisTime(axis, steps)
+        self.travel += abs(steps)
+        if axis == 'X':
+            self.x += steps
+        else:
+            self.y += steps
+        return t
+
+class HexRun(object):
+    '''
+    Times a sliced hex file with a motion model's settings, starting from
+    start, and notes the first place it takes the head outside the limits.
+    Jobs end where they started.
+    '''
+
+    def __init__(self, model, path, start, firingTime=FIRING_TIME):
+        self.seconds = 0.0
+        self.travel = 0
+        self.firings = 0
+        self.lines = 0
+        self.outside = None
+        x, y = start
+        with HexFile(path) as hexFile:
+            for line in hexFile.lines():
+                if len(line) < 3:
+                    continue
+                self.lines += 1
+                if line[0] == 'F':
+                    self.firings += 1
+                elif line[0] == 'M':
+                    steps = int(line[4:])
+                    self.seconds += model.axisTime(line[2], steps)
+                    self.travel += abs(steps)
+                    if line[2] == 'X':
+                        x += steps
+                    else:
+                        y += steps
+                    if self.outside == None and not (0 <= x <= model.xLimit and
+                                                     0 <= y <= model.yLimit):
+                        self.outside = (x, y)
+        self.seconds += self.firings * firingTime
+
+class DryRun(object):
+    def __init__(self, model, baudRate=115200, latency=0.0, formatVersion=1):
+        self.model = model
+        self.baudRate = baudRate
+        self.latency = latency
+        self.formatVersion = formatVersion
+        self.uploadCache = UploadCache(lambda contents, version: compress(contents, version)[0])
+
+    def uploadSize(self, path, printOnline):
+        '''Bytes the controller would send for path, as send() decides.'''
+        with HexFile(path) as hexFile:
+            contents = hexFile.body()
+            size = len(contents)
+            artifact = self.uploadCache.artifact(path, contents, self.formatVersion)
+            if artifact.contents == None and self.formatVersion > 1:
+                artifact = self.uploadCache.artifact(path, contents, 1)
+        if artifact.contents and (printOnline or artifact.size() * 3 < size):
+            size = artifact.size()
+        blocks = (size + BLOCK_SIZE - 1) // BLOCK_SIZE
+        return size + blocks * TRAILER_SIZE, blocks
+
+    def uploadTime(self, path, printOnline):
+        size, blocks = self.uploadSize(path, printOnline)
+        # 10 bits per byte on the wire, and a round trip per block.
+        return size * 10.0 / self.baudRate + blocks * self.latency
+
+    def run(self, images, paths, passes=1, rollers=False):
+        '''
+        Returns a report of the estimated seconds spent in each phase, the
+        carriage travel in steps and any limit violations.
+        '''
+        model = self.model
+        report = {'setup': ROLLER_DWELL, 'upload': 0.0, 'positioning': 0.0,
+                  'printing': 0.0, 'drying': 0.0, 'images': []}
+        # With more than one pass the jobs are stored on the printer first.
+        stored = passes > 1
+        runs = []
+        for image, path in zip(images, paths):
+            name = os.path.basename(path)
+            pos = imageMove(image)
+            run = HexRun(model, path, pos)
+            if run.outside != None:
+                model.violations.append('{}: head reaches {},{} from {},{}'.format(
+                    name, run.outside[0], run.outside[1], pos[0], pos[1]))
+            entry = {'name': name, 'upload': 0.0, 'printing': 0.0,
+                     'firings': run.firings, 'lines': run.lines}
+            if stored:
+                entry['upload'] = self.uploadTime(path, False)
+            report['images'].append(entry)
+            runs.append(run)
+
+        for i in range(passes):
+            for image, path, run, entry in zip(images, paths, runs, report['images']):
+                pos = imageMove(image)
+                report['positioning'] += model.moveTo(pos[0], pos[1], entry['name'])
+                model.travel += run.travel
+                entry['printing'] += run.seconds
+                if not stored:
+                    # Printing online overlaps the upload; the slower one wins.
+                    upload = self.uploadTime(path, True)
+                    entry['upload'] += upload
+                    report['printing'] += max(run.seconds, upload)
+                else:
+                    report['printing'] += run.seconds
+            if rollers:
+                report['drying'] += self.dry(images)
+        report['positioning'] += model.moveTo(0, 0, 'home')
+
+        report['upload'] = sum(entry['upload'] for entry in report['images'])
+        report['travel'] = model.travel
+        report['violations'] = model.violations
+        report['total'] = (report['setup'] + report['positioning'] +
+                           report['printing'] + report['drying'])
+        if stored:
+            report['total'] += report['upload']
+        return report
+
+    def dry(self, images):
+        model = self.model
+        seconds = 0.0
+        for image in images:
+            for x, y, left in dryingMoves(image):
+                seconds += model.moveTo(x, y, 'drying') + ROLLER_DWELL
+                seconds += model.moveTo(left, y, 'drying') + ROLLER_DWELL
+        return seconds
+
+def formatSeconds(seconds):
+    if seconds < 60:
+        return '{:.1f}s'.format(seconds)
+    return '{}m {:04.1f}s'.format(int(seconds // 60), seconds % 60)
+
+def formatReport(report):
+    lines = []
+    for entry in report['images']:
+        lines.append('{:30} upload {:>10}  printing {:>10}  {} firings'.format(
+            entry['name'], formatSeconds(entry['upload']),
+            formatSeconds(entry['printing']), entry['firings']))
+    for phase in ['setup', 'upload', 'positioning', 'printing', 'drying', 'total']:
+        lines.append('{:12} {:>10}'.format(phase, formatSeconds(report[phase])))
+    lines.append('{:12} {:>10.1f}mm'.format('travel', float(report['travel']) / STEPS_PER_MM))
+    for violation in report['violations']:
+        lines.append('limit: ' + violation)
+    return '\n'.join(lines)
+
+def loadOptions(path):
+    f = open(path, 'rb')
+    options = pickle.load(f)
+    f.close()
+    return options
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Estimate print time and check limits without a printer.')
+    parser.add_argument('--passes', type=int, default=1, help='passes per layout')
+    parser.add_argument('--rollers', action='store_true', help='dry with the rollers after each pass')
+    parser.add_argument('--baud', type=int, default=115200, help='serial link rate')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds for each block to be acknowledged')
+    parser.add_argument('--format', type=int, default=1, help='compressed upload format the firmware takes')
+    parser.add_argument('--options', default=None, help='GUI options file with speeds and calibration')
+    parser.add_argument('--files-dir', default=None, help='where sliced images are')
+    parser.add_argument('layouts', nargs='+', help='layout files')
+    args = parser.parse_args()
+
+    from headless import HeadlessPrinter, DEFAULT_FILES_DIR
+    options = {}
+    if args.options:
+        options = loadOptions(args.options)
+    speed = {'X': int(options.get('x_speed', 8000)), 'Y': int(options.get('y_speed', 8000))}
+    accel = {'X': options.get('x_acc', True), 'Y': options.get('y_acc', True)}
+    calibration = None
+    if 'horizontal_offset' in options:
+        calibration = dict((key, options[key]) for key in
+                           ['horizontal_offset', 'vertical_offset', 'print_overlap'])
+
+    slicer = HeadlessPrinter(None, args.files_dir or DEFAULT_FILES_DIR, calibration)
+    ok = True
+    for layout in args.layouts:
+        images = slicer.loadImages(layout)
+        slicer.slice(images)
+        paths = [image.filename if image.filename.endswith('.hex') else slicer.hexPath(image)
+                 for image in images]
+        dryRun = DryRun(MotionModel(speed, accel), args.baud, args.latency, args.format)
+        report = dryRun.run(images, paths, args.passes, args.rollers)
+        print(layout)
+        print(formatReport(report))
+        ok = ok and len(report['violations']) == 0
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,332 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+    Argentum Control GUI
+
+    Copyright (C) 2013 Isabella Stevens
+    Copyright (C) 2014 Michael Shiel
+    Copyright (C) 2015 Trent Waddington
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+
+# Runs several printers from one job queue. Every attached printer gets its
+# own controller and worker thread, identified by its printer number, and
+# idle printers take the next job they can run, so uploads to different
+# ports happen at the same time. Images are sliced separately for each
+# printer with that printer's calibration.
+#
+#   python farm.py [--virtual 3] [--baud 115200] [--passes 1] jobs...
+#
+# Jobs are hex files or images. With --virtual the jobs are printed on
+# local virtual printers instead of the attached ones.
+
+import os
+import sys
+import time
+import threading
+import collections
+import argparse
+from ArgentumPrinterController import ArgentumPrinterController
+from printers import CALIBRATION_DEFAULTS, printerPorts
+
+def sliceImage(path, outputPath, options):
+    from imageproc import ImageProcessor
+    ip = ImageProcessor(horizontal_offset=options['horizontal_offset'],
+                        vertical_offset=options['vertical_offset'],
+                        overlap=options['print_overlap'])
+    ip.sliceImage(path, outputPath)
+
+class FarmJob(object):
+    def __init__(self, path, passes=1, printerNumber=None):
+        self.path = path
+        self.passes = passes
+        self.printerNumber = printerNumber
+        self.status = 'queued'
+        self.printer = None
+        self.error = None
+        self.progress = 0.0
+        self.canceled = False
+        self.started = None
+        self.finished = None
+
+    def progressFunc(self, pos, size):
+        self.progress = float(pos) / size
+        return not self.canceled
+
+    def isImage(self):
+        return not self.path.lower().endswith('.hex')
+
+    def duration(self):
+        '''Seconds the job ran for, or None if it never started.'''
+        if self.started == None or self.finished == None:
+            return None
+        return self.finished - self.started
+
+    def __repr__(self):
+        return 'FarmJob({!r}, {})'.format(os.path.basename(self.path), self.status)
+
+class FarmPrinter(object):
+    def __init__(self, controller, number, options):
+        self.controller = controller
+        self.number = number
+        self.options = options
+        self.job = None
+        self.jobsDone = 0
+        self.thread = None
+
+    def __repr__(self):
+        return 'FarmPrinter({!r} on {})'.format(self.number, self.controller.port)
+
+class PrinterFarm(object):
+    '''
+    slicer(path, outputPath, options) turns an image into a hex file for
+    a printer with the given calibration options.
+    '''
+
+    def __init__(self, filesDir, slicer=sliceImage):
+        self.filesDir = filesDir
+        self.slicer = slicer
+        self.printers = []
+        self.jobs = []
+        self.queue = collections.deque()
+        self.condition = threading.Condition()
+        self.running = False
+
+    def discover(self, ports=None):
+        '''Connects to all ports at once and adds every printer that answers.'''
+        if ports == None:
+            ports = printerPorts()
+        threads = []
+        for port in ports:
+            thread = threading.Thread(target=self.add, args=(port,))
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        return self.printers
+
+    def add(self, port, options=None):
+        controller = ArgentumPrinterController(port)
+        if not controller.connect():
+            print('{}: {}'.format(port, controller.lastError))
+            return None
+        number = controller.printerNumber
+        if number == None:
+            number = controller.getPrinterNumber()
+        if number == None:
+            number = port
+        if options == None:
+            options = controller.getOptions()
+        if options == None:
+            options = dict(CALIBRATION_DEFAULTS)
+        printer = FarmPrinter(controller, number, options)
+        with self.condition:
+            self.printers.append(printer)
+            if self.running:
+                self.startWorker(printer)
+        return printer
+
+    def printer(self, number):
+        for printer in self.printers:
+            if printer.number == number:
+                return printer
+        return None
+
+    def submit(self, path, passes=1, printerNumber=None):
+        '''Queues a job, optionally for one printer only.'''
+        job = FarmJob(path, passes, printerNumber)
+        with self.condition:
+            self.jobs.append(job)
+            self.queue.append(job)
+            self.condition.notifyAll()
+        return job
+
+    def cancel(self, job):
+        with self.condition:
+            job.canceled = True
+            if job in self.queue:
+                self.queue.remove(job)
+                job.status = 'canceled'
+            self.condition.notifyAll()
+
+    def start(self):
+        with self.condition:
+            self.running = True
+            for printer in self.printers:
+                self.startWorker(printer)
+
+    def startWorker(self, printer):
+        printer.thread = threading.Thread(target=self.workLoop, args=(printer,))
+        printer.thread.daemon = True
+        printer.thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notifyAll()
+        for printer in self.printers:
+            if printer.thread != None:
+                printer.thread.join()
+                printer.thread = None
+
+    def close(self):
+        self.stop()
+        for printer in self.printers:
+            printer.controller.disconnect()
+
+    def nextJob(self, printer):
+        # Called with the condition held.
+        for job in self.queue:
+            if job.printerNumber == None or job.printerNumber == printer.number:
+                self.queue.remove(job)
+                return job
+        return None
+
+    def workLoop(self, printer):
+        while True:
+            with self.condition:
+                job = None
+                while self.running:
+                    job = self.nextJob(printer)
+                    if job != None:
+                        break
+                    self.condition.wait(1)
+                if job == None:
+                    return
+                job.status = 'running'
+                job.printer = printer.number
+                printer.job = job
+            job.started = time.time()
+            try:
+                if self.runJob(printer, job):
+                    job.status = 'done'
+                elif job.canceled:
+                    job.status = 'canceled'
+                else:
+                    job.status = 'failed'
+            except Exception as e:
+                job.status = 'failed'
+                job.error = str(e)
+            job.finished = time.time()
+            with self.condition:
+                printer.job = None
+                printer.jobsDone = printer.jobsDone + 1
+                self.condition.notifyAll()
+
+    def hexFor(self, printer, job):
+        if not job.isImage():
+            return job.path
+        # Each printer's calibration gives a different hex file.
+        outputDir = os.path.join(self.filesDir, str(printer.number))
+        if not os.path.isdir(outputDir):
+            os.makedirs(outputDir)
+        name = os.path.splitext(os.path.basename(job.path))[0] + '.hex'
+        outputPath = os.path.join(outputDir, name)
+        self.slicer(job.path, outputPath, printer.options)
+        return outputPath
+
+    def runJob(self, printer, job):
+        controller = printer.controller
+        if not controller.connected:
+            job.error = 'printer not connected'
+            return False
+        path = self.hexFor(printer, job)
+        controller.home(wait=True)
+        if job.canceled:
+            return False
+        if job.passes > 1 and controller.storeJob(path):
+            for i in range(job.passes):
+                if not controller.Print(os.path.basename(path), path, job.progressFunc):
+                    job.error = 'print failed on pass {}'.format(i + 1)
+                    return False
+            return True
+        for i in range(job.passes):
+            if not controller.send(path, job.progressFunc, True):
+                job.error = 'upload failed on pass {}'.format(i + 1)
+                return False
+        return True
+
+    def idle(self):
+        with self.condition:
+            if len(self.queue) > 0:
+                return False
+            for printer in self.printers:
+                if printer.job != None:
+                    return False
+            return True
+
+    def wait(self, timeout=None):
+        '''Waits for the queue to drain. Returns False on timeout.'''
+        start = time.time()
+        with self.condition:
+            while not self.idle():
+                if timeout != None and time.time() - start > timeout:
+                    return False
+                self.condition.wait(1)
+        return True
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Print jobs on several Argentums from one queue.')
+    parser.add_argument('--virtual', type=int, default=0, help='number of virtual printers to use')
+    parser.add_argument('--baud', type=int, default=115200, help='virtual printer link rate, 0 for unthrottled')
+    parser.add_argument('--time-scale', type=float, default=0.0, help='fraction of virtual motion time to spend')
+    parser.add_argument('--passes', type=int, default=1, help='passes per job')
+    parser.add_argument('--files-dir', default='farm-files', help='where sliced images are written')
+    parser.add_argument('files', nargs='+', help='hex files or images to print')
+    args = parser.parse_args()
+
+    virtualPrinters = []
+    ports = None
+    if args.virtual > 0:
+        from virtualprinter import VirtualPrinter
+        for n in range(args.virtual):
+            vp = VirtualPrinter(baudRate=args.baud or None,
+                                timeScale=args.time_scale,
+                                seed=n,
+                                printerNumber='VIRTUAL{}'.format(n + 1))
+            vp.start()
+            virtualPrinters.append(vp)
+        ports = [vp.port for vp in virtualPrinters]
+
+    farm = PrinterFarm(args.files_dir)
+    try:
+        printers = farm.discover(ports)
+        if len(printers) == 0:
+            print('No printers found.')
+            sys.exit(1)
+        for printer in printers:
+            print('{} {}'.format(printer, printer.options))
+        start = time.time()
+        for path in args.files:
+            farm.submit(path, args.passes)
+        farm.start()
+        farm.wait()
+        for job in farm.jobs:
+            # Jobs canceled while queued never ran.
+            duration = job.duration()
+            print('{:30} {:8} {:12} {} {}'.format(os.path.basename(job.path),
+                                                  job.status, job.printer,
+                                                  'not run' if duration == None else '{:.2f}s'.format(duration),
+                                                  job.error or ''))
+        print('{} jobs in {:.2f}s'.format(len(farm.jobs), time.time() - start))
+        ok = all(job.status == 'done' for job in farm.jobs)
+    finally:
+        farm.close()
+        for vp in virtualPrinters:
+            vp.stop()
+    sys.exit(0 if ok else 1)
@@ -24,18 +24,88 @@
 
 import sys
 import io
+import numpy
 from simcon import SimulatorController
 from controllers import TestParsingController
+from binhex2txt import (Converter, walkBinary, binaryRecords, textLines,
+                        VALUES, CHUNK_SIZE)
+from hexpreview import parseInts
+
+OP_FIRING = 1
+OP_MOVE = ord('M')
+
+# A decoded command. Moves use axis and steps, firings the rest.
+COMMAND = numpy.dtype([('op', numpy.uint8), ('axis', 'S1'), ('steps', numpy.int64),
+                       ('firing1', numpy.uint8), ('address1', numpy.uint8),
+                       ('firing2', numpy.uint8), ('address2', numpy.uint8)])
+
+class CommandDecoder(Converter):
+    '''
+    Decodes a hex file with textual or binary firings, fed a chunk at a
+    time, into arrays of COMMAND in file order. Comments are skipped.
+    '''
+
+    binary = False
+
+    def convert(self, data, final):
+        if not self.binary and data.find(b'\x01') != -1:
+            self.binary = True
+        if self.binary:
+            return self.decodeBinary(data, final)
+        return self.decodeText(data, final)
+
+    def decodeBinary(self, data, final):
+        runs, segments, pos = walkBinary(data, self.offset, final)
+        records, starts = binaryRecords(data, runs, self.offset)
+        moves = [s for s in segments if not isinstance(s, int) and data[s[0]] == b'M']
+        commands = numpy.zeros(len(records) + len(moves), COMMAND)
+        # The walk has already checked the moves.
+        fields = [data[start:end].split() for start, end in moves]
+        at = numpy.concatenate((starts, numpy.array([start for start, end in moves], numpy.int64)))
+        order = numpy.argsort(at, kind='mergesort')
+        firings = order < len(records)
+        commands['op'][firings] = OP_FIRING
+        commands['firing1'][firings] = records[:, 1]
+        commands['address1'][firings] = records[:, 2]
+        commands['firing2'][firings] = records[:, 5]
+        commands['address2'][firings] = records[:, 6]
+        commands['op'][~firings] = OP_MOVE
+        commands['axis'][~firings] = [f[1] for f in fields]
+        commands['steps'][~firings] = [int(f[2]) for f in fields]
+        self.keep(data, pos)
+        return commands
+
+    def decodeText(self, data, final):
+        end = self.wholeLines(data, final)
+        if end == 0:
+            self.keep(data, 0)
+            return numpy.zeros(0, COMMAND)
+        text = numpy.frombuffer(data, numpy.uint8, end)
+        (starts, ends, lengths, firsts), firings, moves, comments = textLines(data, text, self.offset)
+        lines = numpy.sort(numpy.concatenate((firings, moves)))
+        commands = numpy.zeros(len(lines), COMMAND)
+        isFiring = firsts[lines] == ord('F')
+        f = starts[firings]
+        commands['op'][isFiring] = OP_FIRING
+        commands['address1'][isFiring] = VALUES[text[f + 2]]
+        commands['firing1'][isFiring] = VALUES[text[f + 3]] * 16 + VALUES[text[f + 4]]
+        commands['address2'][isFiring] = VALUES[text[f + 2]]
+        commands['firing2'][isFiring] = VALUES[text[f + 5]] * 16 + VALUES[text[f + 6]]
+        m = starts[moves]
+        commands['op'][~isFiring] = OP_MOVE
+        commands['axis'][~isFiring] = text[m + 2].view('S1')
+        commands['steps'][~isFiring] = parseInts(text, m + 4, ends[moves])
+        self.keep(data, end)
+        return commands
 
 class PrintFile:
     file = None
     fileName = None
     fileSize = 0
 
-    opCodes = {}
-
     def __init__(self, fileName, commandHandler=None):
         self.fileName = fileName
+        self.opCodes = {}
 
         if commandHandler:
             self.installCommandHandler(commandHandler)
@@ -87,6 +157,25 @@ class PrintFile:
 
         return primitives
 
+    def batches(self, chunkSize=CHUNK_SIZE):
+        '''The rest of the file as arrays of COMMAND, a chunk at a time.'''
+        decoder = CommandDecoder()
+        while True:
+            chunk = self.file.read(chunkSize)
+            if not chunk:
+                break
+            commands = decoder.feed(chunk)
+            if len(commands) > 0:
+                yield commands
+        commands = decoder.finish()
+        if len(commands) > 0:
+            yield commands
+
+    def dispatch(self):
+        '''Hands the rest of the file to the command handler, a batch at a time.'''
+        for commands in self.batches():
+            self.commandHandler.commandBatch(commands)
+
     def __iter__(self):
         return self
 
@@ -128,8 +217,7 @@ if __name__ == '__main__':
     th = SimulatorController()
     printFile = PrintFile(inputFileName, commandHandler=th)
 
-    for command in printFile:
-        pass
+    printFile.dispatch()
 
     #parser = PrintFileParser(inputFileName)
     #print(parser.packetCount())
@@ -80,6 +80,7 @@ class Argentum(QtGui.QMainWindow):
 
         self.printer = ArgentumPrinterController()
         self.printer.logSerial = self.getOption("log_serial", False)
+        self.printer.recordSessions = self.getOption("record_session", False)
         self.programmer = None
 
         self.printing = False
@@ -135,9 +136,10 @@ class Argentum(QtGui.QMainWindow):
         QtCore.QObject.connect(self.updatePortListTimer, QtCore.SIGNAL("timeout()"), self.updatePortList)
         self.updatePortListTimer.start(1000)
 
-        self.updatePosDisplayTimer = QtCore.QTimer()
-        QtCore.QObject.connect(self.updatePosDisplayTimer, QtCore.SIGNAL("timeout()"), self.updatePosDisplay)
-        self.updatePosDisplayTimer.start(3000)
+        self.printer.state.subscribe(self.printerStateChanged)
+        self.pollStateTimer = QtCore.QTimer()
+        QtCore.QObject.connect(self.pollStateTimer, QtCore.SIGNAL("timeout()"), self.pollState)
+        self.pollStateTimer.start(500)
 
         self.portListCombo.setSizePolicy(QtGui.QSizePolicy.Expanding,
                          QtGui.QSizePolicy.Fixed)
@@ -314,6 +316,9 @@ class Argentum(QtGui.QMainWindow):
         self.showConnectionLog = QtGui.QAction("&Show Connection Log", self)
         self.showConnectionLog.triggered.connect(self.connectionDialog.show)
 
+        self.exportSerialLogAction = QtGui.QAction("&Export Serial Log", self)
+        self.exportSerialLogAction.triggered.connect(self.exportSerialLogActionTriggered)
+
         self.showPrintHeadAction = QtGui.QAction('Print &Head', self)
         self.showPrintHeadAction.setCheckable(True)
         self.showPrintHeadAction.triggered.connect(self.printView.showPrintHeadActionTriggered)
@@ -371,6 +376,10 @@ class Argentum(QtGui.QMainWindow):
         self.printAction.setEnabled(False)
         self.printAction.triggered.connect(self.filePrintTriggered)
         fileMenu.addAction(self.printAction)
+        self.resumePrintAction = QtGui.QAction('&Resume Print', self)
+        self.resumePrintAction.setEnabled(False)
+        self.resumePrintAction.triggered.connect(self.fileResumePrintTriggered)
+        fileMenu.addAction(self.resumePrintAction)
         fileMenu.addSeparator()
         self.exitAction = QtGui.QAction("E&xit", self)
         self.exitAction.triggered.connect(self.fileExitActionTriggered)
@@ -440,6 +449,7 @@ class Argentum(QtGui.QMainWindow):
         printerMenu.addAction(self.rollerCalibrationAction)
         printerMenu.addAction(self.changePrinterNumAction)
         printerMenu.addAction(self.showConnectionLog)
+        printerMenu.addAction(self.exportSerialLogAction)
         printerMenu.addSeparator()
 
         utilityMenu = printerMenu.addMenu('Utilities')
@@ -524,19 +534,17 @@ class Argentum(QtGui.QMainWindow):
         progress.setLabelText("Stepper motor testing.\n\nPress cancel to stop.")
         progress.show()
         self.printer.home()
+        # Keep the next move queued on the printer while the last one runs.
+        pipeline = self.printer.pipeline(control=lambda: not progress.wasCanceled())
+        targets = [(2500, 2500), (7500, 7500)]
+        last = None
         while not progress.wasCanceled():
-            self.printer.moveTo(2500, 2500, withOk=True)
-            while self.printer.waitForResponse(timeout=1, expect='Ok') == None:
-                QtGui.QApplication.processEvents()
-                if progress.wasCanceled():
-                    break
-            if progress.wasCanceled():
-                break
-            self.printer.moveTo(7500, 7500, withOk=True)
-            while self.printer.waitForResponse(timeout=1, expect='Ok') == None:
+            move = pipeline.moveTo(*targets[0])
+            targets.reverse()
+            while last and not last.wait(0.1) and not progress.wasCanceled():
                 QtGui.QApplication.processEvents()
-                if progress.wasCanceled():
-                    break
+            last = move
+        pipeline.finish(10)
         self.printer.home()
 
     def startUpdateLoop(self):
@@ -681,7 +689,11 @@ class Argentum(QtGui.QMainWindow):
     def monitor(self):
         data = self.printer.monitor()
         if data:
-            self.appendOutput(data.decode('utf-8', 'ignore'))
+            text = data.decode('utf-8', 'ignore')
+            self.printer.state.observe(text)
+            self.appendOutput(text)
+        while len(self.printer.unhandled) > 0:
+            self.appendOutput(self.printer.unhandled.popleft())
         QtCore.QTimer.singleShot(100, self.monitor)
 
     ### Button Functions ###
@@ -767,6 +779,17 @@ class Argentum(QtGui.QMainWindow):
 
         self.printFile()
 
+    def exportSerialLogActionTriggered(self):
+        if self.printer.serialLog == None:
+            QtGui.QMessageBox.information(self,
+                    'Export Serial Log',
+                    'Nothing has been logged. Turn on serial logging in the Preferences first.')
+            return
+
+        filename = str(QtGui.QFileDialog.getSaveFileName(self, 'Export Serial Log', 'serial.txt', "Text files (*.txt);; All files (*)"))
+        if filename:
+            self.printer.serialLog.export(filename)
+
     def updateActionTriggered(self):
         tokenAsker = SupportTokenAsker(self)
         if tokenAsker.exec_() == QtGui.QDialog.Rejected:
@@ -1089,8 +1112,8 @@ class Argentum(QtGui.QMainWindow):
                 return False
             if not self.printer.connected:
                 return False
-            volts = self.printer.volt()
-            if volts == 0:
+            volts = self.printer.state.query('volts')
+            if volts == None:
                 continue
             if wantNoPower and volts < 5:
                 progress.hide()
@@ -1197,12 +1220,16 @@ class Argentum(QtGui.QMainWindow):
     def filePrintTriggered(self):
         self.printView.startPrint()
 
+    def fileResumePrintTriggered(self):
+        self.printView.startPrint(resume=True)
+
     def fileExitActionTriggered(self):
         if self.printView.closeLayout():
             self.close()
 
     def enableConnectionSpecificControls(self, enabled):
         self.printAction.setEnabled(enabled)
+        self.resumePrintAction.setEnabled(enabled)
         self.optionsAction.setEnabled(enabled)
         self.uploadFileAction.setEnabled(enabled)
         self.printFileAction.setEnabled(enabled)
@@ -1257,7 +1284,7 @@ class Argentum(QtGui.QMainWindow):
             self.printer.turnLightsOff()
         self.printView.update()
 
-        options = self.printer.getOptions()
+        options = self.printer.state.refresh('options')
         if options != None:
             for key, value in options.items():
                 self.options[key] = value
@@ -1289,6 +1316,8 @@ class Argentum(QtGui.QMainWindow):
             if curPort == "" or self.portListCombo.findText(curPort) == -1:
                 if self.portListCombo.count() == 1:
                     curPort = self.portListCombo.itemText(0)
+                elif self.autoConnect and not self.printer.connected and not self.flashing:
+                    self.startAutoConnect([str(port[0]) for port in portList])
                 else:
                     self.setConnectionStatus('Multiple printers connected.')
                     self.tabWidget.setCurrentWidget(self.console)
@@ -1301,19 +1330,25 @@ class Argentum(QtGui.QMainWindow):
             else:
                 self.portListCombo.setCurrentIndex(idx)
                 if self.autoConnect and not self.printer.connected and curPort != NO_PRINTER and not self.flashing:
-                    self.autoConnect = False
-                    self.autoConnectFailed = False
-                    self.autoConnected = False
-                    self.autoConnecting = True
-                    self.setConnectionStatus("Connecting...")
-                    QtCore.QTimer.singleShot(100, self.autoConnectUpdater)
-                    self.autoConnectThread = threading.Thread(target=self.autoConnectLoop)
-                    self.autoConnectThread.port = str(curPort)
-                    self.autoConnectThread.start()
+                    self.startAutoConnect([str(curPort)])
+
+    def startAutoConnect(self, ports):
+        self.autoConnect = False
+        self.autoConnectFailed = False
+        self.autoConnected = False
+        self.autoConnecting = True
+        self.setConnectionStatus("Connecting...")
+        QtCore.QTimer.singleShot(100, self.autoConnectUpdater)
+        self.autoConnectThread = threading.Thread(target=self.autoConnectLoop)
+        self.autoConnectThread.ports = ports
+        self.autoConnectThread.start()
 
     def autoConnectUpdater(self):
         if self.autoConnected:
             if self.printer.connected:
+                idx = self.portListCombo.findText(self.printer.port)
+                if idx != -1:
+                    self.portListCombo.setCurrentIndex(idx)
                 self.autoConnect = self.getOption("autoconnect", True)
                 self.autoConnecting = False
                 self.printerConnected()
@@ -1327,13 +1362,17 @@ class Argentum(QtGui.QMainWindow):
         QtCore.QTimer.singleShot(100, self.autoConnectUpdater)
 
     def autoConnectLoop(self):
-        port = self.autoConnectThread.port
-        print("autoConnectLoop running with port={}".format(port))
-        if port != NO_PRINTER:
-            if self.printer.connect(port=port):
-                self.autoConnected = True
-            else:
-                self.autoConnectFailed = True
+        ports = self.autoConnectThread.ports
+        print("autoConnectLoop running with ports={}".format(ports))
+        if len(ports) == 1:
+            connected = self.printer.connect(port=ports[0])
+        else:
+            # Several boards attached; take whichever printer answers first.
+            connected = self.printer.connectFirst(ports)
+        if connected:
+            self.autoConnected = True
+        else:
+            self.autoConnectFailed = True
 
     def copy(self):
         if self.tabWidget.currentWidget() == self.console:
@@ -1359,19 +1398,35 @@ class Argentum(QtGui.QMainWindow):
         getPrinterNumberDialog = GetPrinterNumberDialog(self)
         getPrinterNumberDialog.exec_()
 
-    def updatePosDisplay(self, pos=None, doit=False):
-        if not doit and not self.getOption("poll_for_pos", True):
+    def wantPosition(self):
+        if not self.getOption("poll_for_pos", True):
+            return False
+        if self.printing or self.printer.printing:
+            return False
+        if self.tabWidget.currentWidget() == self.printWidget and self.printView.showingPrintHead == False:
+            return False
+        return True
+
+    def pollState(self):
+        if not self.printer.connected:
             return
+        if self.wantPosition():
+            self.printer.state.poll()
+        else:
+            self.printer.state.poll(exclude=['pos'])
+
+    def printerStateChanged(self, name, value):
+        if name == 'pos' and self.wantPosition():
+            self.updatePosDisplay(value)
+
+    def updatePosDisplay(self, pos=None, doit=False):
         if pos == None:
             if not self.printer.connected:
                 return
-            if not doit and self.printer.getTimeSinceLastCommand() < 1:
-                return
-            if self.printing or self.printer.printing:
-                return
-            if self.tabWidget.currentWidget() == self.printWidget and self.printView.showingPrintHead == False:
-                return
-            pos = self.printer.getPosition()
+            if doit:
+                pos = self.printer.state.query('pos')
+            else:
+                pos = self.printer.state.get('pos')
             if pos == None:
                 return
         self.lastPos = pos
@@ -1530,7 +1585,8 @@ class Argentum(QtGui.QMainWindow):
         if self.sentVolt or not self.printer.connected:
             return
         self.sentVolt = True
-        if self.printer.volt() < 9:
+        volts = self.printer.state.refresh('volts', maxAge=5)
+        if volts == None or volts < 9:
             QtGui.QMessageBox.information(self, "Printer error", "The power cable is not connected or the power switch is off.")
 
     def incrementX(self):
@@ -1624,9 +1680,9 @@ class Argentum(QtGui.QMainWindow):
 
     def getPrinterNumber(self):
         if self.printer.connected:
-            pnum = self.printer.printerNumber
+            pnum = self.printer.state.get('pnum')
             if pnum == None:
-                pnum = self.printer.getPrinterNumber()
+                pnum = self.printer.state.query('pnum')
             if pnum != None:
                 self.options["printer_number"] = pnum
                 self.saveOptions()
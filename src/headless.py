@@ -0,0 +1,423 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+    Argentum Control GUI
+
+    Copyright (C) 2013 Isabella Stevens
+    Copyright (C) 2014 Michael Shiel
+    Copyright (C) 2015 Trent Waddington
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+
+# Prints layouts without the GUI or PyQt4, for scripts and unattended batch
+# runs. Images are sliced with PIL and printed with the GUI's print loop,
+# see printloop.py.
+#
+#   python headless.py print [--port /dev/ttyACM0] [--passes 2] job.layout
+#   python headless.py slice job.layout
+#
+# A daemon keeps the printer connected and prints queued layouts one after
+# another. It takes one JSON request per line on a UNIX socket:
+#
+#   python headless.py serve [--socket ~/.argentum.sock] [--port ...]
+#   python headless.py submit [--passes 2] job.layout
+#   python headless.py status
+#   python headless.py cancel 3
+#
+# Only raster images and hex files can be printed this way; Gerber and SVG
+# files need Qt to render.
+
+import os
+import sys
+import time
+import json
+import socket
+import argparse
+import threading
+import collections
+import SocketServer
+from ArgentumPrinterController import ArgentumPrinterController
+from layoutfile import readLayout
+from checkpoint import PrintCheckpoint
+from printloop import PrintLoop, PrintLoopError
+from printers import CALIBRATION_DEFAULTS, printerPorts
+
+DEFAULT_SOCKET = os.path.expanduser('~/.argentum.sock')
+DEFAULT_FILES_DIR = os.path.join(os.path.expanduser('~'), 'Documents', 'Argentum')
+
+class PrintJobError(PrintLoopError):
+    pass
+
+class HeadlessLoop(PrintLoop):
+    '''The GUI's print loop, reporting to a HeadlessJob.'''
+
+    def __init__(self, printer, images, paths, checkpoint, job):
+        PrintLoop.__init__(self, printer, images, paths, checkpoint)
+        self.job = job
+
+    def canceled(self):
+        return self.job.canceled
+
+    def message(self, text):
+        self.job.message = text
+
+    def progressFunc(self, pos, size):
+        return self.job.progressFunc(pos, size)
+
+class HeadlessJob(object):
+    def __init__(self, number, layout, passes=1, rollers=False):
+        self.number = number
+        self.layout = layout
+        self.passes = passes
+        self.rollers = rollers
+        self.status = 'queued'
+        self.message = ''
+        self.progress = 0.0
+        self.error = None
+        self.canceled = False
+        self.started = None
+        self.finished = None
+
+    def progressFunc(self, pos, size):
+        self.progress = float(pos) / size
+        return not self.canceled
+
+    def toDict(self):
+        return {'job': self.number,
+                'layout': self.layout,
+                'passes': self.passes,
+                'status': self.status,
+                'message': self.message,
+                'progress': self.progress,
+                'error': self.error,
+                'started': self.started,
+                'finished': self.finished}
+
+class HeadlessPrinter(object):
+    '''
+    Slices and prints layouts on one printer. options overrides the
+    calibration read from the printer's EEPROM.
+    '''
+
+    def __init__(self, port=None, filesDir=DEFAULT_FILES_DIR, options=None, dilateCount=None):
+        self.port = port
+        self.filesDir = filesDir
+        self.options = options
+        self.dilateCount = dilateCount
+        self.printer = ArgentumPrinterController(port)
+        if not os.path.isdir(filesDir):
+            os.makedirs(filesDir)
+
+    def connect(self):
+        if self.printer.connected:
+            return True
+        if self.port != None:
+            return self.printer.connect(self.port)
+        ports = printerPorts()
+        if len(ports) == 0:
+            self.printer.lastError = "No printer connected."
+            return False
+        return self.printer.connectFirst(ports)
+
+    def disconnect(self):
+        self.printer.disconnect()
+
+    def calibration(self):
+        if self.options != None:
+            return self.options
+        options = None
+        if self.printer.connected:
+            options = self.printer.state.refresh('options', maxAge=60)
+        if options == None:
+            options = CALIBRATION_DEFAULTS
+        return options
+
+    def hexPath(self, image):
+        return os.path.join(self.filesDir, image.slicedHexFilename())
+
+    def isSliced(self, image):
+        hexPath = self.hexPath(image)
+        if not os.path.exists(hexPath) or os.path.getsize(hexPath) == 0:
+            return False
+        hexModified = os.path.getmtime(hexPath)
+        if os.path.getmtime(image.filename) >= hexModified:
+            return False
+        if image.lastResized and image.lastResized >= hexModified:
+            return False
+        return True
+
+    def slice(self, images, job=None):
+        from imageproc import ImageProcessor
+        options = self.calibration()
+        for image in images:
+            if image.filename.endswith(".hex") or self.isSliced(image):
+                continue
+            if job:
+                job.message = "Slicing {}".format(os.path.basename(image.filename))
+            ip = ImageProcessor(horizontal_offset=int(options['horizontal_offset']),
+                                vertical_offset=int(options['vertical_offset']),
+                                overlap=int(options['print_overlap']),
+                                dilateCount=self.dilateCount)
+            progressFunc = None
+            if job:
+                progressFunc = job.progressFunc
+            hexPath = self.hexPath(image)
+            try:
+                ip.sliceImage(image.filename, hexPath, progressFunc=progressFunc,
+                              size=image.sliceSize())
+            except IOError as e:
+                if os.path.exists(hexPath):
+                    os.remove(hexPath)
+                raise PrintJobError("Can't slice {}: {}".format(image.filename, e))
+            if job and job.canceled:
+                return False
+        return True
+
+    def loadImages(self, layout):
+        images = [image for image in readLayout(layout) if image.visible]
+        for image in images:
+            if image.left == None or image.bottom == None or image.width == None or image.height == None:
+                raise PrintJobError("{} has no position in {}".format(image.filename, layout))
+            if image.filename.endswith(".hex"):
+                image.hexFilename = os.path.basename(image.filename)
+        return images
+
+    def printLayout(self, layout, passes=1, rollers=False, job=None):
+        if job == None:
+            job = HeadlessJob(0, layout, passes, rollers)
+        images = self.loadImages(layout)
+        if len(images) == 0:
+            raise PrintJobError("Nothing to print in {}".format(layout))
+        if not self.connect():
+            raise PrintJobError(self.printer.lastError)
+        printer = self.printer
+        if (printer.version == None or
+                printer.majorVersion == 0 and printer.minorVersion < 15):
+            raise PrintJobError("Printer firmware needs upgrade.")
+        if not self.slice(images, job):
+            return False
+
+        paths = []
+        for image in images:
+            if image.filename.endswith(".hex"):
+                paths.append(image.filename)
+            else:
+                paths.append(self.hexPath(image))
+
+        checkpoint = PrintCheckpoint(images, passes, rollers)
+        return HeadlessLoop(printer, images, paths, checkpoint, job).run()
+
+    def runJob(self, job):
+        job.status = 'running'
+        job.started = time.time()
+        try:
+            if self.printLayout(job.layout, job.passes, job.rollers, job):
+                job.status = 'done'
+                job.message = 'Print complete'
+            elif job.canceled:
+                job.status = 'canceled'
+            else:
+                job.status = 'failed'
+        except PrintLoopError as e:
+            job.status = 'failed'
+            job.error = str(e)
+        except Exception as e:
+            job.status = 'failed'
+            job.error = "Unknown Error: {}".format(e)
+        job.finished = time.time()
+        return job.status == 'done'
+
+class JobDaemon(object):
+    '''Prints submitted layouts one after another on one printer.'''
+
+    def __init__(self, headlessPrinter, socketPath=DEFAULT_SOCKET):
+        self.headlessPrinter = headlessPrinter
+        self.socketPath = socketPath
+        self.jobs = []
+        self.queue = collections.deque()
+        self.condition = threading.Condition()
+        self.running = False
+        self.server = None
+
+    def submit(self, layout, passes=1, rollers=False):
+        with self.condition:
+            job = HeadlessJob(len(self.jobs) + 1, os.path.abspath(layout), passes, rollers)
+            self.jobs.append(job)
+            self.queue.append(job)
+            self.condition.notifyAll()
+        return job
+
+    def job(self, number):
+        for job in self.jobs:
+            if job.number == number:
+                return job
+        return None
+
+    def cancel(self, number):
+        with self.condition:
+            job = self.job(number)
+            if job == None:
+                return None
+            job.canceled = True
+            if job in self.queue:
+                self.queue.remove(job)
+                job.status = 'canceled'
+            return job
+
+    def workLoop(self):
+        while True:
+            with self.condition:
+                while self.running and len(self.queue) == 0:
+                    self.condition.wait(1)
+                if not self.running:
+                    return
+                job = self.queue.popleft()
+            self.headlessPrinter.runJob(job)
+
+    def handle(self, request):
+        cmd = request.get('cmd')
+        if cmd == 'print':
+            job = self.submit(request['layout'], int(request.get('passes', 1)),
+                              bool(request.get('rollers', False)))
+            return job.toDict()
+        if cmd == 'status':
+            return {'connected': self.headlessPrinter.printer.connected,
+                    'jobs': [job.toDict() for job in self.jobs]}
+        if cmd == 'cancel':
+            job = self.cancel(int(request['job']))
+            if job == None:
+                return {'error': 'no such job'}
+            return job.toDict()
+        if cmd == 'shutdown':
+            return {'status': 'stopping'}
+        return {'error': 'unknown command {}'.format(cmd)}
+
+    def serve(self):
+        if os.path.exists(self.socketPath):
+            os.remove(self.socketPath)
+        daemon = self
+        class Handler(SocketServer.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    try:
+                        reply = daemon.handle(json.loads(line))
+                    except (ValueError, KeyError) as e:
+                        reply = {'error': 'bad request: {}'.format(e)}
+                    self.wfile.write(json.dumps(reply) + '\n')
+                    self.wfile.flush()
+                    if reply.get('status') == 'stopping':
+                        threading.Thread(target=daemon.stop).start()
+        class Server(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+            daemon_threads = True
+        self.server = Server(self.socketPath, Handler)
+        self.running = True
+        worker = threading.Thread(target=self.workLoop)
+        worker.daemon = True
+        worker.start()
+        try:
+            self.server.serve_forever()
+        finally:
+            with self.condition:
+                self.running = False
+                self.condition.notifyAll()
+            self.server.server_close()
+            if os.path.exists(self.socketPath):
+                os.remove(self.socketPath)
+            self.headlessPrinter.disconnect()
+
+    def stop(self):
+        if self.server != None:
+            self.server.shutdown()
+
+def request(socketPath, message):
+    '''Sends one request to a running daemon and returns its reply.'''
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    s.connect(socketPath)
+    try:
+        s.sendall(json.dumps(message) + '\n')
+        reply = s.makefile().readline()
+    finally:
+        s.close()
+    return json.loads(reply)
+
+def formatJob(job):
+    line = '{:4} {:9} {:5.1f}% {}'.format(job['job'], job['status'],
+                                         job['progress'] * 100, job['layout'])
+    if job.get('error'):
+        line = line + ' - ' + job['error']
+    elif job.get('message'):
+        line = line + ' - ' + job['message']
+    return line
+
+if __name__ == '__main__':
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--port', default=None, help='serial port, otherwise the first printer found')
+    common.add_argument('--files-dir', default=DEFAULT_FILES_DIR, help='where sliced images are written')
+    common.add_argument('--socket', default=DEFAULT_SOCKET, help='UNIX socket of the job daemon')
+    common.add_argument('--passes', type=int, default=1, help='passes per layout')
+    common.add_argument('--rollers', action='store_true', help='dry with the rollers after each pass')
+    parser = argparse.ArgumentParser(description='Print Argentum layouts without the GUI.')
+    actions = parser.add_subparsers(dest='action')
+    for action, help in [('print', 'slice and print layouts'),
+                         ('slice', 'only slice the images in layouts'),
+                         ('submit', 'queue layouts on the daemon')]:
+        actions.add_parser(action, parents=[common], help=help).add_argument('args', nargs='+', metavar='layout')
+    actions.add_parser('cancel', parents=[common], help='cancel queued or running jobs').add_argument('args', nargs='+', metavar='job')
+    for action, help in [('serve', 'run the job daemon'),
+                         ('status', 'show the daemon\'s jobs'),
+                         ('shutdown', 'stop the daemon')]:
+        actions.add_parser(action, parents=[common], help=help)
+    args = parser.parse_args()
+
+    ok = True
+    if args.action in ('print', 'slice'):
+        headlessPrinter = HeadlessPrinter(args.port, args.files_dir)
+        try:
+            for layout in args.args:
+                if args.action == 'slice':
+                    headlessPrinter.slice(headlessPrinter.loadImages(layout))
+                    continue
+                job = HeadlessJob(0, layout, args.passes, args.rollers)
+                headlessPrinter.runJob(job)
+                print('{}: {} {}'.format(layout, job.status, job.error or ''))
+                ok = ok and job.status == 'done'
+        except PrintLoopError as e:
+            print(e)
+            ok = False
+        finally:
+            headlessPrinter.disconnect()
+    elif args.action == 'serve':
+        JobDaemon(HeadlessPrinter(args.port, args.files_dir), args.socket).serve()
+    elif args.action == 'submit':
+        for layout in args.args:
+            print(formatJob(request(args.socket, {'cmd': 'print',
+                                                  'layout': os.path.abspath(layout),
+                                                  'passes': args.passes,
+                                                  'rollers': args.rollers})))
+    elif args.action == 'status':
+        reply = request(args.socket, {'cmd': 'status'})
+        print('Printer {}connected.'.format('' if reply['connected'] else 'not '))
+        for job in reply['jobs']:
+            print(formatJob(job))
+    elif args.action == 'cancel':
+        for number in args.args:
+            reply = request(args.socket, {'cmd': 'cancel', 'job': int(number)})
+            print(reply.get('error') or formatJob(reply))
+    elif args.action == 'shutdown':
+        request(args.socket, {'cmd': 'shutdown'})
+    sys.exit(0 if ok else 1)
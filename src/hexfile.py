@@ -0,0 +1,377 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+    Argentum Control GUI
+
+    Copyright (C) 2013 Isabella Stevens
+    Copyright (C) 2014 Michael Shiel
+    Copyright (C) 2015 Trent Waddington
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+# Helpers for working with Argentum .hex job files that don't depend on Qt,
+# so they can be shared by the printer controller, the emulators and tools.
+
+import os
+import mmap
+import hashlib
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Below this many bytes a loop is quicker than setting up the arrays.
+DJB2_VECTOR_MIN = 256
+DJB2_PIECE = 1 << 16
+djb2Powers = None
+
+def calcDJB2(contents, hash=5381):
+    # The firmware hashes signed chars, so bytes >= 128 are negative.
+    # Pass the previous value as hash to continue a running hash.
+    if numpy != None and len(contents) >= DJB2_VECTOR_MIN:
+        return vectorDJB2(contents, hash)
+    for c in contents:
+        cval = ord(c)
+        if cval >= 128:
+            cval = -(256 - cval)
+        hash = hash * 33 + cval
+        hash = hash & 0xffffffff
+    return hash
+
+def djb2Table():
+    '''33^k mod 2^32 for k up to DJB2_PIECE.'''
+    global djb2Powers
+    if djb2Powers is None:
+        djb2Powers = numpy.cumprod(numpy.concatenate(([1], numpy.repeat(33, DJB2_PIECE))).astype(numpy.uint32),
+                                   dtype=numpy.uint32)
+    return djb2Powers
+
+def vectorDJB2(contents, hash=5381):
+    '''
+    calcDJB2 with NumPy. After n more bytes c the hash is
+    hash * 33^n + sum(c[i] * 33^(n-1-i)), all mod 2^32, which uint32
+    arithmetic gives by wrapping.
+    '''
+    powers = djb2Table()
+    data = numpy.frombuffer(contents, numpy.int8)
+    for pos in xrange(0, len(data), DJB2_PIECE):
+        piece = data[pos:pos + DJB2_PIECE].astype(numpy.uint32)
+        n = len(piece)
+        weighted = numpy.multiply(piece, powers[n - 1::-1], dtype=numpy.uint32)
+        hash = (hash * int(powers[n]) + int(weighted.sum(dtype=numpy.uint32))) & 0xffffffff
+    return hash
+
+def fileDJB2(contents):
+    # The djb2 the printer reports for a file, as 8 hex digits. Files can
+    # carry it in their header, or in a '# <djb2>' first line, so it doesn't
+    # need computing.
+    header, body = splitHeader(contents)
+    if header != None and header.djb2 != None:
+        return header.djb2
+    if len(contents) > 10 and contents[0] == '#' and contents[1] == ' ' and contents[10] == '\n':
+        return contents[2:10]
+    return "{:08x}".format(calcDJB2(body))
+
+# Sliced files start with a header line describing the job:
+#
+#   #argentum 1 djb2=1c2f86a5 size=640x480 passes=12 source=<md5> slicer=726,0,103,3
+#
+# The djb2 is of the rest of the file, which is all that is uploaded: the
+# header is stripped before sending, so it is also the djb2 the printer
+# reports for the file. size is the image in pixels, source the MD5 of the
+# image it was sliced from and slicer the head offset, vertical offset,
+# overlap and dilate count it was sliced with. Readers ignore keys they
+# don't know, and any key may be missing.
+
+HEADER_TAG = '#argentum'
+HEADER_VERSION = 1
+MAX_HEADER = 256
+
+class HexHeader(object):
+    def __init__(self, version=HEADER_VERSION, djb2=None, width=None,
+                 height=None, passes=None, source=None, slicer=None):
+        self.version = version
+        self.djb2 = djb2
+        self.width = width
+        self.height = height
+        self.passes = passes
+        self.source = source
+        self.slicer = slicer
+
+    def format(self):
+        fields = [HEADER_TAG, str(self.version)]
+        if self.djb2 != None:
+            fields.append('djb2=' + self.djb2)
+        if self.width != None and self.height != None:
+            fields.append('size={}x{}'.format(self.width, self.height))
+        if self.passes != None:
+            fields.append('passes={}'.format(self.passes))
+        if self.source != None:
+            fields.append('source=' + self.source)
+        if self.slicer != None:
+            fields.append('slicer=' + ','.join([str(v) for v in self.slicer]))
+        return ' '.join(fields)
+
+    @classmethod
+    def parse(cls, line):
+        fields = line.rstrip('\r\n').split(' ')
+        if len(fields) < 2 or fields[0] != HEADER_TAG:
+            return None
+        try:
+            header = cls(int(fields[1]))
+            for field in fields[2:]:
+                key, eq, value = field.partition('=')
+                if key == 'djb2':
+                    header.djb2 = value
+                elif key == 'size':
+                    width, height = value.split('x')
+                    header.width = int(width)
+                    header.height = int(height)
+                elif key == 'passes':
+                    header.passes = int(value)
+                elif key == 'source':
+                    header.source = value
+                elif key == 'slicer':
+                    header.slicer = [int(v) for v in value.split(',')]
+        except ValueError:
+            return None
+        return header
+
+def splitHeader(contents):
+    '''Returns the header of a hex file, or None, and the rest of it.'''
+    if not contents.startswith(HEADER_TAG + ' '):
+        return None, contents
+    nl = contents.find('\n')
+    if nl == -1:
+        nl = len(contents)
+    header = HexHeader.parse(contents[:nl])
+    if header == None:
+        return None, contents
+    return header, contents[nl+1:]
+
+def readHeader(path):
+    '''The header of a hex file without reading the rest of it.'''
+    f = open(path, 'rb')
+    line = f.readline(MAX_HEADER)
+    f.close()
+    if not line.startswith(HEADER_TAG + ' '):
+        return None
+    return HexHeader.parse(line)
+
+def addHeader(path, header):
+    '''
+    Puts header at the top of a hex file, filling in the djb2 and pass count
+    from the file.
+    '''
+    f = open(path, 'rb')
+    old, body = splitHeader(f.read())
+    f.close()
+    header.djb2 = "{:08x}".format(calcDJB2(body))
+    header.passes = 0
+    for line in body.split('\n'):
+        if isPassEnd(line):
+            header.passes = header.passes + 1
+    f = open(path, 'wb')
+    f.write(header.format() + '\n')
+    f.write(body)
+    f.close()
+    return header
+
+BLOCK_SIZE = 1024
+
+def blockTrailer(hash):
+    # Uploads send the running hash after every block, 7 bits per byte.
+    return (chr( hash        & 0x7f) +
+            chr((hash >>  7) & 0x7f) +
+            chr((hash >> 14) & 0x7f) +
+            chr((hash >> 21) & 0x7f) +
+            chr((hash >> 28) & 0x0f))
+
+def blockTrailers(contents, blockSize=BLOCK_SIZE):
+    if numpy != None and len(contents) >= blockSize * 4 and blockSize <= DJB2_PIECE:
+        return [blockTrailer(hash) for hash in blockHashes(contents, blockSize)]
+    trailers = []
+    hash = 5381
+    for pos in range(0, len(contents), blockSize):
+        hash = calcDJB2(contents[pos:pos+blockSize], hash)
+        trailers.append(blockTrailer(hash))
+    return trailers
+
+def blockHashes(contents, blockSize=BLOCK_SIZE):
+    '''
+    The running djb2 at the end of every block. The blocks are hashed on
+    their own a few hundred at a time with NumPy, as in vectorDJB2, and
+    then chained: each running hash is the last times 33^blockSize plus
+    the block's own.
+    '''
+    powers = djb2Table()
+    weights = powers[blockSize - 1::-1]
+    scale = int(powers[blockSize])
+    data = numpy.frombuffer(contents, numpy.int8)
+    full = len(data) // blockSize
+    hashes = []
+    hash = 5381
+    step = 256
+    for first in xrange(0, full, step):
+        count = min(step, full - first)
+        blocks = data[first * blockSize:(first + count) * blockSize].reshape(count, blockSize)
+        own = numpy.multiply(blocks.astype(numpy.uint32), weights, dtype=numpy.uint32).sum(axis=1, dtype=numpy.uint32)
+        for value in own.tolist():
+            hash = (hash * scale + value) & 0xffffffff
+            hashes.append(hash)
+    if full * blockSize < len(data):
+        hashes.append(calcDJB2(buffer(contents, full * blockSize), hash))
+    return hashes
+
+def isPassEnd(line):
+    # Every pass ends with a line feed, which the firmware reports with a '.'.
+    return len(line) > 3 and line[0] == 'M' and line[2] == 'X'
+
+class PassCounter(object):
+    '''
+    Counts the passes in a job that arrives in pieces. Give it a
+    Decompressor to count the passes in a compressed upload.
+    '''
+
+    def __init__(self, decoder=None):
+        self.decoder = decoder
+        self.pending = ''
+        self.passes = 0
+
+    def feed(self, data):
+        if self.decoder != None:
+            data = self.decoder.feed(data)
+        lines = (self.pending + data).split('\n')
+        self.pending = lines.pop()
+        for line in lines:
+            if isPassEnd(line):
+                self.passes = self.passes + 1
+        return self.passes
+
+# Sidecars are what uploadcache.py and passindex.py remember about a hex
+# file. They're kept in a per-user directory rather than next to the file,
+# which may be read-only or shared, and are named by the file's full path.
+SIDECAR_DIR = os.path.join(os.path.expanduser('~'), '.argentum', 'cache')
+
+def sidecarPath(path, suffix, create=False):
+    '''
+    Where the sidecar for the hex file at path is kept. With create the
+    directory is made if need be, which can raise OSError.
+    '''
+    key = os.path.normcase(os.path.abspath(path))
+    if isinstance(key, unicode):
+        key = key.encode('utf-8')
+    if create and not os.path.isdir(SIDECAR_DIR):
+        os.makedirs(SIDECAR_DIR)
+    return os.path.join(SIDECAR_DIR, hashlib.md5(key).hexdigest() + suffix)
+
+CHUNK_SIZE = 1 << 20
+
+class HexFile(object):
+    '''
+    A hex file mapped into memory rather than read into a string. Views
+    and chunks are buffers onto the mapping, so hashing, uploading or
+    scanning a file of tens of MB doesn't copy all of it, and pages are
+    only read as they're used. The body is the file without its header,
+    which is what gets uploaded.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        f = open(path, 'rb')
+        try:
+            self.size = os.fstat(f.fileno()).st_size
+            if self.size > 0:
+                self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                # Empty files can't be mapped.
+                self.data = ''
+        finally:
+            f.close()
+        self.header = None
+        self.start = 0
+        if self.data[:len(HEADER_TAG) + 1] == HEADER_TAG + ' ':
+            nl = self.data.find('\n')
+            if nl == -1:
+                nl = self.size
+            self.header = HexHeader.parse(self.data[:nl])
+            if self.header != None:
+                self.start = min(nl + 1, self.size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def close(self):
+        # Buffers from view() and chunks() mustn't be used after this.
+        if not isinstance(self.data, str):
+            self.data.close()
+        self.data = ''
+
+    def view(self, start=0, end=None):
+        if end == None:
+            end = self.size
+        return buffer(self.data, start, max(end - start, 0))
+
+    def body(self):
+        return self.view(self.start)
+
+    def read(self):
+        '''The body as a string, for code that needs one.'''
+        return self.data[self.start:]
+
+    def chunks(self, start=None, size=CHUNK_SIZE):
+        if start == None:
+            start = self.start
+        for pos in xrange(start, self.size, size):
+            yield self.view(pos, min(pos + size, self.size))
+
+    def lines(self, start=None):
+        '''The lines of the body, without their newlines.'''
+        pos = self.start if start == None else start
+        data = self.data
+        while pos < self.size:
+            nl = data.find('\n', pos)
+            if nl == -1:
+                nl = self.size
+            yield data[pos:nl]
+            pos = nl + 1
+
+    def md5(self):
+        md5 = hashlib.md5()
+        for chunk in self.chunks():
+            md5.update(chunk)
+        return md5.hexdigest()
+
+    def djb2(self):
+        # The djb2 the printer reports for the file once it is uploaded.
+        if self.header != None and self.header.djb2 != None:
+            return self.header.djb2
+        if self.size > 10 and self.data[0:2] == '# ' and self.data[10] == '\n':
+            return self.data[2:10]
+        hash = 5381
+        for chunk in self.chunks():
+            hash = calcDJB2(chunk, hash)
+        return "{:08x}".format(hash)
@@ -0,0 +1,242 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+    Argentum Control GUI
+
+    Copyright (C) 2013 Isabella Stevens
+    Copyright (C) 2014 Michael Shiel
+    Copyright (C) 2015 Trent Waddington
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+# Renders a hex file back into a picture of what it prints, for previewing
+# jobs that were imported as hex files. Every firing is placed with the
+# nozzle geometry in CartridgeMath. The file is decoded with NumPy a chunk
+# of whole lines at a time, into a canvas with one pixel for every
+# scale x scale pixels of the sliced image. The canvas is white, ink from the
+# first cartridge is black and ink from the second (dilated) cartridge is
+# grey.
+
+import sys
+import numpy
+from CartridgeMath import offset_for_nozzle, nozzle_from_primitive_address
+from hexfile import HexFile
+
+# The defaults of ImageProcessor, used when the file has no header.
+SPN = 3.386666
+HEAD_OFFSET = 726
+PRIMITIVE_OFFSET = 12
+OVERLAP = 103
+
+BLANK = 255
+DILATED = 160
+INK = 0
+
+CHUNK_SIZE = 1 << 22
+
+def hexTable():
+    table = numpy.zeros(256, numpy.uint8)
+    for n, c in enumerate('0123456789ABCDEF'):
+        table[ord(c)] = n
+        table[ord(c.lower())] = n
+    return table
+
+def addressTable():
+    # Firing lines carry the multiplexer output, which is the address plus
+    # one with its bits reversed. -1 marks outputs that aren't an address.
+    table = numpy.zeros(16, numpy.int8) - 1
+    for address in range(13):
+        a = address + 1
+        out = ((a & 1) << 3) | ((a & 2) << 1) | ((a & 4) >> 1) | ((a & 8) >> 3)
+        table[out] = address
+    return table
+
+def nozzleTables():
+    # Indexed by address * 8 + bit and by bit, where bit is the position of
+    # the primitive in a firing byte unpacked most significant bit first.
+    rows = numpy.zeros(16 * 8, numpy.int32)
+    cols = numpy.zeros(8, numpy.int32)
+    for bit in range(8):
+        primitive = 7 - bit
+        for address in range(13):
+            x, y = offset_for_nozzle(nozzle_from_primitive_address(primitive, address))
+            rows[address * 8 + bit] = y
+            cols[bit] = x
+    return rows, cols
+
+HEX = hexTable()
+ADDRESS = addressTable()
+NOZZLE_ROWS, NOZZLE_COLS = nozzleTables()
+
+def parseInts(data, starts, ends):
+    '''The integers in data[starts[i]:ends[i]], which may start with '-'.'''
+    values = numpy.zeros(len(starts), numpy.int64)
+    negative = data[numpy.minimum(starts, len(data) - 1)] == ord('-')
+    starts = starts + negative
+    lengths = ends - starts
+    some = numpy.flatnonzero(lengths > 0)
+    if len(some) == 0:
+        return values
+    starts = starts[some]
+    ends = ends[some]
+    lengths = lengths[some]
+    firsts = numpy.cumsum(lengths) - lengths
+    positions = numpy.arange(lengths.sum()) - numpy.repeat(firsts - starts, lengths)
+    powers = numpy.repeat(ends, lengths) - positions - 1
+    digits = (data[positions].astype(numpy.int64) - ord('0')) * 10 ** powers
+    values[some] = numpy.add.reduceat(digits, firsts)
+    return numpy.where(negative, -values, values)
+
+class HexPreview(object):
+    def __init__(self, scale=4, headOffset=HEAD_OFFSET, overlap=OVERLAP):
+        self.scale = scale
+        self.headOffset = headOffset
+        # The slicer adds this many blank rows above the image.
+        self.rowShift = 2 * ((208 // overlap) * overlap // 2)
+        self.canvas = numpy.zeros((0, 0), numpy.uint8)
+
+    def grow(self, rows, cols):
+        if rows <= self.canvas.shape[0] and cols <= self.canvas.shape[1]:
+            return
+        rows = max(rows, self.canvas.shape[0] * 3 // 2)
+        cols = max(cols, self.canvas.shape[1])
+        canvas = numpy.zeros((rows, cols), numpy.uint8)
+        canvas[:] = BLANK
+        canvas[:self.canvas.shape[0], :self.canvas.shape[1]] = self.canvas
+        self.canvas = canvas
+
+    def draw(self, data, x, y):
+        '''
+        Draws the firings in data, whole lines starting with the head at
+        (x, y). Returns where the head is at the end.
+        '''
+        if len(data) == 0:
+            return x, y
+        newlines = numpy.flatnonzero(data == ord('\n'))
+        ends = newlines
+        if data[-1] != ord('\n'):
+            ends = numpy.append(ends, len(data))
+        starts = numpy.concatenate(([0], ends[:-1] + 1))
+        lengths = ends - starts
+        firsts = data[numpy.minimum(starts, len(data) - 1)]
+
+        # The head position before every line.
+        moves = numpy.flatnonzero((firsts == ord('M')) & (lengths > 4))
+        steps = parseInts(data, starts[moves] + 4, ends[moves])
+        axes = data[starts[moves] + 2]
+        dx = numpy.zeros(len(starts), numpy.int64)
+        dy = numpy.zeros(len(starts), numpy.int64)
+        dx[moves[axes == ord('X')]] = steps[axes == ord('X')]
+        dy[moves[axes == ord('Y')]] = steps[axes == ord('Y')]
+        xs = x + numpy.cumsum(dx) - dx
+        ys = y + numpy.cumsum(dy) - dy
+        end = (x + dx.sum(), y + dy.sum())
+
+        firings = numpy.flatnonzero((firsts == ord('F')) & (lengths >= 7))
+        at = starts[firings]
+        address = ADDRESS[HEX[data[at + 2]]]
+        valid = address >= 0
+        firings = firings[valid]
+        at = at[valid]
+        address = address[valid]
+        rows = (-xs[firings] / SPN).astype(numpy.int32) - self.rowShift
+        cols = numpy.round(ys[firings] / SPN).astype(numpy.int32) - 1 - PRIMITIVE_OFFSET
+        first = HEX[data[at + 3]] * 16 + HEX[data[at + 4]]
+        second = HEX[data[at + 5]] * 16 + HEX[data[at + 6]]
+        # Where a firing's byte goes in a mask of all 104 nozzles, which is
+        # kept in two words: addresses 0 to 7 and addresses 8 to 12.
+        shifts = (address % 8).astype(numpy.uint64) * 8
+        low = address < 8
+        passes = numpy.concatenate(([True], rows[1:] != rows[:-1]))
+
+        # The second cartridge first, so ink from the first shows over it.
+        for firing, offset, value in ((second, 0, DILATED), (first, self.headOffset, INK)):
+            # Even and odd primitives are in different columns of nozzles.
+            for bits, shift in ((0x55, NOZZLE_COLS[7]), (0xaa, NOZZLE_COLS[6])):
+                masks = (firing & bits).astype(numpy.uint64) << shifts
+                self.fire(numpy.where(low, masks, 0), numpy.where(low, 0, masks),
+                          rows, (cols + (shift - offset)) // self.scale, passes, value)
+        return end
+
+    def fire(self, low, high, rows, cols, passes, value):
+        # All the firings made in the same pass for the same column of the
+        # canvas are merged before being spread out over the nozzles, which
+        # at a reduced scale makes a lot less to draw.
+        runs = numpy.flatnonzero(passes | numpy.concatenate(([True], cols[1:] != cols[:-1])))
+        for masks, first in ((low, 0), (high, 64)):
+            masks = numpy.bitwise_or.reduceat(masks, runs)
+            run, bit = numpy.nonzero(numpy.unpackbits(masks.view(numpy.uint8).reshape(-1, 8), axis=1))
+            if len(run) == 0:
+                continue
+            line = runs[run]
+            r = (rows[line] + NOZZLE_ROWS[first + bit]) // self.scale
+            c = cols[line]
+            # Anything before the first row or column is off the image.
+            keep = (r >= 0) & (c >= 0)
+            r = r[keep]
+            c = c[keep]
+            if len(r) == 0:
+                continue
+            self.grow(r.max() + 1, c.max() + 1)
+            self.canvas[r, c] = value
+
+def renderHex(path, scale=4):
+    '''
+    Returns a (height, width) array of grey levels picturing the job in
+    path, with one pixel for every scale x scale pixels of the image it was
+    sliced from.
+    '''
+    with HexFile(path) as hexFile:
+        header = hexFile.header
+        if header != None and header.slicer != None:
+            preview = HexPreview(scale, header.slicer[0], header.slicer[2])
+        else:
+            preview = HexPreview(scale)
+
+        data = numpy.frombuffer(hexFile.view(), numpy.uint8)
+        x, y = 0, 0
+        start = hexFile.start
+        while start < len(data):
+            end = hexFile.data.rfind('\n', start, start + CHUNK_SIZE) + 1
+            if end <= start:
+                end = min(start + CHUNK_SIZE, len(data))
+            x, y = preview.draw(data[start:end], x, y)
+            start = end
+        del data
+
+    # The slicer mirrors images and turns them on their side, so the canvas
+    # is the image transposed and turned half around.
+    if header != None and header.width != None:
+        width = (header.width + scale - 1) // scale
+        height = (header.height + scale - 1) // scale
+        preview.grow(width, height)
+        return preview.canvas.T[:height, :width][::-1, ::-1]
+    pixels = preview.canvas.T
+    ink = numpy.nonzero(pixels != BLANK)
+    if len(ink[0]) == 0:
+        return pixels[:1, :1]
+    return pixels[:ink[0].max() + 1, :ink[1].max() + 1][::-1, ::-1]
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print("usage: hexpreview.py <hex file> <image file> [scale]")
+        sys.exit(1)
+    from PIL import Image
+    scale = 4
+    if len(sys.argv) > 3:
+        scale = int(sys.argv[3])
+    Image.fromarray(renderHex(sys.argv[1], scale)).save(sys.argv[2])
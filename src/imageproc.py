@@ -23,11 +23,17 @@
 """
 
 from PIL import Image
-from PyQt4.QtGui import QImage, QTransform
-from PyQt4 import QtCore
+# Without PyQt4 (headless.py) images are loaded and transformed with PIL.
+try:
+    from PyQt4.QtGui import QImage, QTransform
+    from PyQt4 import QtCore
+except ImportError:
+    QImage = None
 import os
 import sys
 import time
+import hashlib
+from hexfile import HexHeader, addHeader, calcDJB2
 ### Image Processing Functions
 
 """
@@ -43,16 +49,6 @@ try:
 except NameError:
     xrange = range
 
-def calcDJB2(contents):
-    hash = 5381
-    for c in contents:
-        cval = ord(c)
-        if cval >= 128:
-            cval = -(256 - cval)
-        hash = hash * 33 + cval
-        hash = hash & 0xffffffff
-    return hash
-
 class ImageProcessor:
     # Distance between the same line of primitives on two different heads (in pixels)
     # Distance between the two cartridges in pixels
@@ -82,6 +78,9 @@ class ImageProcessor:
     fps = 1
 
     outputFile = None
+    # The header of the file being written, its djb2 and passes counted as
+    # the commands go out.
+    hexHeader = None
 
     # This allows for easier inspection of hex files
     USE_TEXTUAL_FIRING = True
@@ -119,20 +118,26 @@ class ImageProcessor:
         self.outputFileName = outputFileName
 
         # Open our image and split it into its odd rows and even rows
-        if type(inputFileName) == type(''):
+        if type(inputFileName) == type('') and QImage != None:
             inputImage = QImage(inputFileName)
+        elif type(inputFileName) == type(''):
+            inputImage = Image.open(inputFileName)
         else:
             inputImage = inputFileName
-        if size:
-            width, height = size
-            inputImage = inputImage.scaled(width, height, aspectRatioMode=QtCore.Qt.IgnoreAspectRatio, transformMode=QtCore.Qt.SmoothTransformation)
-        inputImage = inputImage.mirrored(horizontal=True, vertical=False)
-        #rot270 = QTransform()
-        #rot270.rotate(270)
-        #inputImage = inputImage.transformed(rot270)
-        rot90 = QTransform()
-        rot90.rotate(90)
-        inputImage = inputImage.transformed(rot90)
+        header = self.header(inputFileName, inputImage, size)
+        if isinstance(inputImage, Image.Image):
+            inputImage = self.transformPILImage(inputImage, size)
+        else:
+            if size:
+                width, height = size
+                inputImage = inputImage.scaled(width, height, aspectRatioMode=QtCore.Qt.IgnoreAspectRatio, transformMode=QtCore.Qt.SmoothTransformation)
+            inputImage = inputImage.mirrored(horizontal=True, vertical=False)
+            #rot270 = QTransform()
+            #rot270.rotate(270)
+            #inputImage = inputImage.transformed(rot270)
+            rot90 = QTransform()
+            rot90.rotate(90)
+            inputImage = inputImage.transformed(rot90)
 
         print("after transformed {}".format(time.time() - start))
         start = time.time()
@@ -216,11 +221,40 @@ class ImageProcessor:
 
         # We have our input images and their matrices. Now we need to generate
         # the correct output data.
+        self.hexHeader = header
         self.writeCommands(progressFunc)
+        self.hexHeader = None
 
         print("after write commands {}".format(time.time() - start))
         start = time.time()
 
+    def header(self, inputFileName, inputImage, size=None):
+        '''The header for a file sliced from this image, finished once it is written.'''
+        if type(inputFileName) == type(''):
+            f = open(inputFileName, 'rb')
+            source = hashlib.md5(f.read()).hexdigest()
+            f.close()
+        elif isinstance(inputImage, Image.Image):
+            source = hashlib.md5(inputImage.tobytes()).hexdigest()
+        else:
+            source = hashlib.md5(inputImage.constBits().asstring(inputImage.byteCount())).hexdigest()
+        if size:
+            width, height = size
+        elif isinstance(inputImage, Image.Image):
+            width, height = inputImage.size
+        else:
+            width, height = inputImage.width(), inputImage.height()
+        return HexHeader(width=width, height=height, source=source,
+                         slicer=[self.HEADOFFSET, self.VOFFSET, self.mOffset, self.dilateCount])
+
+    def transformPILImage(self, image, size=None):
+        '''The same scaling, mirroring and rotation as done with Qt.'''
+        image = image.convert('RGBA')
+        if size:
+            image = image.resize(size, Image.ANTIALIAS)
+        image = image.transpose(Image.FLIP_LEFT_RIGHT)
+        return image.transpose(Image.ROTATE_270)
+
     def dilate(self, img):
         width, height = img.size
         outImg = img.copy()
@@ -267,6 +301,19 @@ class ImageProcessor:
 
         xposition = 0
 
+        # Every line feed ends a pass, so the header line can be sized
+        # before any commands are written and filled in once they are.
+        header = self.hexHeader
+        self.djb2 = 5381
+        self.passes = 0
+        self.pending = []
+        self.pendingSize = 0
+        if header != None:
+            header.djb2 = '0' * 8
+            header.passes = int(height/self.mOffset)*2 + 1
+            reserved = header.format() + '\n'
+            self.outputFile.write(reserved)
+
         tot = 25.0 / (int(height/self.mOffset)*2 + 1)
         for y in xrange(int(height/self.mOffset)*2 + 1):
             # Print out progress
@@ -319,7 +366,18 @@ class ImageProcessor:
         #self.writeMovementCommand('X', 0)
         #self.writeMovementCommand('Y', 0)
 
+        self.flush()
+        if header != None:
+            header.djb2 = "{:08x}".format(self.djb2)
+            header.passes = self.passes
+            line = header.format() + '\n'
+            if len(line) == len(reserved):
+                self.outputFile.seek(0)
+                self.outputFile.write(line)
+                header = None
         self.outputFile.close()
+        if header != None:
+            addHeader(self.outputFileName, header)
 
     def calculateFiring(self, xPos, yPos, addr, side):
         # Lookup tables to convert address to position
@@ -376,8 +434,13 @@ class ImageProcessor:
     Splits an input image into two images.
     '''
     def splitImageTwos(self, image):
-        width = image.width()
-        height = image.height()
+        if isinstance(image, Image.Image):
+            width, height = image.size
+            imageHeight = height
+        else:
+            width = image.width()
+            height = image.height()
+            imageHeight = image.height()
 
         # If the height of the input image isn't a multiple of 4, round it up.
         if height % 4 != 0:
@@ -393,15 +456,22 @@ class ImageProcessor:
         # References to the pixel data.
         evenMatrix = even.load()
         oddMatrix = odd.load()
-        inputVector = image.bits()
-        inputVector.setsize(image.byteCount())
-        stride = width*4
+        if isinstance(image, Image.Image):
+            # Same channel order as the bytes of a 32 bit QImage.
+            inputVector = image.convert('RGBA').load()
+            def inputMatrix(x, y):
+                r, g, b, a = inputVector[x, y]
+                return (b, g, r, a)
+        else:
+            inputVector = image.bits()
+            inputVector.setsize(image.byteCount())
+            stride = width*4
 
-        def inputMatrix(x, y):
-            return (ord(inputVector[x*4   + y*stride]),
-                    ord(inputVector[x*4+1 + y*stride]),
-                    ord(inputVector[x*4+2 + y*stride]),
-                    ord(inputVector[x*4+3 + y*stride]))
+            def inputMatrix(x, y):
+                return (ord(inputVector[x*4   + y*stride]),
+                        ord(inputVector[x*4+1 + y*stride]),
+                        ord(inputVector[x*4+2 + y*stride]),
+                        ord(inputVector[x*4+3 + y*stride]))
 
         # Divide by 4 because we're copying two rows at a time (why?)
         # Subtract 1 because of zero-offset.
@@ -418,16 +488,35 @@ class ImageProcessor:
         # (non-existant) we added.
         y = int(height / 4) - 1
         for x in xrange(width):
-            if y*4 < image.height(): oddMatrix[x, y*2] = inputMatrix(x, y*4)
-            if y*4 + 1 < image.height(): oddMatrix[x, y*2+1] = inputMatrix(x, y*4+1)
+            if y*4 < imageHeight: oddMatrix[x, y*2] = inputMatrix(x, y*4)
+            if y*4 + 1 < imageHeight: oddMatrix[x, y*2+1] = inputMatrix(x, y*4+1)
 
-            if y*4 + 2 < image.height(): evenMatrix[x, y*2] = inputMatrix(x, y*4+2)
-            if y*4 + 3 < image.height(): evenMatrix[x, y*2+1] = inputMatrix(x, y*4+3)
+            if y*4 + 2 < imageHeight: evenMatrix[x, y*2] = inputMatrix(x, y*4+2)
+            if y*4 + 3 < imageHeight: evenMatrix[x, y*2+1] = inputMatrix(x, y*4+3)
 
         return (odd, even)
 
+    # Commands are gathered into blocks this big, which are hashed as
+    # they are written out.
+    WRITE_BLOCK = 1 << 16
+
+    def write(self, data):
+        self.pending.append(data)
+        self.pendingSize += len(data)
+        if self.pendingSize >= self.WRITE_BLOCK:
+            self.flush()
+
+    def flush(self):
+        data = ''.join(self.pending)
+        self.pending = []
+        self.pendingSize = 0
+        self.outputFile.write(data)
+        self.djb2 = calcDJB2(data, self.djb2)
+
     def writeMovementCommand(self, axis, steps):
-        self.outputFile.write('M {} {}\n'.format(axis, steps).encode('utf-8'))
+        if axis == 'X':
+            self.passes += 1
+        self.write('M {} {}\n'.format(axis, steps).encode('utf-8'))
 
     def writeFiringCommand(self, a, firing1, firing2):
         # The multiplexer doesn't use the first output, for startup reasons.
@@ -442,17 +531,16 @@ class ImageProcessor:
 
 
         if self.USE_TEXTUAL_FIRING:
-            self.outputFile.write('F {:01X}{:02X}{:02X}\n'.format(address, firing1, firing2).encode('utf-8'))
+            self.write('F {:01X}{:02X}{:02X}\n'.format(address, firing1, firing2).encode('utf-8'))
         else:
-            outputStream = self.outputFile
-            outputStream.write(chr(1)) # Fire command
-            outputStream.write(chr(firing1)) # Relevant firing data, i.e. which primitive(s) to fire
-            outputStream.write(chr(address)) # The address we're firing within the primitive(s)
-            outputStream.write('\n')
-            outputStream.write(chr(1)) # Fire command
-            outputStream.write(chr(firing2)) # Relevant firing data, i.e. which primitive(s) to fire
-            outputStream.write(chr(address)) # The address we're firing within the primitive(s)
-            outputStream.write('\n')
+            self.write(chr(1) + # Fire command
+                       chr(firing1) + # Relevant firing data, i.e. which primitive(s) to fire
+                       chr(address) + # The address we're firing within the primitive(s)
+                       '\n' +
+                       chr(1) + # Fire command
+                       chr(firing2) + # Relevant firing data, i.e. which primitive(s) to fire
+                       chr(address) + # The address we're firing within the primitive(s)
+                       '\n')
 
 if __name__ == "__main__":
     if len(sys.argv) < 3:
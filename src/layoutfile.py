@@ -0,0 +1,174 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+    Argentum Control GUI
+
+    Copyright (C) 2013 Isabella Stevens
+    Copyright (C) 2014 Michael Shiel
+    Copyright (C) 2015 Trent Waddington
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+
+# Reading and writing .layout files, and the geometry that places a layout's
+# images on the print area, without any Qt. A layout is a list of [image]
+# sections:
+#
+#   [image]
+#   filename=board.png
+#   left=10.0
+#   bottom=20.0
+#   width=50.0
+#   height=30.0
+#   lastResized=1445900000.0
+#
+# Positions and sizes are in millimetres; relative filenames are relative to
+# the layout file.
+
+import os
+
+printPlateDesignScale = [1.0757, 1.2256] # * printArea
+imageScale            = [ 23.70,  23.70] # * print = pixels
+
+def hexFilenameFor(filename):
+    filename = os.path.basename(filename)
+    if filename.find('.') != -1:
+        filename = filename[:filename.find('.')]
+    return filename + ".hex"
+
+class LayoutImage(object):
+    def __init__(self, filename):
+        self.filename = filename
+        self.left = None
+        self.bottom = None
+        self.width = None
+        self.height = None
+        self.lastResized = None
+        self.visible = True
+        self.hexFilename = hexFilenameFor(filename)
+
+    def sliceSize(self):
+        '''The size in pixels to slice a resized image at, or None.'''
+        if self.lastResized == None:
+            return None
+        return (int(self.width * imageScale[0]), int(self.height * imageScale[1]))
+
+    def slicedHexFilename(self):
+        size = self.sliceSize()
+        if size == None:
+            return self.hexFilename
+        return "{}-{}x{}.hex".format(self.hexFilename[:-4], size[0], size[1])
+
+def readLayout(filename):
+    '''Returns the LayoutImages in a layout file, in order.'''
+    file = open(filename, "r")
+    lines = file.read().split('\n')
+    file.close()
+
+    layoutPath = os.path.dirname(filename)
+    bImageSection = False
+    images = []
+    image = None
+    for line in lines:
+        if len(line) == 0:
+            continue
+        if line[0] == '#':
+            continue
+        if line[0] == '[':
+            bImageSection = False
+            if line == '[image]':
+                bImageSection = True
+            continue
+        if line.find('=') == -1:
+            # What is this?
+            continue
+
+        key = line[0:line.find('=')]
+        value = line[line.find('=')+1:]
+
+        if bImageSection:
+            if key == "filename":
+                filename = value
+                if not os.path.isabs(filename):
+                    filename = os.path.join(layoutPath, filename)
+                image = LayoutImage(filename)
+                images.append(image)
+            if image:
+                if key == "left":
+                    image.left = float(value)
+                if key == "bottom":
+                    image.bottom = float(value)
+                if key == "width":
+                    image.width = float(value)
+                if key == "height":
+                    image.height = float(value)
+                if key == "lastResized":
+                    image.lastResized = float(value)
+    return images
+
+def writeLayout(filename, images):
+    # XXX Saves full pathnames. :(
+    file = open(filename, "w")
+    layoutPath = os.path.dirname(filename)
+    for image in images:
+        file.write('[image]\n')
+        path = os.path.relpath(image.filename, layoutPath)
+        if path.find('..') != -1:
+            path = image.filename
+        file.write('filename={}\n'.format(path))
+        file.write('left={}\n'.format(image.left))
+        file.write('bottom={}\n'.format(image.bottom))
+        file.write('width={}\n'.format(image.width))
+        file.write('height={}\n'.format(image.height))
+        if image.lastResized:
+            file.write('lastResized={}\n'.format(image.lastResized))
+        file.write('\n')
+    file.close()
+
+def printAreaToMove(offsetX, offsetY):
+    fudgeX = -80
+    fudgeY = -560
+    x = offsetX * 80 + fudgeX
+    y = offsetY * 80 + fudgeY
+    x = int(x)
+    y = int(y)
+    return (x, y)
+
+def imageMove(image):
+    '''Where to move the head before printing an image.'''
+    pos = printAreaToMove(image.left + image.width, image.bottom)
+    if image.filename.endswith(".hex"):
+        pos = (pos[0] - 15 * 80, pos[1] + 560 + 25 * 80)
+    return pos
+
+def dryingMoves(image):
+    '''
+    The roller passes over an image: for each, the roller goes down at
+    (x, y) and is lifted again after moving back to (left, y).
+    '''
+    pos = printAreaToMove(image.left + image.width - 60, image.bottom + 30)
+    x = pos[0]
+    y = pos[1]
+    sy = y
+    moves = []
+    while y - sy < image.height * 80:
+        left = x - int(image.width * 1.5) * 80
+        if left < 0:
+            left = 0
+        moves.append((x, y, left))
+        y = y + 30 * 80
+    return moves
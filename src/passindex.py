@@ -0,0 +1,204 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+    Argentum Control GUI
+
+    Copyright (C) 2013 Isabella Stevens
+    Copyright (C) 2014 Michael Shiel
+    Copyright (C) 2015 Trent Waddington
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+# An index of the passes in a hex file, so that tools can find pass k, the
+# number of passes or the extent of a job without scanning the whole file.
+# A pass is the run of lines up to and including a line feed (an 'M X'
+# line). The index is kept in a sidecar (see hexfile.sidecarPath), keyed
+# by the size and modification time of the hex file, and skipped if it
+# can't be read or written. The sidecar is:
+#
+#   magic | file size (uint32) | mtime (double) | pass count (uint32) |
+#   tail offset (uint32) | end x (int32) | end y (int32) | passes
+#
+# where every pass is its byte offset and size, the head position at its
+# start, the span of columns it covers and the number of firings in it.
+# Positions are in steps relative to where the job starts. Anything after
+# the last pass is the tail.
+
+import os
+import struct
+import collections
+from hexfile import isPassEnd, HexFile
+import hexfile
+
+MAGIC = 'ARGIDX01'
+HEADER = struct.Struct('<IdIIii')
+ENTRY = struct.Struct('<IIiiiiI')
+
+HexPass = collections.namedtuple('HexPass',
+    ['offset', 'size', 'x', 'y', 'yMin', 'yMax', 'firings'])
+
+def sidecarPath(path, create=False):
+    return hexfile.sidecarPath(path, '.index', create)
+
+class PassIndex(object):
+    def __init__(self, passes, tail, end, size=0, mtime=0):
+        self.passes = passes
+        self.tail = tail
+        self.end = end
+        self.size = size
+        self.mtime = mtime
+
+    def __len__(self):
+        return len(self.passes)
+
+    def __getitem__(self, n):
+        return self.passes[n]
+
+    def count(self):
+        return len(self.passes)
+
+    def position(self, n):
+        '''Where the head is when pass n starts, n == count() for the end.'''
+        if n < len(self.passes):
+            return (self.passes[n].x, self.passes[n].y)
+        return self.end
+
+    def offset(self, n):
+        if n < len(self.passes):
+            return self.passes[n].offset
+        return self.tail
+
+    def firings(self):
+        return sum(p.firings for p in self.passes)
+
+    def extent(self):
+        '''The (width, height) in steps the whole job covers.'''
+        ys = [0, self.end[1]]
+        for p in self.passes:
+            ys.append(p.yMin)
+            ys.append(p.yMax)
+        return (-self.end[0], max(ys) - min(ys))
+
+    def read(self, path, first, last=None):
+        '''The text of passes first to last - 1, or to the end of the file.'''
+        start = self.offset(first)
+        f = open(path, 'rb')
+        f.seek(start)
+        if last == None:
+            text = f.read()
+        else:
+            text = f.read(self.offset(last) - start)
+        f.close()
+        return text
+
+    @classmethod
+    def build(cls, contents):
+        passes = []
+        offset = 0
+        # Comment lines at the top describe the file, they're not a pass.
+        while contents[offset:offset+1] == '#':
+            nl = contents.find('\n', offset)
+            if nl == -1:
+                offset = len(contents)
+                break
+            offset = nl + 1
+        start = offset
+        x = 0
+        y = 0
+        yMin = 0
+        yMax = 0
+        firings = 0
+        passX = 0
+        passY = 0
+        while offset < len(contents):
+            nl = contents.find('\n', offset)
+            if nl == -1:
+                nl = len(contents)
+            line = contents[offset:nl]
+            offset = nl + 1
+            if len(line) > 3 and line[0] == 'M':
+                if isPassEnd(line):
+                    passes.append(HexPass(start, min(offset, len(contents)) - start,
+                                          passX, passY, yMin, yMax, firings))
+                    x = x + int(line[4:])
+                    start = offset
+                    passX = x
+                    passY = y
+                    yMin = y
+                    yMax = y
+                    firings = 0
+                else:
+                    y = y + int(line[4:])
+                    yMin = min(yMin, y)
+                    yMax = max(yMax, y)
+            elif len(line) > 0 and line[0] == 'F':
+                firings = firings + 1
+        return cls(passes, min(start, len(contents)), (x, y), len(contents))
+
+    def save(self, path):
+        f = open(path, 'wb')
+        f.write(MAGIC)
+        f.write(HEADER.pack(self.size, self.mtime, len(self.passes),
+                            self.tail, self.end[0], self.end[1]))
+        for p in self.passes:
+            f.write(ENTRY.pack(*p))
+        f.close()
+
+    @classmethod
+    def load(cls, path):
+        f = open(path, 'rb')
+        try:
+            if f.read(len(MAGIC)) != MAGIC:
+                return None
+            header = f.read(HEADER.size)
+            if len(header) != HEADER.size:
+                return None
+            size, mtime, count, tail, endX, endY = HEADER.unpack(header)
+            data = f.read(count * ENTRY.size)
+            if len(data) != count * ENTRY.size:
+                return None
+        finally:
+            f.close()
+        passes = [HexPass(*ENTRY.unpack_from(data, n * ENTRY.size))
+                  for n in range(count)]
+        return cls(passes, tail, (endX, endY), size, mtime)
+
+def passIndex(path, sidecars=True):
+    '''
+    The PassIndex of a hex file, from its sidecar when that is up to date,
+    otherwise by reading the file (and writing a new sidecar).
+    '''
+    st = os.stat(path)
+    if sidecars:
+        try:
+            index = PassIndex.load(sidecarPath(path))
+        except (IOError, OSError, struct.error):
+            index = None
+        if index != None and index.size == st.st_size and index.mtime == st.st_mtime:
+            return index
+    hexFile = HexFile(path)
+    try:
+        index = PassIndex.build(hexFile.data)
+    finally:
+        hexFile.close()
+    index.mtime = st.st_mtime
+    if sidecars:
+        try:
+            index.save(sidecarPath(path, create=True))
+        except (IOError, OSError):
+            pass
+    return index
@@ -0,0 +1,220 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+    Argentum Control GUI
+
+    Copyright (C) 2013 Isabella Stevens
+    Copyright (C) 2014 Michael Shiel
+    Copyright (C) 2015 Trent Waddington
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+# Queues commands for the printer and keeps a few of them outstanding, so
+# the printer starts on the next move as soon as it finishes the last one
+# instead of waiting for the response to travel back and the next command
+# to be sent.
+#
+#   pipeline = printer.pipeline()
+#   pipeline.moveTo(1000, 1000)
+#   pipeline.command('l d', expect=None)
+#   pipeline.dwell(1.5)
+#   done = pipeline.moveTo(0, 1000)
+#   done.wait(10)
+#
+# There is no thread behind it: commands are sent and responses read
+# whenever the pipeline is used, and while waiting on any of its futures.
+
+import time
+import collections
+from protocol import Events
+
+class CommandFuture(object):
+    def __init__(self, command, expect):
+        self.command = command
+        self.expect = expect
+        self.pipeline = None
+        self.response = []
+        self.finished = False
+        self.cancelled = False
+
+    def done(self):
+        return self.finished or self.cancelled
+
+    def wait(self, timeout=None):
+        '''
+        Waits for the printer's response, returns True once the command
+        completed or was cancelled.
+        '''
+        deadline = None
+        if timeout != None:
+            deadline = time.time() + timeout
+        while not self.done():
+            if not self.pipeline.printer.connected:
+                return False
+            left = 0.1
+            if deadline != None:
+                left = min(left, deadline - time.time())
+                if left <= 0:
+                    return False
+            self.pipeline.pump(left)
+        return True
+
+    def error(self):
+        '''
+        The line refusing a move, or None. Only the virtual printer's wording
+        is known for sure; the firmware's refusal has always been recognised
+        by the slash between a coordinate and its limit, so any response line
+        with one counts too.
+        '''
+        event = Events(self.response).first('out_of_limits')
+        if event != None:
+            return event.line
+        for line in self.response:
+            if line.find('/') != -1:
+                return line
+        return None
+
+class Dwell(object):
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.until = None
+
+class CommandPipeline(object):
+    '''
+    Keeps up to depth commands sent to the printer ahead of their responses.
+    Responses come back in order, so each line goes to the oldest command
+    still waiting and its expected text completes it.
+
+    control is called before every command is sent. Like the progress
+    callbacks elsewhere it returns True to go on, "Pause" to hold the
+    remaining commands back and False to cancel them.
+    '''
+
+    # Seconds finish() allows each command by default.
+    commandTimeout = 10
+
+    def __init__(self, printer, depth=2, control=None):
+        self.printer = printer
+        self.depth = depth
+        self.control = control
+        self.queue = collections.deque()
+        self.outstanding = collections.deque()
+        self.buffer = ''
+
+    def submit(self, command, expect):
+        future = CommandFuture(command, expect)
+        future.pipeline = self
+        self.queue.append(future)
+        self.pump(0)
+        return future
+
+    def command(self, command, expect='Ok'):
+        '''
+        Queues a command. With expect None nothing is waited for: the
+        command is done once it is sent and its response, if any, is read
+        with the next command's.
+        '''
+        return self.submit(command, expect)
+
+    def moveTo(self, x, y):
+        return self.submit("M {} {} k".format(int(x), int(y)), 'Ok')
+
+    def dwell(self, seconds):
+        '''
+        Sends nothing more until everything before has completed and then
+        the given time has passed, for example while the rollers move.
+        '''
+        self.queue.append(Dwell(seconds))
+        self.pump(0)
+
+    def cancel(self):
+        for item in self.queue:
+            if isinstance(item, CommandFuture):
+                item.cancelled = True
+        self.queue.clear()
+
+    def finish(self, timeout=None):
+        '''
+        Waits for every queued command, returns False on a timeout or if the
+        printer goes away. Without a timeout every command gets the 10
+        seconds a single command would, plus the dwells.
+        '''
+        if timeout == None:
+            timeout = 0
+            for item in list(self.queue) + list(self.outstanding):
+                if isinstance(item, Dwell):
+                    timeout = timeout + item.seconds
+                else:
+                    timeout = timeout + self.commandTimeout
+        deadline = time.time() + timeout
+        while self.queue or self.outstanding:
+            if not self.printer.connected or time.time() > deadline:
+                return False
+            self.pump(0.1)
+        return True
+
+    def pump(self, timeout=0):
+        self.sendQueued()
+        if len(self.outstanding) > 0:
+            self.readResponses(timeout)
+            self.sendQueued()
+        elif timeout > 0:
+            time.sleep(timeout)
+
+    def sendQueued(self):
+        while self.queue and len(self.outstanding) < self.depth:
+            item = self.queue[0]
+            if isinstance(item, Dwell):
+                if len(self.outstanding) > 0:
+                    return
+                if item.until == None:
+                    item.until = time.time() + item.seconds
+                if time.time() < item.until:
+                    return
+                self.queue.popleft()
+                continue
+            if self.control:
+                state = self.control()
+                if state == "Pause":
+                    return
+                if not state:
+                    self.cancel()
+                    return
+            self.queue.popleft()
+            self.printer.command(item.command)
+            if item.expect == None:
+                item.finished = True
+            else:
+                self.outstanding.append(item)
+
+    def readResponses(self, timeout):
+        printer = self.printer
+        if not printer.connected:
+            return
+        try:
+            printer.serialSetTimeout(timeout)
+            self.buffer += printer.serialRead(max(1, printer.serialDevice.inWaiting()))
+        finally:
+            printer.serialSetTimeout(0)
+        while self.outstanding and self.buffer.find('\n') != -1:
+            line, self.buffer = self.buffer.split('\n', 1)
+            line = line.rstrip('\r')
+            future = self.outstanding[0]
+            future.response.append(line)
+            if line.find(future.expect) != -1:
+                future.finished = True
+                self.outstanding.popleft()
@@ -0,0 +1,44 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+    Argentum Control GUI
+
+    Copyright (C) 2013 Isabella Stevens
+    Copyright (C) 2014 Michael Shiel
+    Copyright (C) 2015 Trent Waddington
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+
+# What farm.py and headless.py need to know about attached printers without
+# pulling in each other: which ports have one, and the calibration to use
+# for a printer that doesn't report its own.
+
+# The EEPROM values a printer ships with, for printers that don't report them.
+CALIBRATION_DEFAULTS = {'horizontal_offset': 726,
+                        'vertical_offset': 0,
+                        'print_overlap': 41}
+
+def printerPorts():
+    '''The ports that have an Arduino Mega on them.'''
+    from serial.tools.list_ports import comports
+    ports = []
+    for port in comports():
+        if (port[2].find("2341:0042") != -1 or
+                port[2].find("2341:42") != -1):
+            ports.append(port[0])
+    return ports
@@ -0,0 +1,218 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+    Argentum Control GUI
+
+    Copyright (C) 2013 Isabella Stevens
+    Copyright (C) 2014 Michael Shiel
+    Copyright (C) 2015 Trent Waddington
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+
+# Cached view of the printer's slowly changing state: head position, supply
+# voltage, limit switches, EEPROM options and printer number. Values are
+# refreshed at their own rates when the serial link is idle, and are also
+# picked out of any output the printer sends unprompted, so the GUI and the
+# print loop read the cache instead of asking the printer each time.
+#
+# poll() does the queries on the caller's thread. The GUI calls it from a
+# timer on the main thread, where it can't race the console monitor for the
+# port; start() runs it on a thread for callers with nothing else reading.
+
+import time
+import threading
+from protocol import Events, LineSplitter
+
+# Seconds between refreshes; None means only on request.
+DEFAULT_RATES = {'pos': 3,
+                 'volts': 5,
+                 'limits': None,
+                 'options': None,
+                 'pnum': None}
+
+class PrinterState(object):
+    quiet = 1
+
+    def __init__(self, printer, rates=None):
+        self.printer = printer
+        self.rates = dict(DEFAULT_RATES)
+        if rates != None:
+            self.rates.update(rates)
+        self.values = {}
+        self.stamps = {}
+        self.subscribers = []
+        self.splitter = LineSplitter()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.running = False
+
+    def subscribe(self, func):
+        '''func(name, value) is called whenever a value changes.'''
+        self.subscribers.append(func)
+
+    def unsubscribe(self, func):
+        if func in self.subscribers:
+            self.subscribers.remove(func)
+
+    def clear(self):
+        with self.lock:
+            self.values = {}
+            self.stamps = {}
+
+    def get(self, name, maxAge=None):
+        with self.lock:
+            if not name in self.values:
+                return None
+            if maxAge != None and time.time() - self.stamps[name] > maxAge:
+                return None
+            return self.values[name]
+
+    def age(self, name):
+        with self.lock:
+            if not name in self.stamps:
+                return None
+            return time.time() - self.stamps[name]
+
+    def set(self, name, value):
+        if value == None:
+            return
+        with self.lock:
+            changed = self.values.get(name) != value
+            self.values[name] = value
+            self.stamps[name] = time.time()
+        if changed:
+            for func in list(self.subscribers):
+                func(name, value)
+
+    def observe(self, text):
+        '''Pick state out of printer output that nobody asked for.'''
+        self.apply(Events(self.splitter.feed(text)))
+
+    def apply(self, events):
+        mm = events.first('pos_mm')
+        steps = events.first('pos_steps')
+        if mm != None and steps != None:
+            self.set('pos', mm.values + steps.values)
+        for kind in ['volts', 'limits', 'pnum']:
+            event = events.first(kind)
+            if event != None:
+                self.set(kind, event.value)
+        options = events.all('option')
+        if len(options) == 3 and events.first('crc') != None:
+            self.set('options', dict(event.values for event in options))
+
+    def homed(self):
+        limits = self.get('limits')
+        if limits == None:
+            return None
+        return limits == "X- Y-"
+
+    def query(self, name):
+        printer = self.printer
+        if name == 'pos':
+            value = printer.getPosition()
+        elif name == 'volts':
+            value = printer.volt()
+            if value == 0:
+                value = None
+        elif name == 'limits':
+            value = None
+            events = printer.request('lim')
+            if events != None and events.first('limits') != None:
+                value = events.first('limits').value
+        elif name == 'options':
+            value = printer.getOptions()
+        elif name == 'pnum':
+            value = printer.getPrinterNumber()
+        self.set(name, value)
+        return value
+
+    def refresh(self, name, maxAge=0):
+        '''Ask the printer unless the cached value is younger than maxAge.'''
+        if maxAge > 0:
+            value = self.get(name, maxAge)
+            if value != None:
+                return value
+        return self.query(name)
+
+    def idle(self):
+        printer = self.printer
+        if not printer.connected or not printer.monitorEnabled:
+            return False
+        if printer.printing or printer.sendingFile:
+            return False
+        if printer.serialDevice == None or printer.serialDevice.timeout != 0:
+            return False
+        since = printer.getTimeSinceLastCommand()
+        return since == None or since >= self.quiet
+
+    def due(self):
+        names = []
+        for name, rate in self.rates.items():
+            if rate == None:
+                continue
+            age = self.age(name)
+            if age == None or age >= rate:
+                names.append(name)
+        return names
+
+    def poll(self, exclude=()):
+        for name in self.due():
+            if name in exclude:
+                continue
+            if not self.idle():
+                break
+            self.query(name)
+
+    def waitFor(self, name, test, interval=0.5, timeout=None, cancel=None):
+        '''Re-query name every interval until test(value) holds.'''
+        start = time.time()
+        while True:
+            value = self.query(name)
+            if value != None and test(value):
+                return value
+            if cancel != None and cancel():
+                return None
+            if not self.printer.connected:
+                return None
+            if timeout != None and time.time() - start > timeout:
+                return None
+            time.sleep(interval)
+
+    def start(self, interval=0.25):
+        if self.thread != None:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self.pollLoop, args=(interval,))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def pollLoop(self, interval):
+        while self.running:
+            try:
+                self.poll()
+            except Exception as e:
+                self.printer.debug("state poll exception: {}".format(e))
+            time.sleep(interval)
+
+    def stop(self):
+        if self.thread == None:
+            return
+        self.running = False
+        self.thread.join()
+        self.thread = None
@@ -0,0 +1,210 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+    Argentum Control GUI
+
+    Copyright (C) 2013 Isabella Stevens
+    Copyright (C) 2014 Michael Shiel
+    Copyright (C) 2015 Trent Waddington
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+
+# The steps of printing a layout that don't need a user interface, shared
+# by the GUI's print view and headless.py: waiting for power, priming the
+# rollers, storing the jobs for multi-pass prints, then every layout pass
+# moving to each image, checking the move was within the limits and
+# printing the image's job. Progress, pausing and drying are hooks that
+# callers override; PrintLoop itself doesn't need Qt.
+#
+#   checkpoint = PrintCheckpoint(images, passes=2)
+#   ok = PrintLoop(printer, images, paths, checkpoint).run()
+
+import os
+import time
+from checkpoint import writeResumeJob
+from layoutfile import imageMove, dryingMoves
+
+class PrintLoopError(Exception):
+    pass
+
+class OutsideLimitsError(PrintLoopError):
+    pass
+
+class PrintLoop(object):
+    '''
+    Prints images, already sliced to the hex files in paths, for the layout
+    passes the checkpoint asks for, skipping whatever it has recorded as
+    done. run() returns False when canceled and raises PrintLoopError when
+    the print can't go on.
+    '''
+
+    def __init__(self, printer, images, paths, checkpoint):
+        self.printer = printer
+        self.images = images
+        self.paths = paths
+        self.checkpoint = checkpoint
+
+    ### Hooks
+
+    def canceled(self):
+        return False
+
+    def message(self, text):
+        pass
+
+    def progressFunc(self, pos, size):
+        return not self.canceled()
+
+    def waitIfPaused(self):
+        pass
+
+    def setSpeed(self):
+        pass
+
+    def passStarted(self, layoutPass):
+        self.message("Starting pass {}".format(layoutPass + 1))
+
+    def imagePrinted(self, layoutPass, image):
+        pass
+
+    def passPrinted(self, layoutPass, pipeline):
+        pass
+
+    def dry(self):
+        pipeline = self.printer.pipeline(control=lambda: not self.canceled())
+        pipeline.command("l E", expect=None)
+        for image in self.images:
+            self.message("Drying " + image.hexFilename)
+            for x, y, left in dryingMoves(image):
+                pipeline.moveTo(x, y)
+                pipeline.command("l d", expect=None)
+                pipeline.dwell(1.5)
+                pipeline.moveTo(left, y)
+                pipeline.command("l r", expect=None)
+                pipeline.dwell(1.5)
+        pipeline.finish()
+        self.printer.command("l e", expect='rollers')
+
+    ### The loop
+
+    def run(self):
+        printer = self.printer
+        printer.monitorEnabled = False
+        try:
+            if not self.waitForPower():
+                return False
+            self.start()
+            stored = self.store()
+            if self.canceled():
+                return False
+            if not self.printPasses(stored):
+                return False
+            printer.home()
+        finally:
+            printer.monitorEnabled = True
+        return True
+
+    def waitForPower(self):
+        state = self.printer.state
+        volts = state.refresh('volts', maxAge=2)
+        if volts == None or volts < 5:
+            self.message("Please turn on your printer.")
+            volts = state.waitFor('volts', lambda v: v >= 5, cancel=self.canceled)
+            if volts == None:
+                if self.canceled():
+                    return False
+                raise PrintLoopError("Printer isn't connected.")
+        return True
+
+    def start(self):
+        printer = self.printer
+        self.message("Starting print.")
+        printer.turnLightsOn()
+        printer.command("l E", expect='rollers')
+        printer.command("l r", expect='rollers')
+        time.sleep(1.5)
+        printer.command("l e", expect='rollers')
+        printer.turnMotorsOn()
+        self.setSpeed()
+        printer.home(wait=True)
+
+    def store(self):
+        # With more than one pass, store the images on the printer once
+        # and print them from there rather than streaming them every pass.
+        if self.checkpoint.passes <= 1:
+            return {}
+        self.message("Storing images on the printer.")
+        return self.printer.storeJobs(self.paths, progressFunc=self.progressFunc)
+
+    def printPasses(self, stored):
+        checkpoint = self.checkpoint
+        if checkpoint.started():
+            print("Resuming print at {}.".format(checkpoint.describe()))
+        pipeline = self.printer.pipeline()
+        for i in range(checkpoint.passes):
+            if i < checkpoint.layoutPass:
+                continue
+            self.passStarted(i)
+            for n, (image, path) in enumerate(zip(self.images, self.paths)):
+                if checkpoint.skip(i, n):
+                    continue
+                if self.canceled():
+                    return False
+                self.waitIfPaused()
+                if not self.printImage(pipeline, i, image, path, stored):
+                    return False
+                checkpoint.finishImage()
+                self.imagePrinted(i, n)
+            if checkpoint.useRollers:
+                self.dry()
+            checkpoint.finishPass()
+            self.passPrinted(i, pipeline)
+        return True
+
+    def printImage(self, pipeline, layoutPass, image, path, stored):
+        # An interrupted image carries on from a copy of its job without
+        # the passes already printed.
+        checkpoint = self.checkpoint
+        printer = self.printer
+        pos = imageMove(image)
+        done = checkpoint.done
+        if done > 0:
+            path, offset = writeResumeJob(path, done)
+            if path == None:
+                return True
+            pos = (pos[0] + offset[0], pos[1] + offset[1])
+        move = pipeline.moveTo(pos[0], pos[1])
+        move.wait(10)
+        if move.error():
+            raise OutsideLimitsError("{} is outside the print limits".format(image.filename))
+        name = os.path.basename(path)
+        self.message("Pass {}: {}".format(layoutPass + 1, name))
+        self.waitIfPaused()
+        checkpoint.startImage(name, done)
+        try:
+            if stored.get(path):
+                ok = printer.Print(name, path, progressFunc=self.progressFunc)
+            else:
+                ok = printer.send(path, progressFunc=self.progressFunc, printOnline=True)
+        finally:
+            checkpoint.record(printer.lastPass)
+        if not ok:
+            if self.canceled():
+                return False
+            raise PrintLoopError("Printer error on {}".format(name))
+        return True
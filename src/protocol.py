@@ -0,0 +1,167 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+    Argentum Control GUI
+
+    Copyright (C) 2013 Isabella Stevens
+    Copyright (C) 2014 Michael Shiel
+    Copyright (C) 2015 Trent Waddington
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+
+# The messages the firmware sends, compiled into a single matcher. Each line
+# of printer output is matched once and turned into an Event with the
+# message kind and its fields already converted, so callers look events up
+# by kind instead of searching the text themselves.
+
+import re
+
+def text(value):
+    return value
+
+def stripped(value):
+    return value.strip()
+
+# (kind, pattern, converters for the pattern's groups)
+MESSAGES = [
+    ('version',       r'\+Version \[([^\]]*)\]',                     (text,)),
+    ('pnum',          r'\+Printer Number \[([^\]]*)\]',              (text,)),
+    ('pos_mm',        r'\+X: (-?[0-9.]+) mm, Y: (-?[0-9.]+) mm',     (float, float)),
+    ('pos_steps',     r'\+X: (-?[0-9]+) steps, Y: (-?[0-9]+) steps', (int, int)),
+    ('volts',         r'\+Voltage: (-?[0-9.]+) volts\.',             (float,)),
+    ('limits',        r'\+Limits: ([XY+\- ]*)',                      (stripped,)),
+    ('eeprom',        r'\+EEPROM',                                   ()),
+    ('option',        r'(horizontal_offset|vertical_offset|print_overlap): *(-?[0-9]+)', (str, int)),
+    ('crc',           r'\+?CRC: *(.*)',                              (text,)),
+    ('out_of_limits', r'\+Out of limits (-?[0-9]+)/([0-9]+) (-?[0-9]+)/([0-9]+)', (int, int, int, int)),
+    ('no_such_file',  r'\+No such file: (.*)',                       (text,)),
+    ('rollers',       r'\+Done rollers(.*)',                         (stripped,)),
+    ('print_complete', r'\+Print complete',                          ()),
+    ('stopping',      r'\+Stopping',                                 ()),
+    ('ok',            r'(?<![A-Za-z])Ok\Z',                                       ()),
+    # Firmware before the +Version message printed a bare date stamped version.
+    ('legacy_version', r'([0-9][0-9.]*\+201[45][0-9]*)',             (text,)),
+]
+
+def compileMessages(messages):
+    pattern = []
+    groups = {}
+    index = 1
+    for kind, regex, converters in messages:
+        pattern.append('(?P<{}>{})'.format(kind, regex))
+        count = re.compile(regex).groups
+        groups[kind] = (index + 1, count, converters)
+        index = index + 1 + count
+    return re.compile('|'.join(pattern)), groups
+
+MATCHER, GROUPS = compileMessages(MESSAGES)
+
+VERSION = re.compile(r'\s*([0-9]+)\.([0-9]+)\.([0-9]+)(?:-([^+]*))?\+(\S{8})\s*\Z')
+
+class Event(object):
+    def __init__(self, kind, values, line, number=None):
+        self.kind = kind
+        self.values = values
+        self.line = line
+        self.number = number
+
+    @property
+    def value(self):
+        if len(self.values) == 0:
+            return None
+        return self.values[0]
+
+    def __repr__(self):
+        return 'Event({!r}, {!r})'.format(self.kind, self.values)
+
+def parseLine(line, number=None):
+    '''Returns the Event for a line of output, or None if it isn't known.'''
+    m = MATCHER.search(line)
+    if m == None:
+        return None
+    kind = m.lastgroup
+    first, count, converters = GROUPS[kind]
+    values = []
+    for n in range(count):
+        values.append(converters[n](m.group(first + n)))
+    return Event(kind, tuple(values), line, number)
+
+class Events(object):
+    '''The events parsed from a response, plus the lines nobody knows.'''
+
+    def __init__(self, lines=None):
+        self.events = []
+        self.unknown = []
+        self.count = 0
+        if lines != None:
+            self.extend(lines)
+
+    def extend(self, lines):
+        for line in lines:
+            number = self.count
+            self.count = self.count + 1
+            line = line.rstrip('\r')
+            if line == '':
+                continue
+            event = parseLine(line, number)
+            if event == None:
+                self.unknown.append(line)
+            else:
+                self.events.append(event)
+
+    def first(self, kind):
+        for event in self.events:
+            if event.kind == kind:
+                return event
+        return None
+
+    def all(self, kind):
+        return [event for event in self.events if event.kind == kind]
+
+    def __iter__(self):
+        return iter(self.events)
+
+    def __len__(self):
+        return len(self.events)
+
+class LineSplitter(object):
+    '''Turns arbitrary chunks of output into whole lines.'''
+
+    def __init__(self):
+        self.partial = ''
+
+    def feed(self, text):
+        lines = (self.partial + text).split('\n')
+        self.partial = lines.pop()
+        return lines
+
+def bannerComplete(text):
+    '''True once the boot banner's version line has been received.'''
+    for line in text.split('\n')[:-1]:
+        event = parseLine(line.rstrip('\r'))
+        if event != None and event.kind in ('version', 'legacy_version'):
+            return True
+    return False
+
+def splitVersion(text):
+    '''Returns (major, minor, patch, tag, build) or None.'''
+    m = VERSION.match(text)
+    if m == None:
+        return None
+    major, minor, patch, tag, build = m.groups()
+    return (int(major), int(minor), int(patch), tag, build)
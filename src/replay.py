@@ -0,0 +1,253 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+    Argentum Control GUI
+
+    Copyright (C) 2013 Isabella Stevens
+    Copyright (C) 2014 Michael Shiel
+    Copyright (C) 2015 Trent Waddington
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+# Replays recorded serial sessions (see serialsession.py) against the real
+# ArgentumPrinterController, as a latency and throughput regression test for
+# connect, send and Print.
+#
+#   python replay.py [--fast] [--tolerance 0.25] <session file>
+#
+# Every recorded operation is run again with the printer side played back
+# from the recording. With --fast the printer answers as soon as the
+# controller has written what it wrote originally, which measures the
+# controller's own overhead.
+
+import sys
+import os
+import time
+import shutil
+import tempfile
+import argparse
+import threading
+from virtualprinter import PtyDevice
+from serialsession import loadSession, sessionOperations, monotonic
+from ArgentumPrinterController import ArgentumPrinterController
+
+def coalesceReads(records, gap):
+    '''
+    The controller reads a response with read(1) followed by read(n) of
+    whatever is waiting, so one burst from the printer is recorded as
+    several reads. Join reads that followed each other within gap seconds
+    so they are played back as the burst they were.
+    '''
+    merged = []
+    for kind, timestamp, data in records:
+        if (kind == 'r' and len(merged) > 0 and merged[-1][0] == 'r' and
+                timestamp - merged[-1][3] < gap):
+            last = merged[-1]
+            merged[-1] = ('r', last[1], last[2] + data, timestamp)
+        else:
+            merged.append((kind, timestamp, data, timestamp))
+    return [(kind, timestamp, data) for kind, timestamp, data, last in merged]
+
+class SessionReplayer(PtyDevice):
+    '''
+    Plays the printer side of recorded operations back over a pty. Each
+    chunk the printer sent is held back until the controller has written
+    everything it wrote before that chunk in the recording, and then, if
+    realtime is set, for as long as the printer originally took to answer.
+
+    Call replay(operation) before running the same operation on the
+    controller.
+    '''
+
+    settleTime = 0.05
+    coalesceGap = 0.005
+
+    def __init__(self, realtime=True, baudRate=None):
+        super(SessionReplayer, self).__init__(baudRate)
+        self.realtime = realtime
+        self.lock = threading.Lock()
+        self.operation = None
+
+    def resetStats(self):
+        super(SessionReplayer, self).resetStats()
+        self.stats.update({'mismatches': 0,
+                           'firstMismatch': None})
+
+    def replay(self, operation):
+        with self.lock:
+            self.operation = operation
+            self.records = coalesceReads(operation.records, self.coalesceGap)
+            self.inbuf = ''
+            self.index = 0
+            self.expected = ''
+            self.writing = False
+            self.received = 0
+            self.lastEvent = monotonic()
+            self.lastEventTime = operation.start
+            self.openedAt = None
+            self.resetStats()
+
+    def done(self):
+        with self.lock:
+            return self.operation == None or self.index >= len(self.records)
+
+    def portOpened(self):
+        super(SessionReplayer, self).portOpened()
+        self.openedAt = monotonic()
+
+    def portClosed(self):
+        super(SessionReplayer, self).portClosed()
+        self.openedAt = None
+
+    def run(self):
+        self.openedAt = None
+        while self.running:
+            self.readInput(0.005)
+            with self.lock:
+                if self.operation == None:
+                    self.inbuf = ''
+                    continue
+                self.consumeInput()
+                self.step()
+
+    def consumeInput(self):
+        # Check what the controller wrote against the recording. Anything
+        # beyond the write we're waiting for is kept for the next one.
+        n = min(len(self.inbuf), len(self.expected))
+        if n == 0:
+            return
+        if self.inbuf[:n] != self.expected[:n]:
+            if self.stats['firstMismatch'] == None:
+                self.stats['firstMismatch'] = self.received
+            self.stats['mismatches'] += 1
+        self.received = self.received + n
+        self.expected = self.expected[n:]
+        self.inbuf = self.inbuf[n:]
+
+    def step(self):
+        records = self.records
+        while self.index < len(records):
+            kind, timestamp, data = records[self.index]
+            if kind == 'w':
+                if not self.writing:
+                    self.writing = True
+                    self.expected = data
+                    self.consumeInput()
+                if len(self.expected) > 0:
+                    return
+                self.writing = False
+                self.advance(timestamp)
+            elif kind == 'o':
+                if self.openedAt == None or monotonic() - self.openedAt < self.settleTime:
+                    return
+                self.advance(timestamp)
+            elif kind == 'r':
+                if self.realtime:
+                    due = self.lastEvent + (timestamp - self.lastEventTime)
+                    if monotonic() < due:
+                        return
+                if not self.portOpen:
+                    return
+                self.write(data)
+                self.advance(timestamp)
+            else:
+                self.advance(timestamp)
+
+    def advance(self, timestamp):
+        self.index = self.index + 1
+        self.lastEvent = monotonic()
+        self.lastEventTime = timestamp
+
+def callback(*args):
+    return True
+
+def runOperation(printer, operation, tmpdir):
+    values = {'<callback>': callback, 'None': None}
+    args = [values.get(arg, arg) for arg in operation.args]
+    if operation.name == 'connect':
+        return printer.connect()
+    local = args[0] if operation.name == 'send' else args[1]
+    path = None
+    if local != None:
+        path = os.path.join(tmpdir, os.path.basename(local))
+    if path != None and operation.contents != None:
+        f = open(path, 'wb')
+        f.write(operation.contents)
+        f.close()
+    if operation.name == 'send':
+        return printer.send(path, args[1], args[2] == 'True')
+    if operation.name == 'Print':
+        return printer.Print(args[0], path, args[2])
+    raise ValueError('unknown operation ' + operation.name)
+
+def replaySession(path, realtime=True, tolerance=0.25, slack=0.1):
+    '''
+    Replays a recording and returns how many operations failed. An
+    operation is too slow if it takes more than tolerance longer than it
+    did, plus slack seconds for the latency polling the pty adds.
+    '''
+    operations = sessionOperations(loadSession(path))
+    if len(operations) > 0 and operations[0].name != 'connect':
+        print('{} has no connect to start from'.format(path))
+        return 1
+    replayer = SessionReplayer(realtime=realtime)
+    replayer.start()
+    tmpdir = tempfile.mkdtemp()
+    printer = ArgentumPrinterController(replayer.port)
+    failures = 0
+    try:
+        for operation in operations:
+            replayer.replay(operation)
+            start = monotonic()
+            result = runOperation(printer, operation, tmpdir)
+            elapsed = monotonic() - start
+            while not replayer.done() and monotonic() - start < elapsed + 5:
+                time.sleep(0.01)
+
+            recorded = operation.duration()
+            problems = []
+            if str(result) != operation.result:
+                problems.append('result {} was {}'.format(result, operation.result))
+            if replayer.stats['mismatches'] > 0:
+                problems.append('diverged at byte {}'.format(replayer.stats['firstMismatch']))
+            if not replayer.done():
+                problems.append('stalled')
+            if realtime and recorded and elapsed > recorded * (1 + tolerance) + slack:
+                problems.append('slower than recorded')
+            print('{:<8} {:<24} recorded {:8.3f} s  replayed {:8.3f} s  {}'.format(
+                  operation.name,
+                  os.path.basename(operation.args[0]) if operation.name != 'connect' and operation.args and operation.args[0] != 'None' else '',
+                  recorded or 0, elapsed,
+                  ', '.join(problems) if problems else 'ok'))
+            if problems:
+                failures = failures + 1
+    finally:
+        printer.disconnect()
+        replayer.stop()
+        shutil.rmtree(tmpdir)
+    return failures
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay a recorded printer session.')
+    parser.add_argument('--fast', action='store_true', help="don't reproduce the printer's timing")
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown in realtime mode')
+    parser.add_argument('--slack', type=float, default=0.1, help='seconds allowed on top of the tolerance')
+    parser.add_argument('session', help='session file to replay')
+    args = parser.parse_args()
+    failures = replaySession(args.session, realtime=not args.fast, tolerance=args.tolerance,
+                             slack=args.slack)
+    sys.exit(1 if failures else 0)
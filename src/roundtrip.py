@@ -0,0 +1,254 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+    Argentum Control GUI
+
+    Copyright (C) 2013 Isabella Stevens
+    Copyright (C) 2014 Michael Shiel
+    Copyright (C) 2015 Trent Waddington
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# Checks that the slicer still puts ink in the right place. Each test image
+# is sliced with ImageProcessor.sliceImage, the hex file is drawn back into
+# the pixels of the image with hexpreview, and the ink of the first
+# cartridge is compared with the pixels the slicer should have inked. The
+# slice time, hex size and peak memory of each image and the result of the
+# comparison, with the regions that mismatch, go in a JSON report.
+#
+#   python roundtrip.py [--report roundtrip.json] [--baseline old.json]
+#                       [--tolerance 10] [--size 800x600] [images...]
+#
+# Without images a synthetic corpus of boards is generated. With a baseline
+# report, an image fails if it now mismatches more pixels than it did. The
+# hex files shipped next to this script are run through the simulator too,
+# and fail if it can't draw them or they come out blank.
+
+import sys
+import os
+import time
+import json
+import random
+import shutil
+import glob
+import hashlib
+import tempfile
+import argparse
+import multiprocessing
+import numpy
+from PIL import Image, ImageDraw
+from imageproc import ImageProcessor
+from hexpreview import renderHex, INK
+from imgdiff import diff_arrays
+from simulator import Simulation
+try:
+    import resource
+except ImportError:
+    # Windows
+    resource = None
+
+# The slicer fires where the blue channel is this dark or darker.
+INK_LEVEL = 200
+# Regions of mismatch kept in the report for each image.
+MAX_BOXES = 20
+
+def makeBoard(path, width, height, seed=1):
+    '''Draws a board-like test image: traces, pads and a line of text.'''
+    rnd = random.Random(seed)
+    image = Image.new('RGB', (width, height), (255, 255, 255))
+    draw = ImageDraw.Draw(image)
+    for i in range(width * height // 20000):
+        x, y = rnd.randint(0, width), rnd.randint(0, height)
+        for j in range(rnd.randint(1, 4)):
+            if rnd.random() < 0.5:
+                nx, ny = rnd.randint(0, width), y
+            else:
+                nx, ny = x, rnd.randint(0, height)
+            draw.line((x, y, nx, ny), fill=(0, 0, 0), width=rnd.randint(2, 12))
+            x, y = nx, ny
+        r = rnd.randint(4, 20)
+        if rnd.random() < 0.5:
+            draw.ellipse((x - r, y - r, x + r, y + r), fill=(0, 0, 0))
+        else:
+            draw.rectangle((x - r, y - r, x + r, y + r), fill=(0, 0, 0))
+    draw.text((10, 10), 'Argentum round trip {}'.format(seed), fill=(0, 0, 0))
+    image.save(path)
+    return path
+
+def makeCorpus(tmpdir):
+    paths = []
+    for seed, size in enumerate([(200, 120), (640, 480), (1200, 900)]):
+        paths.append(makeBoard(os.path.join(tmpdir, 'board{}.png'.format(seed + 1)),
+                               size[0], size[1], seed + 1))
+    return paths
+
+def peakMemory():
+    '''The most memory this process has used, in bytes.'''
+    if resource == None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux counts in KB, OS X in bytes.
+    if sys.platform != 'darwin':
+        peak = peak * 1024
+    return peak
+
+def sliceWorker(image, hexPath, size, results):
+    # Each image is sliced in its own process so its peak memory is its own.
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        start = time.time()
+        ImageProcessor().sliceImage(image, hexPath, size=size)
+        seconds = time.time() - start
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    results.put((seconds, peakMemory()))
+
+def sliceImage(image, hexPath, size=None):
+    '''Slices image in a child process, returning (seconds, peak memory).'''
+    results = multiprocessing.Queue()
+    worker = multiprocessing.Process(target=sliceWorker, args=(image, hexPath, size, results))
+    worker.start()
+    worker.join()
+    if worker.exitcode != 0:
+        raise RuntimeError('Slicing {} failed'.format(image))
+    return results.get()
+
+def expectedInk(image, size=None):
+    '''The pixels of image the slicer should ink, as a boolean array.'''
+    image = Image.open(image).convert('RGBA')
+    if size:
+        image = image.resize(size, Image.ANTIALIAS)
+    return numpy.asarray(image)[:, :, 2] <= INK_LEVEL
+
+def compareInk(expected, printed):
+    '''Counts the pixels that should be inked but aren't, and the other way.'''
+    diff = diff_arrays(expected, printed)
+    missing = numpy.count_nonzero(expected & diff.mask)
+    return diff, {'ink': int(numpy.count_nonzero(expected)),
+                  'printed': int(numpy.count_nonzero(printed)),
+                  'missing': int(missing),
+                  'extra': diff.count - int(missing),
+                  'mismatch': diff.percentage,
+                  'regions': len(diff.boxes),
+                  'boxes': diff.boxes[:MAX_BOXES]}
+
+def roundTrip(image, tmpdir, size=None, heatmap=False):
+    name = os.path.basename(image)
+    hexPath = os.path.join(tmpdir, os.path.splitext(name)[0] + '.hex')
+    sliceSeconds, memory = sliceImage(image, hexPath, size)
+    start = time.time()
+    printed = renderHex(hexPath, 1) == INK
+    renderSeconds = time.time() - start
+    expected = expectedInk(image, size)
+    f = open(hexPath, 'rb')
+    md5 = hashlib.md5(f.read()).hexdigest()
+    f.close()
+    entry = {'image': name,
+             'size': [expected.shape[1], expected.shape[0]],
+             'sliceSeconds': sliceSeconds,
+             'renderSeconds': renderSeconds,
+             'hexBytes': os.path.getsize(hexPath),
+             'hexMd5': md5,
+             'peakMemory': memory}
+    diff, comparison = compareInk(expected, printed)
+    entry.update(comparison)
+    if heatmap and diff.count > 0:
+        source = numpy.where(expected, 0, 255).astype(numpy.uint8)
+        diff.heatmap(source).save(os.path.splitext(hexPath)[0] + '-diff.png')
+    return entry
+
+def simulateSample(path):
+    entry = {'hex': os.path.basename(path), 'failure': None}
+    try:
+        pixels = Simulation(path).render()
+    except Exception as e:
+        entry['failure'] = 'simulator failed: {}'.format(e)
+        return entry
+    entry['size'] = [pixels.shape[1], pixels.shape[0]]
+    entry['ink'] = int(numpy.count_nonzero((pixels[:, :, :3] != 255).any(axis=2)))
+    if entry['ink'] == 0:
+        entry['failure'] = 'no ink'
+    return entry
+
+def check(entry, tolerance, baseline=None):
+    '''Why the entry fails, or None.'''
+    if entry['mismatch'] > tolerance:
+        return '{:.2f}% of pixels mismatch'.format(entry['mismatch'])
+    if baseline != None:
+        old = baseline.get(entry['image'])
+        if old != None and entry['missing'] + entry['extra'] > old['missing'] + old['extra']:
+            return '{} pixels mismatch, {} before'.format(entry['missing'] + entry['extra'],
+                                                          old['missing'] + old['extra'])
+    return None
+
+def formatEntry(entry):
+    memory = '-'
+    if entry['peakMemory'] != None:
+        memory = '{:.0f}MB'.format(entry['peakMemory'] / 1048576.0)
+    return '{:<24} {:>9} {:8.2f}s {:>10} {:>7} {:7.2f}%  {}'.format(
+        entry['image'][:24], '{}x{}'.format(*entry['size']), entry['sliceSeconds'],
+        entry['hexBytes'], memory, entry['mismatch'], entry.get('failure') or 'ok')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Slice test images and check the ink lands where it should.')
+    parser.add_argument('--report', default='roundtrip.json', help='where to write the JSON report')
+    parser.add_argument('--baseline', default=None, help='an earlier report to compare mismatches with')
+    parser.add_argument('--tolerance', type=float, default=10.0, help='percentage of pixels allowed to mismatch')
+    parser.add_argument('--size', default=None, help='slice every image at WIDTHxHEIGHT')
+    parser.add_argument('--keep', default=None, help='directory to keep the hex files and heat maps of the mismatches in')
+    parser.add_argument('images', nargs='*', help='test images')
+    args = parser.parse_args()
+
+    size = None
+    if args.size:
+        size = tuple(int(n) for n in args.size.split('x'))
+    baseline = None
+    if args.baseline:
+        f = open(args.baseline, 'r')
+        baseline = dict((entry['image'], entry) for entry in json.load(f)['images'])
+        f.close()
+
+    tmpdir = tempfile.mkdtemp()
+    hexDir = args.keep or tmpdir
+    if not os.path.exists(hexDir):
+        os.makedirs(hexDir)
+    images = args.images or makeCorpus(tmpdir)
+    report = {'tolerance': args.tolerance, 'images': [], 'samples': []}
+    ok = True
+    print('{:<24} {:>9} {:>9} {:>10} {:>7} {:>8}'.format('image', 'size', 'slice', 'hex', 'memory', 'mismatch'))
+    try:
+        for image in images:
+            entry = roundTrip(image, hexDir, size, args.keep != None)
+            entry['failure'] = check(entry, args.tolerance, baseline)
+            ok = ok and entry['failure'] == None
+            report['images'].append(entry)
+            print(formatEntry(entry))
+    finally:
+        shutil.rmtree(tmpdir)
+
+    for path in sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), '*.hex'))):
+        entry = simulateSample(path)
+        ok = ok and entry['failure'] == None
+        report['samples'].append(entry)
+        print('{:<24} {:>9} {:>9}  {}'.format(entry['hex'][:24], 'simulated', entry.get('ink', '-'),
+                                             entry['failure'] or 'ok'))
+
+    f = open(args.report, 'w')
+    json.dump(report, f, indent=2, sort_keys=True)
+    f.close()
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,134 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+    Argentum Control GUI
+
+    Copyright (C) 2013 Isabella Stevens
+    Copyright (C) 2014 Michael Shiel
+    Copyright (C) 2015 Trent Waddington
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+# Low overhead logging of serial traffic for debugging. Chunks are stored
+# raw with a timestamp in a bounded ring buffer, and a background thread
+# drains the ring into a binary log in the session format (serialsession.py).
+# Nothing is formatted until the log is exported as text.
+#
+#   python seriallog.py serial-log.bin > serial.txt
+
+import re
+import atexit
+import sys
+import threading
+import collections
+from serialsession import MAGIC, RECORD, loadSession, monotonic
+
+# Characters that are written to the text log as they are.
+PLAIN = re.compile(r"[^a-zA-Z0-9+\- #\[\].,?!:_']")
+
+def escape(match):
+    c = match.group()
+    if c == '\r':
+        return '\\r'
+    if c == '\n':
+        return '\\n'
+    return '\\x{:02x}'.format(ord(c))
+
+LABELS = {'w': 'write:', 'r': 'read:', 'd': ''}
+
+def formatRecords(records):
+    lines = []
+    for kind, timestamp, data in records:
+        if kind == 'd':
+            text = data
+        elif kind in LABELS:
+            text = LABELS[kind] + PLAIN.sub(escape, data)
+        else:
+            continue
+        lines.append('{:10.4f} {}\n'.format(timestamp, text))
+    return ''.join(lines)
+
+class SerialLog(object):
+    '''
+    add() only appends to the ring, so leaving logging on costs next to
+    nothing. If the writer thread falls behind, the oldest chunks are lost
+    rather than slowing down the serial link.
+    '''
+
+    def __init__(self, path, capacity=16384, interval=0.5):
+        self.path = path
+        self.ring = collections.deque(maxlen=capacity)
+        self.interval = interval
+        self.start = monotonic()
+        self.lock = threading.Lock()
+        self.file = open(path, 'wb')
+        self.file.write(MAGIC)
+        self.running = True
+        self.wakeup = threading.Event()
+        self.thread = threading.Thread(target=self.drainLoop)
+        self.thread.daemon = True
+        self.thread.start()
+        atexit.register(self.close)
+
+    def add(self, kind, data):
+        self.ring.append((kind, monotonic() - self.start, data))
+
+    def drainLoop(self):
+        while self.running:
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+            self.drain()
+
+    def drain(self):
+        with self.lock:
+            if self.file == None:
+                return
+            chunks = []
+            while True:
+                try:
+                    kind, timestamp, data = self.ring.popleft()
+                except IndexError:
+                    break
+                chunks.append(RECORD.pack(kind, timestamp, len(data)))
+                chunks.append(data)
+            if len(chunks) > 0:
+                self.file.write(''.join(chunks))
+                self.file.flush()
+
+    def export(self, path):
+        self.drain()
+        f = open(path, 'w')
+        f.write(formatRecords(loadSession(self.path)))
+        f.close()
+
+    def close(self):
+        if self.file == None:
+            return
+        self.running = False
+        self.wakeup.set()
+        self.thread.join()
+        self.drain()
+        with self.lock:
+            self.file.close()
+            self.file = None
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print('usage: {} <serial log>'.format(sys.argv[0]))
+        sys.exit(1)
+
+    sys.stdout.write(formatRecords(loadSession(sys.argv[1])))
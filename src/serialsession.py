@@ -0,0 +1,228 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+    Argentum Control GUI
+
+    Copyright (C) 2013 Isabella Stevens
+    Copyright (C) 2014 Michael Shiel
+    Copyright (C) 2015 Trent Waddington
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+# Binary recordings of serial sessions with a printer. See replay.py for
+# playing them back.
+#
+# A session file starts with MAGIC and is followed by records of
+#
+#   kind (1 byte) | timestamp (double, seconds) | length (uint32) | data
+#
+# all little endian. Timestamps are monotonic, see below, and relative to
+# the start of the recording. Record kinds are:
+#
+#   w   bytes written by the controller
+#   r   bytes read by the controller
+#   o   the port was opened
+#   c   the port was closed
+#   b   an operation began, data is the name and arguments, tab separated
+#   e   an operation ended, data is its result
+#   f   contents of the file the current operation sends or prints
+
+import os
+import sys
+import struct
+import threading
+import time
+
+MAGIC = 'ARGSESS1'
+RECORD = struct.Struct('<cdI')
+
+def posixMonotonic():
+    '''clock_gettime(CLOCK_MONOTONIC) through ctypes, or None.'''
+    clockIds = {'linux2': 1, 'darwin': 6}
+    if sys.platform not in clockIds:
+        return None
+    import ctypes
+    import ctypes.util
+
+    class timespec(ctypes.Structure):
+        _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        clock_gettime = libc.clock_gettime
+    except (OSError, AttributeError):
+        return None
+    clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+    clockId = clockIds[sys.platform]
+
+    def monotonic():
+        t = timespec()
+        if clock_gettime(clockId, ctypes.byref(t)) != 0:
+            raise OSError(ctypes.get_errno(), 'clock_gettime failed')
+        return t.tv_sec + t.tv_nsec * 1e-9
+    try:
+        monotonic()
+    except OSError:
+        return None
+    return monotonic
+
+# Python 2 has no time.monotonic. On Windows time.clock counts up from the
+# performance counter, elsewhere the system clock is asked directly. Only
+# where neither works are timestamps wall clock time.
+if hasattr(time, 'monotonic'):
+    monotonic = time.monotonic
+elif sys.platform == 'win32':
+    monotonic = time.clock
+else:
+    monotonic = posixMonotonic() or time.time
+
+class SessionRecorder(object):
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'wb')
+        self.file.write(MAGIC)
+        self.start = monotonic()
+        self.lock = threading.Lock()
+
+    def record(self, kind, data=''):
+        with self.lock:
+            if self.file == None:
+                return
+            self.file.write(RECORD.pack(kind, monotonic() - self.start, len(data)))
+            self.file.write(data)
+
+    def beginOperation(self, name, args):
+        self.record('b', '\t'.join([name] + [str(arg) for arg in args]))
+
+    def attachFile(self, path):
+        try:
+            f = open(path, 'rb')
+            contents = f.read()
+            f.close()
+        except IOError:
+            return
+        self.record('f', contents)
+
+    def endOperation(self, result):
+        self.record('e', str(result))
+
+    def close(self):
+        with self.lock:
+            if self.file:
+                self.file.close()
+                self.file = None
+
+def recordedOperation(name, fileArg=None):
+    '''
+    Decorates a controller method so its start, arguments and result are
+    marked in the session recording. fileArg names the argument holding a
+    path whose contents should be captured with the operation.
+    '''
+    def decorate(method):
+        argNames = method.__code__.co_varnames[1:method.__code__.co_argcount]
+        defaults = dict(zip(reversed(argNames), reversed(method.__defaults__ or ())))
+        def wrapper(self, *args, **kwargs):
+            # Started here rather than in the method, so that the first
+            # operation is recorded too.
+            if self.recordSessions and self.sessionRecorder == None:
+                self.startRecordingSession()
+            recorder = self.sessionRecorder
+            if recorder == None:
+                return method(self, *args, **kwargs)
+            values = dict(zip(argNames, args))
+            for n in argNames[len(args):]:
+                values[n] = kwargs.get(n, defaults.get(n))
+            recorder.beginOperation(name, ['<callback>' if callable(values[n]) else values[n]
+                                           for n in argNames])
+            if fileArg != None and values[fileArg]:
+                recorder.attachFile(values[fileArg])
+            result = None
+            try:
+                result = method(self, *args, **kwargs)
+            finally:
+                recorder.endOperation(result)
+            return result
+        wrapper.__name__ = method.__name__
+        wrapper.__doc__ = method.__doc__
+        return wrapper
+    return decorate
+
+def loadSession(path):
+    f = open(path, 'rb')
+    contents = f.read()
+    f.close()
+    if contents[:len(MAGIC)] != MAGIC:
+        raise ValueError('{} is not a session recording'.format(path))
+    records = []
+    pos = len(MAGIC)
+    while pos + RECORD.size <= len(contents):
+        kind, timestamp, length = RECORD.unpack_from(contents, pos)
+        pos = pos + RECORD.size
+        records.append((kind, timestamp, contents[pos:pos+length]))
+        pos = pos + length
+    return records
+
+class Operation(object):
+    '''
+    One recorded connect, send or Print, with the records that belong to it.
+    '''
+    def __init__(self, name, args, start):
+        self.name = name
+        self.args = args
+        self.start = start
+        self.end = None
+        self.result = None
+        self.contents = None
+        self.records = []
+
+    def duration(self):
+        if self.end == None:
+            return None
+        return self.end - self.start
+
+def sessionOperations(records):
+    '''
+    The operations in a recording. Traffic before the first operation, as
+    left by connectFirst or by recordings that missed their connect, is
+    made into a connect of its own so the session can still be replayed.
+    '''
+    operations = []
+    current = None
+    leading = None
+    for kind, timestamp, data in records:
+        if kind == 'b':
+            fields = data.split('\t')
+            current = Operation(fields[0], fields[1:], timestamp)
+            operations.append(current)
+        elif current == None:
+            if len(operations) == 0 and kind in 'wroc':
+                if leading == None:
+                    leading = Operation('connect', ['None'], timestamp)
+                    leading.result = 'True'
+                leading.records.append((kind, timestamp, data))
+            continue
+        elif kind == 'e':
+            current.end = timestamp
+            current.result = data
+            current = None
+        elif kind == 'f':
+            current.contents = data
+        else:
+            current.records.append((kind, timestamp, data))
+    if leading != None and (len(operations) == 0 or operations[0].name != 'connect'):
+        operations.insert(0, leading)
+    return operations
@@ -0,0 +1,303 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+    Argentum Control GUI
+
+    Copyright (C) 2013 Isabella Stevens
+    Copyright (C) 2014 Michael Shiel
+    Copyright (C) 2015 Trent Waddington
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# Simulates printing a hex file, with NumPy instead of a pixel at a time.
+# The file is decoded into arrays of moves and of firings, one firing for
+# each cartridge with its address and bitmask, the head position of every
+# firing is worked out from the moves before it, and then all the nozzles
+# that fire are found and drawn at once with lookup tables built from
+# CartridgeMath. Both the textual and the binary firing formats are read.
+#
+# The picture is the one pixel.py has always drawn: white, with ink from
+# the first cartridge in red and ink from the second, 726 pixels along, in
+# blue. Where both fire it's black.
+#
+#   python simulator.py <hex file> <image file>
+
+import sys
+import numpy
+from PIL import Image
+from CartridgeMath import offset_for_nozzle, nozzle_from_primitive_address
+from hexfile import HexFile
+from hexpreview import HEX, parseInts, CHUNK_SIZE
+
+SPN = 3.386666
+HEAD_OFFSET = 726
+# The picture is moved down to leave room for a line of text.
+TEXT_HEIGHT = 20
+# Firing records in the binary format are 8 bytes: 01 firing address \n,
+# once for each cartridge.
+RECORD_SIZE = 8
+RUN_WINDOW = 4096
+
+def offsetTables():
+    # Indexed by multiplexer output and primitive. The address is the
+    # output with its bits reversed, less one.
+    xs = numpy.zeros((16, 8), numpy.int64)
+    ys = numpy.zeros((16, 8), numpy.int64)
+    for output in range(16):
+        address = (((output & 1) << 3) | ((output & 2) << 1) |
+                   ((output & 4) >> 1) | ((output & 8) >> 3)) - 1
+        for primitive in range(8):
+            x, y = offset_for_nozzle(nozzle_from_primitive_address(primitive, address))
+            xs[output, primitive] = x
+            ys[output, primitive] = y
+    return xs, ys
+
+OFFSET_X, OFFSET_Y = offsetTables()
+
+def roundHalfAway(values):
+    '''numpy.round rounds halves to even, Python 2's round() away from zero.'''
+    whole = numpy.floor(numpy.abs(values))
+    whole += (numpy.abs(values) - whole) >= 0.5
+    return numpy.where(values < 0, -whole, whole).astype(numpy.int64)
+
+class HexEvents(object):
+    '''
+    The moves and firings of a hex file as arrays. Every event has the
+    offset in the file it comes from, which puts them back in order.
+    '''
+
+    def __init__(self):
+        self.moves = []
+        self.firings = []
+
+    def addMoves(self, at, axis, steps):
+        self.moves.append((at, axis, steps))
+
+    def addFirings(self, at, head, address, bitmask):
+        self.firings.append((at, head, address, bitmask))
+
+    def arrays(self, parts, dtypes):
+        if len(parts) == 0:
+            return [numpy.zeros(0, dtype) for dtype in dtypes]
+        return [numpy.concatenate([part[i] for part in parts]).astype(dtype)
+                for i, dtype in enumerate(dtypes)]
+
+    def finish(self):
+        self.moveAt, self.moveAxis, self.moveSteps = self.arrays(
+            self.moves, (numpy.int64, numpy.uint8, numpy.int64))
+        self.fireAt, self.head, self.address, self.bitmask = self.arrays(
+            self.firings, (numpy.int64, numpy.uint8, numpy.uint8, numpy.uint8))
+        # Each cartridge's firing comes from the same line or record.
+        order = numpy.lexsort((self.head, self.fireAt))
+        self.fireAt = self.fireAt[order]
+        self.head = self.head[order]
+        self.address = self.address[order]
+        self.bitmask = self.bitmask[order]
+        self.moves = None
+        self.firings = None
+        return self
+
+def parseText(events, data, base):
+    '''Adds the events in data, whole lines starting at offset base.'''
+    ends = numpy.flatnonzero(data == ord('\n'))
+    if len(data) > 0 and data[-1] != ord('\n'):
+        ends = numpy.append(ends, len(data))
+    if len(ends) == 0:
+        return
+    starts = numpy.concatenate(([0], ends[:-1] + 1))
+    lengths = ends - starts
+    firsts = data[numpy.minimum(starts, len(data) - 1)]
+
+    moves = numpy.flatnonzero((firsts == ord('M')) & (lengths > 4))
+    events.addMoves(base + starts[moves], data[starts[moves] + 2],
+                    parseInts(data, starts[moves] + 4, ends[moves]))
+
+    firings = numpy.flatnonzero((firsts == ord('F')) & (lengths >= 7))
+    at = starts[firings]
+    address = HEX[data[at + 2]]
+    events.addFirings(base + at, numpy.zeros(len(at), numpy.uint8), address,
+                      HEX[data[at + 3]] * 16 + HEX[data[at + 4]])
+    events.addFirings(base + at, numpy.ones(len(at), numpy.uint8), address,
+                      HEX[data[at + 5]] * 16 + HEX[data[at + 6]])
+
+def parseBinary(events, contents, data, start):
+    '''
+    Adds the events in a file with binary firings. contents is the file
+    and data the same bytes as an array. Firing records can contain any
+    byte, so the file is walked from record to record, but runs of
+    records are picked up a window at a time.
+    '''
+    size = len(data)
+    runs = []
+    pos = start
+    while pos < size:
+        c = contents[pos]
+        if c == '\x01':
+            window = data[pos:min(size - RECORD_SIZE + 1, pos + RECORD_SIZE * RUN_WINDOW):RECORD_SIZE]
+            others = numpy.flatnonzero((window != 1) | (data[pos + 4:pos + 4 + RECORD_SIZE * len(window):RECORD_SIZE] != 1))
+            count = others[0] if len(others) > 0 else len(window)
+            if count == 0:
+                raise ValueError('Invalid firing command at byte {}'.format(pos))
+            runs.append((pos, count))
+            pos = pos + count * RECORD_SIZE
+        elif c == 'M':
+            nl = contents.find('\n', pos)
+            if nl == -1:
+                nl = size
+            fields = contents[pos + 1:nl].split()
+            events.addMoves([pos], [ord(fields[0])], [int(fields[1])])
+            pos = nl + 1
+        elif c == '\n':
+            pos = pos + 1
+        else:
+            raise ValueError('Invalid hex file at byte {}'.format(pos))
+
+    if len(runs) == 0:
+        return
+    firsts, counts = numpy.array(runs, numpy.int64).T
+    offsets = numpy.cumsum(counts) - counts
+    at = (numpy.repeat(firsts - offsets * RECORD_SIZE, counts) +
+          numpy.arange(counts.sum()) * RECORD_SIZE)
+    for head in range(2):
+        record = at + head * 4
+        events.addFirings(at, numpy.zeros(len(at), numpy.uint8) + head,
+                          data[record + 2], data[record + 1])
+
+def readEvents(path):
+    with HexFile(path) as hexFile:
+        events = HexEvents()
+        data = numpy.frombuffer(hexFile.view(), numpy.uint8)
+        start = hexFile.start
+        if hexFile.data.find('\x01', start) != -1:
+            parseBinary(events, hexFile.data, data, start)
+        else:
+            while start < len(data):
+                end = hexFile.data.rfind('\n', start, start + CHUNK_SIZE) + 1
+                if end <= start:
+                    end = min(start + CHUNK_SIZE, len(data))
+                parseText(events, data[start:end], start)
+                start = end
+        del data
+    return events.finish()
+
+def track(steps, start=0.0, signed=True):
+    '''
+    The position on an axis after each of its moves, in pixels. A move of
+    zero steps goes home. Positions are summed one move at a time like
+    pixel.py did, so they round the same way.
+    '''
+    deltas = steps / SPN
+    if not signed:
+        deltas = numpy.abs(deltas)
+    positions = numpy.zeros(len(steps))
+    homes = numpy.flatnonzero(steps == 0)
+    bounds = numpy.concatenate(([0], homes, [len(steps)]))
+    for i in range(len(bounds) - 1):
+        first, end = bounds[i], bounds[i + 1]
+        origin = start
+        if i > 0:
+            # Home, at zero, and on from there.
+            origin = 0.0
+            first = first + 1
+        positions[first:end] = numpy.cumsum(numpy.concatenate(([origin], deltas[first:end])))[1:]
+    return positions
+
+class Simulation(object):
+    '''
+    The firings of a hex file with where the head was for each: x, y,
+    head, address and bitmask are arrays with an entry for every firing of
+    a cartridge.
+    '''
+
+    def __init__(self, path):
+        events = readEvents(path)
+        self.head = events.head
+        self.address = events.address
+        self.bitmask = events.bitmask
+        self.x = self.positions(events, 'X', 1)
+        self.y = self.positions(events, 'Y', -1)
+        self.width, self.height = self.size(events)
+        self.outside = 0
+
+    def positions(self, events, axis, sign):
+        # Firings before the first move, or on an axis that never moves,
+        # are at zero.
+        mine = events.moveAxis == ord(axis)
+        after = numpy.concatenate(([0.0], track(sign * events.moveSteps[mine])))
+        last = numpy.searchsorted(events.moveAt[mine], events.fireAt)
+        return after[last]
+
+    def size(self, events):
+        # Like pixel.py, the largest distance each axis has travelled
+        # since going home, starting 104 nozzles in.
+        maximums = []
+        for axis in 'XY':
+            steps = events.moveSteps[events.moveAxis == ord(axis)]
+            travelled = track(steps, 104 * SPN, False)
+            maximum = 104
+            if len(events.moveSteps) > 0:
+                maximum = max(maximum, 104 * SPN)
+            if len(travelled) > 0:
+                maximum = max(maximum, travelled.max())
+            maximums.append(maximum)
+        return (int(round(maximums[0]) + HEAD_OFFSET),
+                int(round(maximums[1] + 104 * SPN) + TEXT_HEIGHT))
+
+    def nozzles(self, head):
+        '''The pixels fired by one cartridge, as arrays of x and y.'''
+        mine = numpy.flatnonzero(self.head == head)
+        # Unpacked most significant bit first, so bit 7 - n is primitive n.
+        firing, bit = numpy.nonzero(numpy.unpackbits(self.bitmask[mine][:, None], axis=1))
+        firing = mine[firing]
+        primitive = 7 - bit
+        output = self.address[firing] & 15
+        xs = (OFFSET_X[output, primitive] + head * HEAD_OFFSET +
+              roundHalfAway(self.x[firing]))
+        ys = OFFSET_Y[output, primitive] + roundHalfAway(self.y[firing]) + TEXT_HEIGHT
+        # Negative positions wrap around, as they do with PIL pixel access.
+        inside = ((xs >= -self.width) & (xs < self.width) &
+                  (ys >= -self.height) & (ys < self.height))
+        self.outside += len(xs) - numpy.count_nonzero(inside)
+        return xs[inside] % self.width, ys[inside] % self.height
+
+    def render(self):
+        '''A (height, width, 4) RGBA array of the print.'''
+        self.outside = 0
+        pixels = numpy.zeros((self.height, self.width, 4), numpy.uint8)
+        pixels[:] = 255
+        first = numpy.zeros((self.height, self.width), bool)
+        second = numpy.zeros((self.height, self.width), bool)
+        xs, ys = self.nozzles(0)
+        first[ys, xs] = True
+        xs, ys = self.nozzles(1)
+        second[ys, xs] = True
+        # Red ink takes out green and blue, blue ink red and green.
+        pixels[:, :, 0][second] = 0
+        pixels[:, :, 1][first | second] = 0
+        pixels[:, :, 2][first] = 0
+        return pixels
+
+    def image(self):
+        return Image.fromarray(self.render(), 'RGBA')
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print("usage: simulator.py <hex file> <image file>")
+        sys.exit(1)
+    simulation = Simulation(sys.argv[1])
+    simulation.image().save(sys.argv[2])
+    if simulation.outside > 0:
+        print("{} nozzles fired outside the picture".format(simulation.outside))
@@ -0,0 +1,150 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+    Argentum Control GUI
+
+    Copyright (C) 2013 Isabella Stevens
+    Copyright (C) 2014 Michael Shiel
+    Copyright (C) 2015 Trent Waddington
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+# Compressing a job and hashing its blocks is the same work every time the
+# same hex file is sent, and a print sends every image once per pass. The
+# result is kept in memory and in a sidecar (see hexfile.sidecarPath),
+# keyed by the MD5 of the hex file so that any change to it invalidates the
+# sidecar. A sidecar that can't be read or written is skipped. It is:
+#
+#   magic | md5 (32 hex chars) | format version (byte) |
+#   requested version (byte) | stream size (uint32) | block count (uint32) |
+#   trailers | stream
+#
+# where every trailer is 5 bytes. A format version of 0 records that the
+# file couldn't be compressed in the requested format.
+
+import os
+import struct
+import hashlib
+import collections
+from hexfile import blockTrailers
+import hexfile
+
+MAGIC = 'ARGUPLD1'
+HEADER = struct.Struct('<32sBBII')
+TRAILER_SIZE = 5
+
+def sidecarPath(path, create=False):
+    return hexfile.sidecarPath(path, '.upload', create)
+
+class UploadArtifact(object):
+    def __init__(self, md5, version, requested, contents=None, trailers=None):
+        self.md5 = md5
+        self.version = version
+        self.requested = requested
+        self.contents = contents
+        if contents != None and trailers == None:
+            trailers = blockTrailers(contents)
+        self.trailers = trailers
+
+    def size(self):
+        if self.contents == None:
+            return 0
+        return len(self.contents)
+
+    def save(self, path):
+        contents = self.contents or ''
+        trailers = self.trailers or []
+        f = open(path, 'wb')
+        f.write(MAGIC)
+        f.write(HEADER.pack(self.md5, self.version, self.requested,
+                            len(contents), len(trailers)))
+        f.write(''.join(trailers))
+        f.write(contents)
+        f.close()
+
+    @classmethod
+    def load(cls, path):
+        f = open(path, 'rb')
+        try:
+            if f.read(len(MAGIC)) != MAGIC:
+                return None
+            header = f.read(HEADER.size)
+            if len(header) != HEADER.size:
+                return None
+            md5, version, requested, size, count = HEADER.unpack(header)
+            data = f.read(count * TRAILER_SIZE)
+            contents = f.read(size)
+            if len(data) != count * TRAILER_SIZE or len(contents) != size:
+                return None
+        finally:
+            f.close()
+        trailers = [data[i:i+TRAILER_SIZE] for i in range(0, len(data), TRAILER_SIZE)]
+        if version == 0:
+            return cls(md5, 0, requested)
+        return cls(md5, version, requested, contents, trailers)
+
+class UploadCache(object):
+    '''
+    compress is called as compress(contents, version) and returns the
+    compressed text, or None when the file can't be compressed.
+    '''
+
+    def __init__(self, compress, size=8, sidecars=True):
+        self.compress = compress
+        self.size = size
+        self.sidecars = sidecars
+        self.artifacts = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def artifact(self, path, contents, version):
+        md5 = hashlib.md5(contents).hexdigest()
+        key = (md5, version)
+        artifact = self.artifacts.pop(key, None)
+        if artifact == None and self.sidecars:
+            artifact = self.loadSidecar(path, md5, version)
+        if artifact == None:
+            self.misses += 1
+            # contents may be a buffer, compressing needs a string.
+            compressed = self.compress(str(contents), version)
+            if compressed == None:
+                artifact = UploadArtifact(md5, 0, version)
+            else:
+                artifact = UploadArtifact(md5, version, version, compressed)
+            if self.sidecars:
+                try:
+                    artifact.save(sidecarPath(path, create=True))
+                except (IOError, OSError):
+                    pass
+        else:
+            self.hits += 1
+        self.artifacts[key] = artifact
+        while len(self.artifacts) > self.size:
+            self.artifacts.popitem(last=False)
+        return artifact
+
+    def loadSidecar(self, path, md5, version):
+        try:
+            artifact = UploadArtifact.load(sidecarPath(path))
+        except (IOError, OSError, struct.error):
+            return None
+        if artifact == None or artifact.md5 != md5 or artifact.requested != version:
+            return None
+        return artifact
+
+    def clear(self):
+        self.artifacts.clear()
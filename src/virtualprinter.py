@@ -0,0 +1,580 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+    Argentum Control GUI
+
+    Copyright (C) 2013 Isabella Stevens
+    Copyright (C) 2014 Michael Shiel
+    Copyright (C) 2015 Trent Waddington
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+# A virtual Argentum that speaks the firmware's serial protocol over a
+# pseudo-terminal, so the real ArgentumPrinterController can connect,
+# upload and print without any hardware attached.
+#
+#   vp = VirtualPrinter(baudRate=115200)
+#   vp.start()
+#   printer = ArgentumPrinterController(vp.port)
+#   printer.connect()
+
+import os
+import sys
+import pty
+import tty
+import select
+import threading
+import time
+import random
+import hashlib
+from hexfile import calcDJB2
+from compression import order, DECOMPRESSORS, V2_FIRMWARE
+
+STEPS_PER_MM = 80
+BLOCK_SIZE = 1024
+
+class PrintStopped(Exception):
+    pass
+
+class PtyDevice(object):
+    '''
+    The printer end of a pseudo-terminal. The slave side (self.port) can be
+    opened with pyserial like a real printer. Opening the port is noticed
+    like the reset an Arduino does when the port is opened. On its own it
+    echoes everything back; subclasses override process() or run().
+
+    baudRate     emulate the transfer time of a serial link (None = as fast
+                 as possible)
+    latency      seconds to wait before each response
+    '''
+
+    def __init__(self, baudRate=None, latency=0.0):
+        self.baudRate = baudRate
+        self.latency = latency
+        self.master = None
+        self.port = None
+        self.thread = None
+        self.running = False
+        self.portOpen = False
+        self.inbuf = ''
+        self.resetStats()
+
+    def resetStats(self):
+        self.stats = {'bytesIn': 0,
+                      'bytesOut': 0}
+
+    def start(self):
+        self.master, slave = pty.openpty()
+        self.port = os.ttyname(slave)
+        tty.setraw(slave)
+        # Nobody has the port open until a controller connects.
+        os.close(slave)
+        self.running = True
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+        return self.port
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+        if self.master != None:
+            os.close(self.master)
+            self.master = None
+
+    def run(self):
+        while self.running:
+            self.readInput(0.05)
+            if self.portOpen and self.inbuf:
+                self.process()
+
+    def process(self):
+        # Subclasses answer what has arrived in inbuf. Left alone the device
+        # is a loopback plug and echoes it.
+        data = self.inbuf
+        self.inbuf = ''
+        self.write(data)
+
+    def debug(self, msg):
+        if os.environ.get('VP_DEBUG'):
+            sys.stderr.write('[vp] {}\n'.format(msg))
+
+    def throttle(self, n):
+        if self.baudRate:
+            # 8N1 framing, ten bits a byte.
+            time.sleep(n * 10.0 / self.baudRate)
+
+    def poll(self, timeout):
+        p = select.poll()
+        p.register(self.master, select.POLLIN)
+        events = p.poll(timeout * 1000)
+        if len(events) == 0:
+            if not self.portOpen:
+                self.portOpened()
+            return False
+        if events[0][1] & select.POLLHUP:
+            if self.portOpen:
+                self.portClosed()
+            time.sleep(timeout if timeout < 0.01 else 0.01)
+            return False
+        if not self.portOpen:
+            self.portOpened()
+        return True
+
+    def readInput(self, timeout):
+        if not self.poll(timeout):
+            return False
+        try:
+            data = os.read(self.master, 4096)
+        except OSError:
+            return False
+        self.throttle(len(data))
+        self.stats['bytesIn'] += len(data)
+        self.inbuf = self.inbuf + data
+        return True
+
+    def write(self, data):
+        if not self.portOpen:
+            return
+        if self.latency:
+            time.sleep(self.latency)
+        self.throttle(len(data))
+        self.stats['bytesOut'] += len(data)
+        try:
+            os.write(self.master, data)
+        except OSError:
+            pass
+
+    def portOpened(self):
+        self.debug('port opened')
+        self.portOpen = True
+        self.inbuf = ''
+
+    def portClosed(self):
+        self.debug('port closed')
+        self.portOpen = False
+
+class VirtualPrinter(PtyDevice):
+    '''
+    Emulates the Argentum firmware.
+
+    errorRate    probability that an uploaded block is reported as bad
+    timeScale    how much of the simulated motion time is actually spent
+                 (0 = instant, 1 = real time)
+    '''
+
+    version = '0.18.1+20151027'
+    printerNumber = 'VIRTUAL'
+    volts = 12.0
+    bootDelay = 0.1
+    xLimit = 230 * STEPS_PER_MM
+    yLimit = 150 * STEPS_PER_MM
+    capacity = None
+
+    def __init__(self, baudRate=None, latency=0.0, errorRate=0.0,
+                 timeScale=0.0, seed=None, version=None, printerNumber=None):
+        super(VirtualPrinter, self).__init__(baudRate, latency)
+        self.errorRate = errorRate
+        self.timeScale = timeScale
+        self.random = random.Random(seed)
+        if version:
+            self.version = version
+        if printerNumber:
+            self.printerNumber = printerNumber
+
+        self.files = {}
+        self.eeprom = {'horizontal_offset': 726,
+                       'vertical_offset': 0,
+                       'print_overlap': 41}
+        self.speed = {'X': 8000, 'Y': 8000}
+        self.accel = {'X': True, 'Y': True}
+
+        self.bannerDue = None
+        self.recvState = None
+        self.x = 0
+        self.y = 0
+        self.homed = False
+
+    def resetStats(self):
+        super(VirtualPrinter, self).resetStats()
+        self.stats.update({'blocksGood': 0,
+                           'blocksBad': 0,
+                           'commands': 0,
+                           'firings': 0,
+                           'travel': 0,
+                           'motionTime': 0.0})
+
+    def respond(self, lines):
+        self.write(''.join(line + '\n' for line in lines))
+
+    def portOpened(self):
+        # Opening the port resets an Arduino, so behave like a fresh boot.
+        super(VirtualPrinter, self).portOpened()
+        self.recvState = None
+        self.homed = False
+        self.bannerDue = time.time() + self.bootDelay
+
+    def portClosed(self):
+        super(VirtualPrinter, self).portClosed()
+        self.bannerDue = None
+
+    def sendBanner(self):
+        self.bannerDue = None
+        self.respond(['+Printer Number [{}]'.format(self.printerNumber),
+                      '+Version [{}]'.format(self.version)])
+
+    ### Main loop
+
+    def run(self):
+        while self.running:
+            timeout = 0.05
+            if self.bannerDue:
+                timeout = max(0, min(timeout, self.bannerDue - time.time()))
+            self.readInput(timeout)
+            if self.bannerDue and time.time() >= self.bannerDue:
+                self.sendBanner()
+            if not self.portOpen or self.bannerDue:
+                continue
+            try:
+                self.process()
+            except PrintStopped:
+                self.respond(['+Stopping'])
+
+    def process(self):
+        while self.running:
+            if self.recvState:
+                if not self.receiveBlock():
+                    return
+                continue
+            nl = self.inbuf.find('\n')
+            if nl == -1:
+                return
+            line = self.inbuf[:nl].rstrip('\r')
+            self.inbuf = self.inbuf[nl+1:]
+            self.stats['commands'] += 1
+            self.handleCommand(line)
+
+    ### Commands
+
+    def handleCommand(self, line):
+        self.debug('command: ' + repr(line))
+        args = line.split()
+        if len(args) == 0:
+            return
+        cmd = args[0]
+
+        if cmd == 'recv':
+            self.startRecv(args)
+        elif cmd == 'ls':
+            self.respond(['+' + name for name in sorted(self.files)])
+        elif cmd == 'djb2' or cmd == 'md5':
+            name = line[len(cmd):].strip()
+            contents = self.findFile(name)
+            if contents == None:
+                self.respond(['+No such file: ' + name])
+            elif cmd == 'djb2':
+                self.respond(['{:08x}'.format(calcDJB2(contents))])
+            else:
+                self.respond([hashlib.md5(contents).hexdigest()])
+        elif cmd == 'rm':
+            name = line[2:].strip()
+            for key in list(self.files):
+                if key.lower() == name.lower():
+                    del self.files[key]
+        elif cmd == 'pos':
+            self.respond(['+X: {:.2f} mm, Y: {:.2f} mm'.format(
+                              float(self.x) / STEPS_PER_MM,
+                              float(self.y) / STEPS_PER_MM),
+                          '+X: {} steps, Y: {} steps'.format(self.x, self.y)])
+        elif cmd == 'volt':
+            self.respond(['+Voltage: {:.2f} volts.'.format(self.volts)])
+        elif cmd == '?eeprom':
+            self.respond(['+EEPROM',
+                          'horizontal_offset: {}'.format(self.eeprom['horizontal_offset']),
+                          'vertical_offset: {}'.format(self.eeprom['vertical_offset']),
+                          'print_overlap: {}'.format(self.eeprom['print_overlap']),
+                          '+CRC: [valid]'])
+        elif cmd == '!write' and len(args) == 5 and args[1] == 'po':
+            self.eeprom['horizontal_offset'] = int(args[2])
+            self.eeprom['vertical_offset'] = int(args[3])
+            self.eeprom['print_overlap'] = int(args[4])
+            self.respond(['+Written.'])
+        elif cmd == 'pnum':
+            if len(args) > 1:
+                self.printerNumber = args[1]
+            self.respond(['+Printer Number [{}]'.format(self.printerNumber)])
+        elif cmd == 'lim':
+            limits = '+Limits: '
+            if self.x == 0:
+                limits = limits + 'X- '
+            if self.y == 0:
+                limits = limits + 'Y- '
+            self.respond([limits])
+        elif cmd == 'home':
+            self.moveTo(0, 0)
+            self.homed = True
+            self.respond(['+Homed'])
+        elif cmd == 'M':
+            self.moveCommand(args)
+        elif cmd == 'p':
+            if len(args) > 1:
+                self.printFile(line[1:].strip())
+        elif cmd == 'l':
+            self.respond(['+Done rollers ' + ' '.join(args[1:])])
+        elif cmd == 's' and len(args) == 3:
+            self.speed[args[1]] = int(args[2])
+        elif cmd == 'a' and len(args) == 3:
+            self.accel[args[1]] = args[2] == 'on'
+        elif cmd in ('pwm', '+', '-', '++', '--', 'c', 'S', 'P', 'R', 'echo'):
+            pass
+        else:
+            self.respond(['+Unknown command: ' + line])
+
+    def findFile(self, name):
+        for key in self.files:
+            if key.lower() == name.lower():
+                return self.files[key]
+        return None
+
+    def moveCommand(self, args):
+        if len(args) >= 3 and (args[1] == 'X' or args[1] == 'Y'):
+            steps = int(args[2])
+            if args[1] == 'X':
+                self.moveTo(self.x + steps, self.y)
+            else:
+                self.moveTo(self.x, self.y + steps)
+            return
+        if len(args) >= 3:
+            x = int(args[1])
+            y = int(args[2])
+            withOk = len(args) > 3 and args[3] == 'k'
+            if x < 0 or x > self.xLimit or y < 0 or y > self.yLimit:
+                # Hosts only rely on the slashes, see CommandFuture.error.
+                lines = ['+Out of limits {}/{} {}/{}'.format(x, self.xLimit, y, self.yLimit)]
+            else:
+                self.moveTo(x, y)
+                lines = []
+            if withOk:
+                lines.append('Ok')
+            if len(lines) > 0:
+                self.respond(lines)
+
+    def moveTo(self, x, y):
+        dx = abs(x - self.x)
+        dy = abs(y - self.y)
+        # Both axes move at once, the slower one decides.
+        t = max(float(dx) / self.speed['X'], float(dy) / self.speed['Y'])
+        self.stats['travel'] += dx + dy
+        self.stats['motionTime'] += t
+        if self.timeScale and t > 0:
+            time.sleep(t * self.timeScale)
+        self.x = x
+        self.y = y
+
+    ### Executing jobs
+
+    def checkControl(self):
+        # Look for stop/pause commands while busy.
+        self.readInput(0)
+        while True:
+            nl = self.inbuf.find('\n')
+            if nl == -1:
+                return
+            line = self.inbuf[:nl].rstrip('\r')
+            if line == 'S':
+                self.inbuf = ''
+                raise PrintStopped()
+            if line == 'P':
+                self.inbuf = self.inbuf[nl+1:]
+                while self.running and self.portOpen:
+                    self.readInput(0.05)
+                    if self.inbuf.find('R\n') != -1:
+                        self.inbuf = self.inbuf[self.inbuf.find('R\n')+2:]
+                        break
+                    if self.inbuf.find('S\n') != -1:
+                        self.inbuf = ''
+                        raise PrintStopped()
+                continue
+            return
+
+    def execute(self, line, progress=False):
+        if len(line) < 3:
+            return
+        if line[0] == 'F':
+            self.stats['firings'] += 1
+        elif line[0] == 'M':
+            steps = int(line[4:])
+            if line[2] == 'X':
+                self.moveTo(self.x + steps, self.y)
+                if progress:
+                    self.respond(['.'])
+            else:
+                self.moveTo(self.x, self.y + steps)
+
+    def printFile(self, name):
+        contents = self.findFile(name)
+        if contents == None:
+            self.respond(['+No such file: ' + name])
+            return
+        self.respond(['+Printing ' + name])
+        n = 0
+        for line in contents.split('\n'):
+            self.execute(line, progress=True)
+            n = n + 1
+            if n % 64 == 0:
+                self.checkControl()
+        self.respond(['+Print complete'])
+
+    ### Uploads
+
+    def startRecv(self, args):
+        if len(args) < 3:
+            self.respond(['Errorecv: usage recv <size> [b|o|bo] <filename>'])
+            return
+        try:
+            size = int(args[1])
+        except ValueError:
+            self.respond(['Errorecv: bad size'])
+            return
+        flags = ''
+        if len(args) > 3:
+            flags = args[2]
+        name = args[-1]
+        if not self.acceptsFlags(flags):
+            self.respond(['Errorecv: unsupported mode ' + flags])
+            return
+        online = flags.find('o') != -1
+        if not online and self.capacity != None:
+            used = sum(len(c) for c in self.files.values())
+            if used + size > self.capacity:
+                self.respond(['Errorecv: not enough space'])
+                return
+        self.recvState = {'name': name,
+                          'size': size,
+                          'pos': 0,
+                          'hash': 5381,
+                          'online': online,
+                          'decoder': self.decoderFor(flags),
+                          'contents': [],
+                          'pending': ''}
+        self.respond(['Ready'])
+
+    def acceptsFlags(self, flags):
+        accepted = 'bo'
+        if self.formatVersion() >= 2:
+            accepted += '2'
+        for f in flags:
+            if f not in accepted:
+                return False
+        return True
+
+    def formatVersion(self):
+        major, minor = self.version.split('.')[:2]
+        if (int(major), int(minor)) >= V2_FIRMWARE:
+            return 2
+        return 1
+
+    def decoderFor(self, flags):
+        if flags.find('2') != -1:
+            return DECOMPRESSORS[2]()
+        if flags.find('b') != -1:
+            return DECOMPRESSORS[1]()
+        return None
+
+    def receiveBlock(self):
+        state = self.recvState
+        nleft = state['size'] - state['pos']
+        blocksize = nleft if nleft < BLOCK_SIZE else BLOCK_SIZE
+
+        if len(self.inbuf) == 1 and self.inbuf in ('C', 'P'):
+            # A lone byte at a block boundary is a control byte, unless more
+            # of the block turns up shortly.
+            self.readInput(0.05)
+            if len(self.inbuf) == 1:
+                c = self.inbuf
+                self.inbuf = ''
+                if c == 'C':
+                    self.debug('recv canceled')
+                    self.recvState = None
+                else:
+                    self.write('p')
+                return True
+
+        if len(self.inbuf) < blocksize + 5:
+            return False
+
+        block = self.inbuf[:blocksize]
+        trailer = self.inbuf[blocksize:blocksize+5]
+        self.inbuf = self.inbuf[blocksize+5:]
+
+        hash = calcDJB2(block, state['hash'])
+        expected = ''.join([chr( hash        & 0x7f),
+                            chr((hash >>  7) & 0x7f),
+                            chr((hash >> 14) & 0x7f),
+                            chr((hash >> 21) & 0x7f),
+                            chr((hash >> 28) & 0x0f)])
+        if trailer != expected or self.random.random() < self.errorRate:
+            self.stats['blocksBad'] += 1
+            # Whatever else is in the buffer is garbage now.
+            self.inbuf = ''
+            self.write('B')
+            return True
+
+        state['hash'] = hash
+        state['pos'] = state['pos'] + blocksize
+        self.stats['blocksGood'] += 1
+
+        data = block
+        if state['decoder']:
+            data = state['decoder'].feed(data)
+            if state['pos'] == state['size']:
+                data = data + state['decoder'].finish()
+        if state['online']:
+            self.runOnline(state, data)
+        else:
+            state['contents'].append(data)
+
+        if state['pos'] == state['size']:
+            self.recvState = None
+            if not state['online']:
+                self.files[state['name']] = ''.join(state['contents'])
+        self.write('G')
+        return True
+
+    def runOnline(self, state, data):
+        lines = (state['pending'] + data).split('\n')
+        state['pending'] = lines.pop()
+        if state['pos'] == state['size']:
+            lines.append(state['pending'])
+        for line in lines:
+            self.execute(line)
+
+if __name__ == '__main__':
+    baudRate = None
+    if len(sys.argv) > 1:
+        baudRate = int(sys.argv[1])
+    vp = VirtualPrinter(baudRate=baudRate)
+    vp.start()
+    print('Virtual printer listening on {}'.format(vp.port))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    vp.stop()